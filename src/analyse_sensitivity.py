@@ -1,8 +1,18 @@
 """Parameter Sensitivity Analysis for Contact Tracing Model
 Sample pairs of (parameters, output summary) must be generated by draw_parameters.py in advance.
+Hyperparameter searches and fits of all metrics are scheduled on one pool of --n-jobs processes.
+By default, hyperparameters are searched by successive halving: every candidate is scored on a small subset of
+the training samples, and only the best 1/eta of them go on to an eta-times larger subset, up to the full set.
+The final 100-tree forest is grown by warm start from the winning 50-tree forest of the search.
+SHAP values are computed in chunks of rows on the same pool, and cached in <metric>.shap.npz next to the model.
+The PDF reports are drawn from that cache page by page on the pool, and can be drawn again by render_report.py.
+With --sobol-samples, first-order and total-effect Sobol indices of every metric are estimated on the meta model
+over the empirical distribution of each parameter, and written into sobol_indices.csv with bootstrap confidence intervals.
+With --incremental, the samples added since the last run grow the saved meta models by new trees, instead of
+searching and fitting from scratch, and only the SHAP values of the new trees and of the new samples are computed.
 
 Usage:
-  analyse_sensitivity.py <WORK_DIR> [--seed=<seed>] [--n_jobs=<njobs>]
+  analyse_sensitivity.py <WORK_DIR> [--seed=<seed>] [--n-jobs=<njobs>] [--multi-output] [--search=<method>] [--halving-eta=<eta>] [--shap-max-rows=<rows>] [--report=<mode>] [--sobol-samples=<n>] [--sobol-bootstrap=<n>] [--sobol-memory=<mb>] [--incremental] [--drift-threshold=<ratio>] [--max-trees=<n>] [--metric=<metric>...]
   analyse_sensitivity.py (-h | --help)
   analyse_sensitivity.py --version
 
@@ -10,22 +20,335 @@ Options:
   -h --help                       Show this screen.
   --version                       Show version.
   --seed=<seed>                   Random seed [default: 1234].
-  --n-jobs=<njobs>               Number of threads in fitting a meta model [default: 1].
+  --n-jobs=<njobs>                Number of processes shared by the fitting of all meta models [default: 1].
+  --multi-output                  Fit one meta model of all metrics into multi_output.model, instead of one model per metric.
+  --search=<method>               Hyperparameter search, either halving or grid (every candidate on all samples) [default: halving].
+  --halving-eta=<eta>             Reduction factor of candidates per round of successive halving [default: 3].
+  --shap-max-rows=<rows>          Number of test samples explained by SHAP, drawn across the quantiles of the metric.
+                                  All test samples are explained when 0 [default: 0].
+  --report=<mode>                 PDF reports, either full, fast (binned or subsampled scatters as render_report.py --fast),
+                                  or none [default: full].
+  --sobol-samples=<n>             Number of base samples of the Sobol indices, each taking the predictions of
+                                  the number of parameter groups plus two inputs. No indices when 0 [default: 0].
+  --sobol-bootstrap=<n>           Number of Poisson bootstrap replicates for the 95% intervals of the Sobol indices [default: 100].
+  --sobol-memory=<mb>             Memory in MB of the inputs and predictions of one chunk of the Sobol samples [default: 256].
+  --incremental                   Update the meta models saved by the last incremental run with the samples added since.
+                                  The test half is chosen by a hash of the sample ID, which differs from the default split.
+  --drift-threshold=<ratio>       A model is refitted from scratch when its MSE on the added samples exceeds this ratio
+                                  to its MSE on the test samples seen before [default: 1.5].
+  --max-trees=<n>                 A model is refitted from scratch when growing it would exceed this number of trees [default: 300].
+  --metric=<metric>               Metric to be analysed, which can be repeated. Importances and Sobol indices are then
+                                  written per metric into <metric>.importance.csv and <metric>.sobol_indices.csv,
+                                  so that runs of different metrics can share WORK_DIR. All metrics by default.
   
 """
 
 import numpy as np
 import pandas as pd
+import copy
 import os
+import sys
 from docopt import docopt
+from os.path import dirname, realpath
 from sklearn.ensemble import ExtraTreesRegressor
 from sklearn.model_selection import train_test_split
 from six.moves import cPickle as pickle
 import shap
 import itertools
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.metrics import mean_squared_error
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')
+sys.path.append(dirname(realpath(__file__)))
+from uk.co.ramp.param.forest import save_forest
+from uk.co.ramp.param.incremental import IncrementalState, hashed_test_mask
+from uk.co.ramp.param.metamodel import (
+    MultiOutputForest, SuccessiveHalving, grow_forest, load_shap, per_output_importances, save_shap, stratified_rows,
+    subset_rows)
+from uk.co.ramp.param.report import submit_report, write_report
+from uk.co.ramp.exec.budget import ThreadBudget
+from uk.co.ramp.gencfg.disease import DiseaseSettings
+from uk.co.ramp.gencfg.population import PopulationSettings
+from uk.co.ramp.param.sobol import add_sums, chunk_rows, chunk_sums, evaluate_chunk, factor_groups, indices_table
+from uk.co.ramp.param.store import SampleStore, finite_samples
+
+_data = {}
+
+# Columns drawn from each other by the samplers, which the Sobol indices resample together
+joint_columns = DiseaseSettings.joint_columns() + PopulationSettings.joint_columns()
+
+
+def init_worker(workdir, seed, incremental=False):
+    """
+    Read the samples once per worker process.
+    """
+    store = SampleStore(workdir)
+    _data['workdir'] = workdir
+    _data['seed'] = seed
+    _data['incremental'] = incremental
+    _data['X'], _data['Y'], _ = finite_samples(store.read('input_parameter_samples'), store.read('output_loss_samples'))
+    _data['splits'] = {}
+    _data['models'] = {}
+    _data['explainers'] = {}
+
+
+def split(metric):
+    """
+    Train-test split of X and the metric, or of X and all metrics when metric is None.
+    The rows are the same for every metric.
+    """
+    if metric not in _data['splits']:
+        X = _data['X']
+        Y = _data['Y'] if metric is None else _data['Y'][metric]
+        if _data['incremental']:
+            test = hashed_test_mask(X.index, _data['seed'])
+            _data['splits'][metric] = [X[~test], X[test], Y[~test], Y[test]]
+        else:
+            _data['splits'][metric] = train_test_split(X, Y, test_size=0.5, random_state=_data['seed'])
+    return _data['splits'][metric]
+
+
+def standardised_split():
+    X_train, X_test, Y_train, Y_test = split(None)
+    offset, scale = MultiOutputForest.standardise(Y_train)
+    return X_train, X_test, (Y_train - offset) / scale, Y_test, offset, scale
+
+
+def hyperparameter_grid(n_train):
+    ms_list = np.unique(np.round(np.logspace(np.log10(2.0), np.log10(np.min([1000, n_train / 2])), 10)).astype(int))
+    return list(itertools.product(ms_list, [int(1), 0.33, 1.0]))
+
+
+def oob_mse(metric, ms, mf, n_rows, keep_model):
+    """
+    Out-of-bag MSE of one hyperparameter point fitted on the first n_rows of a seeded permutation
+    of the training samples, by a single thread.
+    min_samples_split is scaled down with the subset, so that it regularises the trees alike on every subset.
+    When metric is None, the MSE is summed over all standardised metrics.
+    Returns the MSE and, if keep_model, the fitted 50-tree forest.
+    """
+    if metric is None:
+        X_train, _, y_train, _, _, _ = standardised_split()
+    else:
+        X_train, _, y_train, _ = split(metric)
+    if n_rows < X_train.shape[0]:
+        rows = subset_rows(X_train.shape[0], n_rows, _data['seed'])
+        ms = max(2, int(np.round(ms * n_rows / X_train.shape[0])))
+        X_train = X_train.iloc[rows]
+        y_train = y_train.iloc[rows]
+    tmodel = ExtraTreesRegressor(
+        n_estimators=50,
+        criterion='squared_error',
+        max_depth=None,
+        bootstrap=True,
+        oob_score=True,
+        min_samples_split=ms,
+        max_features=mf,
+        n_jobs=1,
+        random_state=_data['seed']).fit(X_train, y_train)
+    mse = mean_squared_error(y_true=y_train, y_pred=tmodel.oob_prediction_)
+    return mse, (tmodel if keep_model else None)
+
+
+def final_forest(model, best_ms, best_mf, n_threads, X_train, y_train):
+    """
+    Grow the 50-tree forest of the search into 100 trees, or fit 100 trees when the search kept no model.
+    Either way the trees are the same, and memory-consuming oob_prediction_ is not kept.
+    """
+    if model is not None:
+        return grow_forest(model, 100, n_threads, X_train, y_train)
+    return ExtraTreesRegressor(
+        n_estimators=100,
+        criterion='squared_error',
+        max_depth=None,
+        bootstrap=True,
+        oob_score=False,
+        min_samples_split=best_ms,
+        max_features=best_mf,
+        n_jobs=n_threads,
+        random_state=_data['seed']).fit(X_train, y_train)
+
+
+def model_name(task):
+    return 'multi_output' if task is None else task
+
+
+def fit_metric(metric, model, best_ms, best_mf, n_threads, shap_max_rows):
+    """
+    Fit the meta model of the chosen hyperparameter, and save the model.
+    Returns the normalised feature importances, the positions of the test rows to be explained by SHAP,
+    and the index and predictions of the test half.
+    """
+    workdir = _data['workdir']
+    X_train, X_test, y_train, y_test = split(metric)
+
+    model = final_forest(model, best_ms, best_mf, n_threads, X_train, y_train)
+    
+    fimp = model.feature_importances_
+    fimp /= fimp.sum()
+    
+    with open('{}/{}.model'.format(workdir, metric), 'wb') as fout:
+        pickle.dump(model, fout)
+    save_forest('{}/{}.forest'.format(workdir, metric), model, X_train.columns)
+
+    rows = stratified_rows(y_test, shap_max_rows, _data['seed'])
+    return fimp, rows, X_test.index.values, model.predict(X_test)
+
+
+def load_model(task):
+    """
+    Saved meta model, read once per worker process.
+    It predicts by one thread, whatever number of threads it was fitted by, since the jobs that use it are single-threaded.
+    """
+    if task not in _data['models']:
+        with open('{}/{}.model'.format(_data['workdir'], model_name(task)), 'rb') as fin:
+            model = pickle.load(fin)
+        (model if task is not None else model.forest).set_params(n_jobs=1)
+        _data['models'][task] = model
+    return _data['models'][task]
+
+
+def shap_chunk(task, rows, first_tree=0):
+    """
+    Approximate SHAP values of the test rows at the positions rows, by the trees of the meta model from first_tree on.
+    For the multi-output model, returns a list of the SHAP values of every metric in the original unit.
+    """
+    model = load_model(task)
+    if (task, first_tree) not in _data['explainers']:
+        forest = model if task is not None else model.forest
+        if first_tree > 0:
+            forest = copy.copy(forest)
+            forest.estimators_ = forest.estimators_[first_tree:]
+            forest.n_estimators = len(forest.estimators_)
+        _data['explainers'][(task, first_tree)] = shap.TreeExplainer(forest)
+    explainer = _data['explainers'][(task, first_tree)]
+    X_test = split(task)[1]
+    shap_values = explainer.shap_values(X_test.iloc[rows], approximate=True)
+    if task is None:
+        # shap>=0.45 returns one array of shape (rows, features, outputs) instead of a list of arrays per output
+        if isinstance(shap_values, np.ndarray) and shap_values.ndim == 3:
+            shap_values = list(np.moveaxis(shap_values, -1, 0))
+        if len(shap_values) != len(model.scale):
+            raise ValueError('SHAP values of {} outputs for a model of {} outputs'.format(len(shap_values), len(model.scale)))
+        return [values * scale for values, scale in zip(shap_values, model.scale)]
+    return shap_values
+
+
+def sobol_chunk(task, n_rows, chunk, n_bootstrap):
+    """
+    Weighted sums of the estimators of the Sobol indices and of their n_bootstrap replicates over the predictions
+    of the meta model on one chunk of the Saltelli design, whose draws are seeded by the chunk number.
+    Only the sums are returned to the main process, whose memory does not grow with the number of chunks.
+    """
+    model = load_model(task)
+    if 'groups' not in _data:
+        _data['groups'] = factor_groups(_data['X'].values, list(_data['X'].columns), joint_columns)
+    predict = model.predict if task is None else (lambda X: model.predict(X).reshape(-1, 1))
+    random_state = np.random.RandomState(_data['seed'] + chunk)
+    f = evaluate_chunk(predict, _data['X'].values, list(_data['X'].columns), _data['groups'], n_rows, random_state)
+    return chunk_sums(f, n_bootstrap, random_state)
+
+
+def stack_shap(results, j, task, n_columns):
+    """
+    SHAP values of the metric j stacked over the results of shap_chunk.
+    """
+    if len(results) == 0:
+        return np.zeros((0, n_columns))
+    return np.vstack([result[j] for result in results]) if task is None else np.vstack(results)
+
+
+def update_task(task, n_threads, shap_max_rows, drift_threshold, max_trees):
+    """
+    Grow the saved meta model by warm start with trees on all training samples, whose number is proportional to
+    the share of the training samples added since the last incremental run, and save the model.
+    The cached SHAP values keep their rows, and the new test samples are explained in proportion to --shap-max-rows.
+    Returns a pair of the update and None, or of None and the reason when the model must be searched and fitted
+    from scratch instead, because of drift, too many trees, or missing SHAP caches. The update is the normalised
+    feature importances, the positions in the test half of the cached and the new rows to be explained,
+    the index and predictions of the test half, and the numbers of trees before and after growing.
+    """
+    workdir = _data['workdir']
+    state = IncrementalState(workdir, _data['seed'])
+    model = load_model(task)
+    X_train, X_test, y_train, y_test = split(task)
+    if task is None:
+        forest = model.forest
+        y_train = (y_train - model.offset) / model.scale
+        y_test = (y_test - model.offset) / model.scale
+        predict = forest.predict
+    else:
+        forest = model
+        predict = model.predict
+    new_train = ~X_train.index.isin(state.seen)
+    new_test = ~X_test.index.isin(state.seen)
+
+    # Data drift is measured by the errors of the model on the samples it has not seen
+    if new_train.any() or new_test.any():
+        mse_seen = mean_squared_error(y_test[~new_test], predict(X_test[~new_test]))
+        X_new = pd.concat([X_train[new_train], X_test[new_test]])
+        y_new = pd.concat([y_train[new_train], y_test[new_test]])
+        mse_new = mean_squared_error(y_new, predict(X_new))
+        if mse_new > drift_threshold * mse_seen:
+            del _data['models'][task]
+            return None, 'MSE {} on the added samples against {} before'.format(mse_new, mse_seen)
+
+    n_old = len(forest.estimators_)
+    n_total = n_old + int(np.ceil(100.0 * new_train.sum() / X_train.shape[0]))
+    caches = ['{}/{}.shap.npz'.format(workdir, metric) for metric in (model.output_names if task is None else [task])]
+    if n_total > max_trees:
+        del _data['models'][task]
+        return None, '{} trees would exceed --max-trees={}'.format(n_total, max_trees)
+    if not all(os.path.exists(cache) for cache in caches):
+        del _data['models'][task]
+        return None, 'SHAP caches are missing'
+    old_rows = X_test.index.get_indexer(load_shap(caches[0])['index'])
+    if (old_rows < 0).any():
+        del _data['models'][task]
+        return None, 'SHAP caches have rows out of the test half'
+
+    if n_total > n_old:
+        grow_forest(forest, n_total, n_threads, X_train, y_train)
+        with open('{}/{}.model'.format(workdir, model_name(task)), 'wb') as fout:
+            pickle.dump(model, fout)
+        save_forest('{}/{}.forest'.format(workdir, model_name(task)), model, X_train.columns)
+
+    if task is None:
+        fimp = per_output_importances(forest, X_train, y_train)
+        strata = y_test.values.sum(axis=1)
+    else:
+        fimp = forest.feature_importances_
+        fimp /= fimp.sum()
+        strata = y_test.values
+    new_rows = np.where(new_test)[0]
+    if shap_max_rows > 0:
+        quota = int(np.round(shap_max_rows * len(new_rows) / float(X_test.shape[0])))
+        new_rows = new_rows[stratified_rows(strata[new_rows], quota, _data['seed'])] if quota > 0 else new_rows[:0]
+    return (fimp, old_rows, new_rows, X_test.index.values, model.predict(X_test), n_old, n_total), None
+
+
+def fit_multi_output(forest, best_ms, best_mf, n_threads, shap_max_rows):
+    """
+    Fit one meta model of all metrics, and save the model.
+    Returns the normalised feature importances of shape (n_features, n_metrics), the positions of the test rows
+    to be explained by SHAP, and the index and predictions of shape (n_test, n_metrics) of the test half.
+    """
+    workdir = _data['workdir']
+    X_train, X_test, Y_train, Y_test, offset, scale = standardised_split()
+
+    forest = final_forest(forest, best_ms, best_mf, n_threads, X_train, Y_train)
+    model = MultiOutputForest(forest, Y_train.columns, offset, scale)
+    
+    fimp = per_output_importances(forest, X_train, Y_train)
+    
+    with open('{}/multi_output.model'.format(workdir), 'wb') as fout:
+        pickle.dump(model, fout)
+    save_forest('{}/multi_output.forest'.format(workdir), model, X_train.columns)
+
+    # The subsample is stratified by the sum of the standardised metrics
+    rows = stratified_rows((Y_test.values - offset).dot(1.0 / scale), shap_max_rows, _data['seed'])
+    return fimp, rows, X_test.index.values, model.predict(X_test)
+
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='0.0.1')
@@ -36,84 +359,195 @@ if __name__ == '__main__':
     workdir = _getopt('<WORK_DIR>', None)
     seed = int(_getopt('--seed', 1234))
     n_jobs = int(_getopt('--n-jobs', 1))
+    multi_output = _getopt('--multi-output', False)
+    search = _getopt('--search', 'halving')
+    eta = int(_getopt('--halving-eta', 3))
+    shap_max_rows = int(_getopt('--shap-max-rows', 0))
+    report = _getopt('--report', 'full')
+    sobol_samples = int(_getopt('--sobol-samples', 0))
+    sobol_bootstrap = int(_getopt('--sobol-bootstrap', 100))
+    sobol_memory = float(_getopt('--sobol-memory', 256))
+    incremental = _getopt('--incremental', False)
+    drift_threshold = float(_getopt('--drift-threshold', 1.5))
+    max_trees = int(_getopt('--max-trees', 300))
+    selected_metrics = _getopt('--metric', [])
+    if report not in ['full', 'fast', 'none']:
+        raise ValueError('--report must be one of full, fast or none')
+    if search not in ['halving', 'grid']:
+        raise ValueError('--search must be either halving or grid')
 
-    X = pd.read_csv('{}/input_parameter_samples.csv'.format(workdir), index_col=0)
-    Y = pd.read_csv('{}/output_loss_samples.csv'.format(workdir), index_col=0)
+    store = SampleStore(workdir)
+    X_columns = store.columns('input_parameter_samples')
+    metrics = store.columns('output_loss_samples')
+    if len(selected_metrics) > 0:
+        if multi_output or incremental:
+            raise ValueError('--metric cannot be combined with --multi-output or --incremental')
+        missing = [metric for metric in selected_metrics if metric not in metrics]
+        if len(missing) > 0:
+            raise ValueError('Metrics {} are not in output_loss_samples'.format(missing))
+        metrics = [metric for metric in metrics if metric in selected_metrics]
+    X_all, _, dropped = finite_samples(store.read('input_parameter_samples'), store.read('output_loss_samples'))
+    if len(dropped) > 0:
+        print('{} samples without finite losses are left out, such as {}'.format(len(dropped), list(dropped[:5])))
+    n_train = X_all.shape[0] - int(np.ceil(0.5 * X_all.shape[0]))
+    if incremental:
+        X_index = X_all.index.astype(str)
+        n_train = int((~hashed_test_mask(X_index, seed)).sum())
+        state = IncrementalState(workdir, seed)
+    grid = hyperparameter_grid(n_train)
+    # A fit or update of one metric takes up to its share of the cores, out of the threads that are free when it starts
+    n_threads = n_jobs if multi_output else max(1, n_jobs // len(metrics))
     
-    imp = []
-    for metric in Y.columns:
-        X_train, X_test, y_train, y_test = train_test_split(X, Y[metric], test_size=0.5, random_state=seed)
-        n_train = X_train.shape[0]
-        ms_list = np.unique(np.round(np.logspace(np.log10(2.0), np.log10(np.min([1000, n_train / 2])), 10)).astype(int))
-        
-        # Fast search of hyperparameters of minimal out-of-bag MSE
-        min_mse = np.inf
-        best_ms = 1
-        best_mf = 1.0
-        for ms, mf in itertools.product(ms_list, [int(1), 0.33, 1.0]):
-            tmodel = ExtraTreesRegressor(
-                n_estimators=50,
-                criterion='mse',
-                max_depth=None,
-                bootstrap=True,
-                oob_score=True,
-                min_samples_split=ms,
-                max_features=mf,
-                n_jobs=n_jobs,
-                random_state=seed).fit(X_train, y_train)
-            mse = mean_squared_error(y_true=y_train, y_pred=tmodel.oob_prediction_)
-            if mse < min_mse:
-                min_mse = mse
-                best_ms = ms
-                best_mf = mf
-
-        # Fit extra trees of the best hyperparameter, without generating memory-consuming oob_prediction_
-        model = ExtraTreesRegressor(
-            n_estimators=100,
-            criterion='mse',
-            max_depth=None,
-            bootstrap=True,
-            oob_score=False,
-            min_samples_split=best_ms,
-            max_features=best_mf,
-            n_jobs=n_jobs,
-            random_state=seed).fit(X_train, y_train)
-        
-        fimp = model.feature_importances_
-        fimp /= fimp.sum()
-        imp.append(fimp.reshape(-1, 1))
+    # The multi-output mode runs the same search with one task name None for all metrics
+    tasks = [None] if multi_output else metrics
+    # A grid search is successive halving whose first round is already on all samples
+    searches = {task: SuccessiveHalving(grid, n_train, eta=eta, min_rows=n_train if search == 'grid' else 100) for task in tasks}
+
+    if sobol_samples > 0:
+        # Columns identical in every sample or dependent on each other are one factor of the Sobol indices
+        groups = factor_groups(X_all.values, X_columns, joint_columns)
+        n_outputs = len(metrics) if multi_output else 1
+        sobol_chunks = np.diff(np.append(
+            np.arange(0, sobol_samples, chunk_rows(len(groups), len(X_columns), n_outputs, sobol_memory * (1 << 20))),
+            sobol_samples))
+        sobol_tables = {}
     
-        explainer = shap.TreeExplainer(model)
-        shap_values = explainer.shap_values(X_test, approximate=True)
-        
-        with open('{}/{}.model'.format(workdir, metric), 'wb') as fout:
-            pickle.dump(model, fout)
-        
-        with PdfPages('{}/{}.pdf'.format(workdir, metric)) as pdf:
-            plt.figure(figsize=(6, 6))
-            plt.scatter(model.predict(X_test), y_test)
-            plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
-            plt.title('{}\nForecast by Meta-Model vs Actual Outcome by Simulator'.format(metric))
-            plt.xlabel('Forecast')
-            plt.ylabel('Actual')
-            pdf.savefig()
-            plt.close()
-
-            plt.figure(figsize=(12, 6))
-            shap.summary_plot(shap_values, X_test, show=False, plot_size=(12, 6))
-            plt.subplots_adjust(left=0.28, bottom=0.12, right=0.98, top=0.92)
-            plt.title('Datapoint-specific Sensitivities to {}'.format(metric))
-            pdf.savefig()
-            plt.close()
-
-            for xcol in X.columns:
-                plt.figure(figsize=(6, 6))
-                shap.dependence_plot(xcol, shap_values, X_test, show=False)
-                plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
-                plt.title('How Interaction with {} Affects {}'.format(xcol, metric))
-                pdf.savefig()
-                plt.close()
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_worker, initargs=(workdir, seed, incremental)) as executor:
+        # Every job holds its threads until it finishes, so that the pool never runs more than --n-jobs threads
+        budget = ThreadBudget(executor, n_jobs)
+
+        def submit_round(task):
+            # Forests are sent back only from a final round of a few candidates, to be grown into the meta model
+            halving = searches[task]
+            keep_model = halving.is_final() and len(halving.candidates) <= eta
+            return [
+                budget.submit(oob_mse, task, ms, mf, halving.current_size(), keep_model)
+                for _, (ms, mf) in halving.current()]
+
+        def submit_shap(task, rows, first_tree=0):
+            n_chunks = max(1, min(2 * n_jobs, int(np.ceil(len(rows) / 100.0))))
+            return [budget.submit(shap_chunk, task, chunk, first_tree) for chunk in np.array_split(rows, n_chunks) if len(chunk) > 0]
+
+        # Each task goes through the stages of search, fit, shap and render, and a stage is submitted
+        # as soon as the futures of the previous stage of the task finish.
+        # In the incremental mode, a task whose model can be grown starts from the update stage instead of search and fit.
+        stage = {}
+        futures = {}
+        for task in tasks:
+            if incremental and state.can_update(model_name(task), X_index):
+                stage[task] = 'update'
+                futures[task] = [budget.submit_threads(
+                    lambda threads, task=task: executor.submit(
+                        update_task, task, threads, shap_max_rows, drift_threshold, max_trees),
+                    n_threads)]
+            else:
+                stage[task] = 'search'
+                # Fast search of hyperparameters of minimal out-of-bag MSE
+                futures[task] = submit_round(task)
+        fitted = {}
+        reports = {}
+        # Numbers of the SHAP futures of a task on the new rows by all trees, and on the cached rows by the new trees
+        n_shap_chunks = {}
+        updates = {}
+        while any(stage[task] != 'done' for task in tasks):
+            for task in tasks:
+                if stage[task] == 'done' or not all(future.done() for future in futures[task]):
+                    continue
+                results = [future.result() for future in futures[task]]
+                futures[task] = []
+                if stage[task] == 'search':
+                    halving = searches[task]
+                    candidates = list(halving.candidates)
+                    halving.report([mse for mse, _ in results])
+                    if not halving.finished:
+                        futures[task] = submit_round(task)
+                        continue
+                    best_ms, best_mf = halving.best
+                    if incremental:
+                        state.record(model_name(task), best_ms, best_mf)
+                    best_model = results[candidates.index(halving.best_index)][1]
+                    if task is None:
+                        futures[task] = [budget.submit_threads(
+                            lambda threads, model=best_model, ms=best_ms, mf=best_mf: executor.submit(
+                                fit_multi_output, model, ms, mf, threads, shap_max_rows),
+                            n_threads)]
+                    else:
+                        futures[task] = [budget.submit_threads(
+                            lambda threads, task=task, model=best_model, ms=best_ms, mf=best_mf: executor.submit(
+                                fit_metric, task, model, ms, mf, threads, shap_max_rows),
+                            n_threads)]
+                    del best_model
+                    stage[task] = 'fit'
+                elif stage[task] in ['fit', 'update']:
+                    if stage[task] == 'update' and results[0][0] is None:
+                        print('{}: {}, refitting from scratch'.format(model_name(task), results[0][1]))
+                        state.record_refit(model_name(task), results[0][1])
+                        stage[task] = 'search'
+                        futures[task] = submit_round(task)
+                        continue
+                    if stage[task] == 'update':
+                        fimp, old_rows, new_rows, test_index, y_pred, n_old, n_total = results[0][0]
+                        fitted[task] = (fimp, np.concatenate([old_rows, new_rows]), test_index, y_pred)
+                        futures[task] = submit_shap(task, new_rows)
+                        n_new_chunks = len(futures[task])
+                        if n_total > n_old:
+                            futures[task] += submit_shap(task, old_rows, first_tree=n_old)
+                        n_shap_chunks[task] = (n_new_chunks, len(futures[task]) - n_new_chunks)
+                        updates[task] = (old_rows, n_old, n_total)
+                    else:
+                        fitted[task] = results[0]
+                        futures[task] = submit_shap(task, fitted[task][1])
+                        n_shap_chunks[task] = (len(futures[task]), 0)
+                    if sobol_samples > 0:
+                        futures[task] += [
+                            budget.submit(sobol_chunk, task, int(n_rows), chunk, sobol_bootstrap) for chunk, n_rows in enumerate(sobol_chunks)]
+                    stage[task] = 'shap'
+                elif stage[task] == 'shap':
+                    _, rows, test_index, y_pred = fitted[task]
+                    output_names = metrics if task is None else [task]
+                    n_new_chunks, n_old_chunks = n_shap_chunks[task]
+                    if sobol_samples > 0:
+                        sobol_tables[task] = indices_table(
+                            add_sums(results[n_new_chunks + n_old_chunks:]), X_columns, groups, output_names)
+                    for j, metric in enumerate(output_names):
+                        shap_values = stack_shap(results[:n_new_chunks], j, task, len(X_columns))
+                        if task in updates:
+                            # SHAP values of a forest are the average of those of its trees,
+                            # so the cached values are combined with those of the new trees
+                            old_rows, n_old, n_total = updates[task]
+                            old_values = load_shap('{}/{}.shap.npz'.format(workdir, metric))['shap_values']
+                            if n_old_chunks > 0:
+                                new_trees = stack_shap(results[n_new_chunks:n_new_chunks + n_old_chunks], j, task, len(X_columns))
+                                old_values = (n_old * old_values + (n_total - n_old) * new_trees) / n_total
+                            shap_values = np.vstack([old_values, shap_values])
+                        save_shap(
+                            '{}/{}.shap.npz'.format(workdir, metric), shap_values, test_index[rows], X_columns,
+                            test_index, y_pred[:, j] if task is None else y_pred)
+                    stage[task] = 'done'
+                    if report != 'none':
+                        reports[task] = [
+                            (metric, submit_report(budget, workdir, metric, fast=(report == 'fast'), seed=seed))
+                            for metric in output_names]
+                        futures[task] = [page for _, pages in reports[task] for page in pages]
+                        stage[task] = 'render'
+                else:
+                    for metric, pages in reports[task]:
+                        write_report(workdir, metric, results[:len(pages)])
+                        results = results[len(pages):]
+                    del reports[task]
+                    stage[task] = 'done'
+            budget.wait()
+        imp = [fitted[task][0].reshape(len(X_columns), -1) for task in tasks]
+        if incremental:
+            state.save(X_index)
         
-    imp = pd.DataFrame(data=np.hstack(tuple(imp)), index=X.columns, columns=Y.columns)
-    imp.to_csv('{}/relative_importance.csv'.format(workdir))
-    
+    imp = pd.DataFrame(data=np.hstack(tuple(imp)), index=X_columns, columns=metrics)
+    if len(selected_metrics) == 0:
+        imp.to_csv('{}/relative_importance.csv'.format(workdir))
+        if sobol_samples > 0:
+            pd.concat([sobol_tables[task] for task in tasks]).to_csv('{}/sobol_indices.csv'.format(workdir), index=False)
+    else:
+        for metric in metrics:
+            imp[[metric]].to_csv('{}/{}.importance.csv'.format(workdir, metric))
+            if sobol_samples > 0:
+                sobol_tables[metric].to_csv('{}/{}.sobol_indices.csv'.format(workdir, metric), index=False)
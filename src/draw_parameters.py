@@ -1,7 +1,7 @@
 """Random Drawing of (Parameter, Output Statistic) Samples for Sensitivity Analysis
 
 Usage:
-  draw_parameters.py <OUTPUT_DIR> [--job-name=<name>] [--n-simulations=<n_sim>] [--seed=<seed>] [--java-project-dir=<JPDIR>] [--output-summary-file=<OSFILE>] [--output-stat-file=<OSFILE>] [--save-all]
+  draw_parameters.py <OUTPUT_DIR> [--job-name=<name>] [--n-simulations=<n_sim>] [--seed=<seed>] [--java-project-dir=<JPDIR>] [--output-summary-file=<OSFILE>] [--output-stat-file=<OSFILE>] [--save-all] [--parallel=<n>] [--worker-address=<addr>] [--worker-timeout=<sec>] [--input-link=<mode>] [--resume] [--sample-format=<fmt>] [--loss-config=<file>] [--adaptive-rounds=<n>] [--pool-factor=<k>] [--acquisition=<mode>] [--frontier-metrics=<metrics>] [--design=<design>]
   draw_parameters.py (-h | --help)
   draw_parameters.py --version
 
@@ -15,6 +15,18 @@ Options:
   --output-summary-file=<OSFILE>  CSV file that stores a summary of one simulation [default: Compartments.csv]
   --output-stat-file=<OSFILE>     CSV file that stores another summary of one simulation [default: stats.txt]
   --save-all                      Store all Monte Carlo samples 
+  --parallel=<n>                  Number of simulations running at once [default: 1].
+  --worker-address=<addr>         Comma-separated socket addresses of simulation_worker.py processes
+  --worker-timeout=<sec>          Seconds to wait for a simulation worker to answer a job before launching the binary instead [default: 3600].
+  --input-link=<mode>             How static input files reach each trial, either copy, hardlink or symlink [default: copy].
+  --resume                        Skip the trials already recorded in OUTPUT_DIR by the run of the same job name and seed
+  --sample-format=<fmt>           Format of the final sample files, either csv, npy or parquet [default: csv].
+  --loss-config=<file>            JSON file of the loss metrics computed from the outputs of each simulation (see uk/co/ramp/exec/default_losses.json)
+  --adaptive-rounds=<n>           Number of rounds after the first half of the trials, each choosing its trials by a meta-model of the trials so far [default: 0].
+  --pool-factor=<k>               Number of prior draws per trial among which an adaptive round chooses [default: 10].
+  --acquisition=<mode>            How an adaptive round chooses, either variance (largest spread across trees) or frontier (closest to the predicted Pareto front) [default: variance].
+  --frontier-metrics=<metrics>    Comma-separated two losses of the frontier acquisition [default: total_infections,person_days_in_isolation].
+  --design=<design>               How the parameters are drawn, either random (independent draws), sequential (independent draws in the order of the earlier versions), sobol (scrambled Sobol sequence) or lhs (Latin hypercube) [default: random].
   
 """
 
@@ -23,40 +35,22 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-import shutil
-import time
+from collections import OrderedDict
 from docopt import docopt
 from os.path import expanduser, dirname, realpath, sep
 from scipy.odr.odrpack import Output
 sys.path.append(dirname(realpath(__file__)))
 from uk.co.ramp.gencfg.disease import DiseaseSettings
+from uk.co.ramp.gencfg.design import draw_design
 from uk.co.ramp.gencfg.population import PopulationSettings
 from uk.co.ramp.gencfg.isolation_policies import IsolationPolicies
 from uk.co.ramp.gencfg.tracing_policies import TracingPolicies
-
-loss_names = ['peak_severity', 'total_death', 'total_infections', 'death_to_recovery_ratio', 'person_days_in_isolation']
-
-
-def losses(output_summary, output_stat):
-    """
-    Returns a list of negative utility, where each element is a function of the entire output time-series.
-    In production, this part should be provided from an external file.
-    
-    Examples considerable are
-        Total number of deaths
-        DTW distance between the output and observations in the real world (when doing parameter estimation)
-        
-        
-    Because output_summary is given as total population, number of death at the LAST timestamp is taken.
-    About severity, here we focus on the peak value, that is hitting hospital capacity.
-    """
-    return [
-        output_summary['sev'].max(),
-        output_summary['d'].iloc[-1],
-        output_summary['d'].iloc[-1] + output_summary['r'].iloc[-1],
-        float(output_summary['d'].iloc[-1]) / output_summary['r'].iloc[-1],
-        output_stat['Person Days in Isolation']]
-
+from uk.co.ramp.exec.inputs import InputTemplate
+from uk.co.ramp.exec.losses import LossRegistry
+from uk.co.ramp.exec.simulator import ContactTracingSimulator, SimulationPool
+from uk.co.ramp.param.adaptive import round_sizes, fit_surrogate, select_batch
+from uk.co.ramp.param.checkpoint import SampleCheckpoint
+from uk.co.ramp.param.store import SampleStore
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='0.0.1')
@@ -73,6 +67,25 @@ if __name__ == '__main__':
     n_simulations = int(_getopt('--n-simulations', 1000))
     seed = int(_getopt('--seed', 1234))
     save_all = _getopt('--save-all', False)
+    n_parallel = int(_getopt('--parallel', 1))
+    worker_address = _getopt('--worker-address', None)
+    worker_timeout = float(_getopt('--worker-timeout', 3600))
+    input_link = _getopt('--input-link', 'copy')
+    resume = _getopt('--resume', False)
+    sample_format = _getopt('--sample-format', 'csv')
+    loss_registry = LossRegistry.load(_getopt('--loss-config', None))
+    n_rounds = int(_getopt('--adaptive-rounds', 0))
+    pool_factor = int(_getopt('--pool-factor', 10))
+    acquisition = _getopt('--acquisition', 'variance')
+    frontier_metrics = _getopt('--frontier-metrics', 'total_infections,person_days_in_isolation').split(',')
+    design = _getopt('--design', 'random')
+    # The options of the adaptive rounds are checked before any simulation runs
+    if acquisition not in ('variance', 'frontier'):
+        raise ValueError('Acquisition must be either variance or frontier')
+    unknown = [metric for metric in frontier_metrics if metric not in loss_registry.names]
+    if acquisition == 'frontier' and len(unknown) > 0:
+        raise ValueError('Frontier metrics {} are not among the loss metrics {}'.format(unknown, loss_registry.names))
+    sizes = round_sizes(n_simulations, n_rounds)
     
     try:
         os.mkdir(top_output_dir)
@@ -85,116 +98,117 @@ if __name__ == '__main__':
     population = PopulationSettings(random_state=seed)
     isopolicy = IsolationPolicies(random_state=seed, simplified=True)  # simplified=False if more complex policy space is searched for.
     tracepolicy = TracingPolicies(random_state=seed)
+    input_template = InputTemplate(
+        java_project_dir, template_dir='{}/input_template'.format(top_output_dir), link=input_link)
+    run_settings = input_template.load('runSettings.json')
+    simulator = ContactTracingSimulator(
+        java_project_dir, worker_addresses=worker_address.split(',') if worker_address is not None else None,
+        worker_timeout=worker_timeout)
     
-    X_columns = []
-    X = []
-    Y = []
-    for trial in range(n_simulations):
-        X_t = []
-
-        if save_all:       
+    # The full design matrix is drawn up front, so that the samples do not depend on --parallel.
+    # Due to outflow/inflow of people, population should also be slightly perturbed.
+    # Disease settings are highly perturbed because they are main parameters.
+    # Policy parameters are perturbed to seek out good isolation & tracing policies.
+    generators = OrderedDict([
+        ('populationSettings', population),
+        ('diseaseSettings', disease),
+        ('isolationPolicies', isopolicy),
+        ('tracingPolicies', tracepolicy)])
+
+    # With adaptive rounds, the design matrix holds the first round followed by the pool of candidates of each round,
+    # and trial t runs the row selected[t] of it.
+    pool_starts = np.cumsum([0, sizes[0]] + [pool_factor * size for size in sizes[1:]])
+    designs = draw_design(generators, pool_starts[-1], design=design, seed=seed)
+    selected = list(range(sizes[0]))
+    
+    outindex = np.array(['{}.sample{}'.format(jobname, trial) for trial in range(n_simulations)])
+    X = pd.concat(list(designs.values()), axis=1)
+    
+    # Every finished trial is appended to the output CSV files at once, and can be skipped by --resume
+    settings = {}
+    if n_rounds > 0:
+        settings.update({'adaptive_rounds': n_rounds, 'pool_factor': pool_factor, 'acquisition': acquisition})
+        if acquisition == 'frontier':
+            # The metrics of the front decide which candidates are chosen
+            settings['frontier_metrics'] = list(frontier_metrics)
+    if design != 'random':
+        settings['design'] = design
+    checkpoint = SampleCheckpoint(top_output_dir, jobname, seed, n_simulations, resume=resume, settings=settings)
+    
+    def draw_trials(trials):
+        records = [generators[name].records(design.iloc[[selected[trial] for trial in trials]]) for name, design in designs.items()]
+        for trial, values in zip(trials, zip(*records)):
+            if outindex[trial] in checkpoint.finished:
+                continue
+            yield trial, OrderedDict(zip(designs.keys(), values))
+    
+    def run_trial(job, slot):
+        trial, samples = job
+        if save_all:
             subdir = '{}/sample{}'.format(top_output_dir, trial)
+        elif n_parallel > 1:
+            subdir = '{}/slot{}'.format(top_output_dir, slot)
         else:
             subdir = top_output_dir
-        input_dir = '{}/config'.format(subdir, trial)
-        output_dir = '{}/data'.format(subdir, trial)
+        input_dir = '{}/config'.format(subdir)
+        output_dir = '{}/data'.format(subdir)
             
-        try:
-            os.mkdir(subdir)
-        except:
-            pass
+        for d in [subdir, input_dir, output_dir]:
+            try:
+                os.mkdir(d)
+            except:
+                pass
 
-        try:
-            os.mkdir(input_dir)
-        except:
-            pass
-        
-        try:
-            os.mkdir(output_dir)
-        except:
-            pass
-
-        input_loc_file = '{}/input/inputLocations.json'.format(java_project_dir)
-        with open(input_loc_file, 'r') as fin:
-            input_locations = json.load(fin)
-            
-        # Create a copy of default files in input/inputLocations.json
-        # For contact data we could add random noise in the future, for reflecting
-        # the missing contacts not recorded in contact data.
-        for key, val in input_locations.items():
-            shutil.copy2('{}/input/{}'.format(java_project_dir, val), input_dir)
-    
         # Each job should have a unique seed in runSettings
-        run_file = '{}/runSettings.json'.format(input_dir)
-        with open(run_file, 'r') as fin:
-            run_sample = json.load(fin)
+        run_sample = dict(run_settings)
         run_sample['seed'] = seed + trial  # override
-        with open(run_file, 'w') as fout:
-            json.dump(run_sample, fout, sort_keys=True, indent=2)
-
-        # Due to outflow/inflow of people, population should also be slightly perturbed.
-        population_file = '{}/populationSettings.json'.format(input_dir)
-        population_sample = population.next()
-        if trial == 0:
-            for key in population_sample.keys():
-                X_columns.append(key)
-        X_t.append(list(population_sample.values()))
-        with open(population_file, 'w') as fout:
-            json.dump(PopulationSettings.export(population_sample), fout, sort_keys=True, indent=2)
-        
-        # Disease settings are highly perturbed because they are main parameters
-        disease_file = '{}/diseaseSettings.json'.format(input_dir)
-        disease_sample = disease.next()
-        if trial == 0:
-            for key in disease_sample.keys():
-                X_columns.append(key)
-        X_t.append(list(disease_sample.values()))
-        with open(disease_file, 'w') as fout:
-            json.dump(DiseaseSettings.export(disease_sample), fout, sort_keys=True, indent=2)
+        contents = {'runSettings.json': run_sample}
+        for name, sample in samples.items():
+            contents['{}.json'.format(name)] = generators[name].export(sample)
 
-        # Policy parameters are perturbed to seek out good isolation & tracing policies
-        isopolicy_file = '{}/isolationPolicies.json'.format(input_dir)
-        isopolicy_sample = isopolicy.next()
-        if trial == 0:
-            for key in isopolicy_sample.keys():
-                X_columns.append(key)
-        X_t.append(list(isopolicy_sample.values()))
-        with open(isopolicy_file, 'w') as fout:
-            json.dump(IsolationPolicies.export(isopolicy_sample), fout, sort_keys=True, indent=2)
-
-        # Policy parameters are perturbed to seek out good isolation & tracing policies
-        tracepolicy_file = '{}/tracingPolicies.json'.format(input_dir)
-        tracepolicy_sample = tracepolicy.next()
-        if trial == 0:
-            for key in tracepolicy_sample.keys():
-                X_columns.append(key)
-        X_t.append(list(tracepolicy_sample.values()))
-        with open(tracepolicy_file, 'w') as fout:
-            json.dump(TracingPolicies.export(tracepolicy_sample), fout, sort_keys=True, indent=2)
+        # Only the json files above are rewritten, and the rest of the files in input/inputLocations.json are
+        # copied or linked from the default files.
+        # For contact data we could add random noise in the future, for reflecting
+        # the missing contacts not recorded in contact data.
+        input_template.prepare(input_dir, contents)
 
-        finished = False
-        while not finished:
-           exitcode = os.system("{}/build/install/ContactTracing/bin/ContactTracing --overrideInputFolderLocation={} --overrideOutputFolderLocation={} --seed={}".format(java_project_dir, input_dir, output_dir, seed + trial))
-           if exitcode > 0:
-               time.sleep(3)
-               os.system('gradle install')
-               time.sleep(3)
-               continue
-           else:
-               finished = True
-            
-        X.append(np.concatenate(X_t).reshape(1, -1))
+        simulator.run(input_dir, output_dir, seed + trial, slot=slot)
     
-        # Read the summary results file and calculate the summary statistic
-        output_summary = pd.read_csv('{}/{}'.format(output_dir, output_summary_file)).set_index('time')
-        stat_ = pd.read_csv('{}/{}'.format(output_dir, output_stat_file), header=None).set_index(0)
-        stat_.index = stat_.index.str.strip()
-        output_stat = {stat_.index[i]: stat_.values.reshape(-1,)[i] for i in range(stat_.shape[0])}
-        Y.append(np.array(losses(output_summary, output_stat)).reshape(1, -1))
+        # Scan the summary results files and calculate the loss metrics of the registry
+        Y_t = pd.DataFrame(
+            data=np.array(loss_registry.evaluate(
+                '{}/{}'.format(output_dir, output_summary_file),
+                '{}/{}'.format(output_dir, output_stat_file))).reshape(1, -1),
+            index=outindex[[trial]],
+            columns=loss_registry.names)
+        X_t = X.iloc[[selected[trial]]]
+        X_t.index = outindex[[trial]]
+        return X_t, Y_t
     
-    outindex = np.array(['{}.sample{}'.format(jobname, trial) for trial in range(n_simulations)])
-    X = pd.DataFrame(data=np.vstack(tuple(X)), index=outindex, columns=X_columns)
-    Y = pd.DataFrame(data=np.vstack(tuple(Y)), index=outindex, columns=loss_names)
+    pool = SimulationPool(n_parallel)
+    for r, size in enumerate(sizes):
+        if r > 0:
+            # The meta-model is fitted on the trials of the previous rounds read back from the checkpoint files,
+            # so that a resumed run chooses the same trials.
+            n_done = len(selected)
+            Y_done = SampleStore(top_output_dir, 'csv').read('output_loss_samples').loc[outindex[:n_done]]
+            # Trials whose losses recompute_losses.py could not evaluate are NaN, and are left out of the fit
+            finite = np.isfinite(Y_done.values).all(axis=1)
+            if not finite.all():
+                print('Round {}: {} trials without finite losses are left out of the fit'.format(r, (~finite).sum()))
+            model = fit_surrogate(
+                X.iloc[selected].values[finite], Y_done[finite], n_jobs=n_parallel, random_state=seed + r)
+            candidates = np.arange(pool_starts[r], pool_starts[r + 1])
+            chosen = select_batch(
+                model, X.iloc[candidates].values, size, acquisition=acquisition, frontier_metrics=frontier_metrics)
+            selected.extend(candidates[chosen].tolist())
+            print('Round {}: {} trials chosen by {} among {} candidates'.format(r, size, acquisition, len(candidates)))
+        for X_t, Y_t in pool.imap(run_trial, draw_trials(range(len(selected) - size, len(selected)))):
+            checkpoint.append(X_t, Y_t)
     
-    X.to_csv('{}/input_parameter_samples.csv'.format(top_output_dir))
-    Y.to_csv('{}/output_loss_samples.csv'.format(top_output_dir))
+    # The checkpoint files are CSV, which are converted once all trials are finished
+    if sample_format != 'csv':
+        store = SampleStore(top_output_dir, sample_format)
+        csv_store = SampleStore(top_output_dir, 'csv')
+        for name in ['input_parameter_samples', 'output_loss_samples']:
+            store.write(name, csv_store.read(name))
@@ -0,0 +1,72 @@
+/*
+ * Entry point of simulation_worker.py, which runs the main method of Contact Tracing Model repeatedly in one JVM.
+ * While the model is running, System.exit inside it throws ExitGuard.Exit instead of ending the JVM,
+ * and the exit status is returned to the worker as that of the job.
+ */
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.security.Permission;
+
+public class ExitGuard extends SecurityManager {
+
+    /**
+     * Thrown by System.exit while a job is running, carrying the exit status.
+     */
+    public static class Exit extends SecurityException {
+        private static final long serialVersionUID = 1L;
+        public final int status;
+
+        Exit(int status) {
+            super("System.exit(" + status + ") inside the model");
+            this.status = status;
+        }
+    }
+
+    private static volatile boolean running = false;
+
+    /**
+     * Install the guard as the security manager, which throws UnsupportedOperationException
+     * on JVMs that do not allow one (Java 18 to 23 without -Djava.security.manager=allow, and Java 24 or later).
+     */
+    public static void install() {
+        System.setSecurityManager(new ExitGuard());
+    }
+
+    /**
+     * Call the main method of mainClass with args, and return the status of System.exit, or 0 when main returns.
+     * Exceptions thrown by main are thrown again.
+     */
+    public static synchronized int run(String mainClass, String[] args) throws Throwable {
+        Method main = Class.forName(mainClass).getMethod("main", String[].class);
+        running = true;
+        try {
+            main.invoke(null, (Object) args);
+            return 0;
+        } catch (InvocationTargetException e) {
+            // The model may have wrapped the exit into another exception
+            for (Throwable cause = e.getCause(); cause != null; cause = cause.getCause()) {
+                if (cause instanceof Exit) {
+                    return ((Exit) cause).status;
+                }
+            }
+            throw e.getCause();
+        } finally {
+            running = false;
+        }
+    }
+
+    @Override
+    public void checkExit(int status) {
+        if (running) {
+            throw new Exit(status);
+        }
+    }
+
+    @Override
+    public void checkPermission(Permission perm) {
+    }
+
+    @Override
+    public void checkPermission(Permission perm, Object context) {
+    }
+}
@@ -3,7 +3,7 @@ Sample pairs of (parameters, output summary) must be generated by draw_parameter
 predictive models must be fitted by analyse_sensitivity.py in advance.
 
 Usage:
-  policy_frontier.py <WORK_DIR> [--output-prefix=<PREFIX>] [--metricA=<output_metric>] [--metricB=<output_metric>] [--seed=<seed>] [--n-jobs=<njobs>]
+  policy_frontier.py <WORK_DIR> [--output-prefix=<PREFIX>] [--metricA=<output_metric>] [--metricB=<output_metric>] [--metricC=<output_metric>] [--seed=<seed>] [--n-jobs=<njobs>] [--multi-output] [--batch-rows=<rows>] [--chunk-size=<policies>] [--model-format=<fmt>]
   policy_frontier.py (-h | --help)
   policy_frontier.py --version
 
@@ -13,8 +13,15 @@ Options:
   --output-prefix=<PREFIX>        Prefix of output files [default: frontier].
   --metricA=<output_metric>       Metric (column name) to be minimised. Chosen as the X-axis of the frontier plot [default: person_days_in_isolation].
   --metricB=<output_metric>       Metric (column name) to be minimised. Chosen as the Y-axis of the frontier plot [default: total_death].
+  --metricC=<output_metric>       Optional third metric to be minimised, which makes the frontier a set of three-way trade-offs.
   --seed=<seed>                   Random seed [default: 1234].
-  --n-jobs=<njobs>               Number of threads in fitting a meta model [default: 1].
+  --n-jobs=<njobs>                Number of processes evaluating the policies [default: 1].
+  --multi-output                  Predict both metrics by multi_output.model of analyse_sensitivity.py --multi-output.
+  --batch-rows=<rows>             Number of (policy x background sample) rows predicted in one call [default: 200000].
+  --chunk-size=<policies>         Number of policies per unit of work. Each chunk has its own random stream, so that
+                                  the results depend on the chunk size but not on --n-jobs [default: 1000].
+  --model-format=<fmt>            Meta models to load, either pickle (*.model) or mapped (*.forest, memory-mapped and shared
+                                  by the worker processes, which saves memory but is slower to predict) [default: pickle].
   
 """
 
@@ -30,66 +37,132 @@ from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as plt
 from uk.co.ramp.gencfg.isolation_policies import IsolationPolicies
 from uk.co.ramp.gencfg.tracing_policies import TracingPolicies
+from uk.co.ramp.param.forest import MappedForest
+from uk.co.ramp.param.frontier import pareto_front
+from uk.co.ramp.param.store import SampleStore
 
+_data = {}
 
-def fit_frontier(case_loss, X, policy_parameter_columns, score_columns, seed):
-    x_sorted = np.sort(case_loss[:, 0])
-    old_th = None
-    
-    frontier_policies = []
-    frontier_scores = []
-    for j, x_th in enumerate(x_sorted):
-        filt = case_loss[:, 0] <= x_th
-        th = np.arange(n)[filt][case_loss[filt, 1].argmin()]
-        y_th = case_loss[th, 1]
-        policy_th = X[policy_parameter_columns].iloc[th].values
-        if old_th is None or th != old_th:  # new trade-off point
-            frontier_policies.append(policy_th.reshape(1, -1))
-            frontier_scores.append(np.array([x_th, y_th]).reshape(1, -1))
-        old_th = th
-        
+
+def fit_frontier(case_loss, X, policy_parameter_columns, score_columns):
+    """
+    Policies and scores of the rows of case_loss on the Pareto front, ordered by the first objective.
+    With two objectives, the efficient frontier curve interpolates the front, and it is None otherwise.
+    """
+    front = pareto_front(case_loss)
     frontier_policies = pd.DataFrame(
-        data=np.vstack(frontier_policies),
+        data=X[policy_parameter_columns].values[front],
         columns=policy_parameter_columns
     )
     frontier_scores = pd.DataFrame(
-        data=np.vstack(frontier_scores),
+        data=case_loss[front],
         columns=score_columns
     )
         
     # Fit the efficient frontier curve
-    frontier_line = interp1d(frontier_scores[score_columns[0]], frontier_scores[score_columns[1]], kind='linear')
+    frontier_line = None
+    if len(score_columns) == 2:
+        frontier_line = interp1d(frontier_scores[score_columns[0]], frontier_scores[score_columns[1]], kind='linear')
         
     return frontier_policies, frontier_scores, frontier_line
 
 
-def calcstat(X, indices, workdir, metricA, metricB, policy_parameter_columns, k, random_state):
-    with open('{}/{}.model'.format(workdir, metricA), 'rb') as fin:
-        modelA = pickle.load(fin)
-    with open('{}/{}.model'.format(workdir, metricB), 'rb') as fin:
-        modelB = pickle.load(fin)
+def load_model(workdir, name, mapped=False):
+    """
+    Meta model saved by analyse_sensitivity.py, either unpickled from {name}.model or memory-mapped from {name}.forest.
+    """
+    if mapped:
+        return MappedForest('{}/{}.forest'.format(workdir, name))
+    with open('{}/{}.model'.format(workdir, name), 'rb') as fin:
+        return pickle.load(fin)
 
-    n = X.shape[0]
-    result = np.zeros((len(indices), 4))
-    for row, i in enumerate(indices):
-        xpolicy_i = X[policy_parameter_columns].iloc[i].values
-        X_i = X.iloc[random_state.choice(n, size=k)].copy()
-        X_i[policy_parameter_columns] = np.vstack([xpolicy_i.reshape(1, -1) for _ in range(k)])
-        yA = modelA.predict(X_i)
-        yB = modelB.predict(X_i)
-        meanA = np.mean(yA)
-        meanB = np.mean(yB)
-        q99A = np.percentile(yA, 99.0)
-        q99B = np.percentile(yB, 99.0)
+
+def load_predictor(workdir, metrics, multi_output=False, mapped=False):
+    """
+    Returns a function that predicts the list of metrics of the rows of X.
+    A multi-output model predicts all metrics in one call.
+    Mapped models check the columns of X against the feature columns recorded at fitting.
+    """
+    if multi_output:
+        model = load_model(workdir, 'multi_output', mapped=mapped)
+        columns = [model.output_index(metric) for metric in metrics]
         
-        result[row, 0] = meanA
-        result[row, 1] = meanB
-        result[row, 2] = q99A
-        result[row, 3] = q99B
+        def predict(X):
+            Y = model.predict(X)
+            return [Y[:, j] for j in columns]
+        return predict
+
+    models = [load_model(workdir, metric, mapped=mapped) for metric in metrics]
+
+    def predict(X):
+        return [model.predict(X) for model in models]
+    return predict
+
+
+def unique_policies(X, policy_parameter_columns):
+    """
+    Rows of X holding the first occurrence of each distinct policy vector, in the order of X,
+    and the position in those rows of the policy of every row of X.
+    """
+    _, first, inverse = np.unique(X[policy_parameter_columns].values, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    return first[order], position[inverse.reshape(-1)]
+
+
+def calcstat(X, indices, predict, policy_parameter_columns, k, random_state, batch_rows=200000):
+    """
+    Means and 99th percentiles of the metrics predicted by predict for each policy of the rows indices,
+    over k background rows of X drawn with replacement, as an array of shape (len(indices), 2 * n_metrics)
+    whose columns are the means followed by the percentiles.
+    Blocks of (policy x background) rows are built in one preallocated buffer of about batch_rows rows, so that
+    each block costs one predict call per model. The random draws are the same as those of one policy at a time.
+    """
+    n = X.shape[0]
+    values = X.values.astype(np.float64)
+    policy_positions = [X.columns.get_loc(col) for col in policy_parameter_columns]
+    policies = values[np.asarray(indices, dtype=int)][:, policy_positions]
+    m = max(1, batch_rows // k)  # policies per block
+    buffer = np.empty((m * k, values.shape[1]))
+    result = None
+    for start in range(0, len(indices), m):
+        m_b = min(m, len(indices) - start)
+        block = buffer[:m_b * k]
+        np.take(values, random_state.choice(n, size=m_b * k), axis=0, out=block)
+        block[:, policy_positions] = np.repeat(policies[start:start + m_b], k, axis=0)
+        ys = predict(pd.DataFrame(block, columns=X.columns, copy=False))
+        d = len(ys)
+        if result is None:
+            result = np.zeros((len(indices), 2 * d))
+        for j, y in enumerate(ys):
+            y = np.asarray(y).reshape(m_b, k)
+            result[start:start + m_b, j] = np.mean(y, axis=1)
+            result[start:start + m_b, d + j] = np.percentile(y, 99.0, axis=1)
     
     return result
 
 
+def init_worker(workdir, metrics, policy_parameter_columns, k, multi_output, batch_rows, mapped):
+    """
+    Read the samples and the meta models once per worker process.
+    """
+    _data['X'] = SampleStore(workdir).read('input_parameter_samples')
+    _data['predict'] = load_predictor(workdir, metrics, multi_output=multi_output, mapped=mapped)
+    _data['policy_parameter_columns'] = policy_parameter_columns
+    _data['k'] = k
+    _data['batch_rows'] = batch_rows
+
+
+def calcstat_chunk(chunk, indices, seed):
+    """
+    calcstat of one chunk of policies by the random stream of the chunk number.
+    """
+    return calcstat(
+        _data['X'], indices, _data['predict'], _data['policy_parameter_columns'], _data['k'],
+        check_random_state(seed + chunk), batch_rows=_data['batch_rows'])
+
+
 if __name__ == '__main__':
     args = docopt(__doc__, version='0.0.1')
     
@@ -102,71 +175,71 @@ if __name__ == '__main__':
     outprefix = _getopt('--output-prefix', 'frontier')
     metricA = _getopt('--metricA', 'person_days_in_isolation')
     metricB = _getopt('--metricB', 'total_death')
+    metricC = _getopt('--metricC', None)
+    multi_output = _getopt('--multi-output', False)
+    batch_rows = int(_getopt('--batch-rows', 200000))
+    chunk_size = int(_getopt('--chunk-size', 1000))
+    model_format = _getopt('--model-format', 'pickle')
+    if model_format not in ['pickle', 'mapped']:
+        raise ValueError('--model-format must be either pickle or mapped')
+    mapped = model_format == 'mapped'
 
-    X = pd.read_csv('{}/input_parameter_samples.csv'.format(workdir), index_col=0)
+    store = SampleStore(workdir)
+    X = store.read('input_parameter_samples')
 
-    policy_parameter_columns = []
-    isopolicy = IsolationPolicies(random_state=seed)
-    tracepolicy = TracingPolicies(random_state=seed)
-    for key in isopolicy.next().keys():
-        policy_parameter_columns.append(key)
-    for key in tracepolicy.next().keys():
-        policy_parameter_columns.append(key)
+    policy_parameter_columns = IsolationPolicies().columns() + TracingPolicies().columns()
+    metrics = [metricA, metricB] + ([] if metricC is None else [metricC])
+    d = len(metrics)
     
     n = X.shape[0]
     k = n if n <= 1000 else 1000
     
-    average_case_loss = np.zeros((n, 2))
-    worst_case_loss = np.zeros((n, 2))
-
-    if n_jobs > 1:   
-        with multiprocessing.Pool(processes=n_jobs) as pool:
-            indices = [np.arange(n)[i::n_jobs] for i in range(int(n / n_jobs))]
-            arglist = []
-            for j in range(n_jobs):
-                random_state_j = check_random_state(seed + j)
-                arglist.append((X, indices[j], workdir, metricA, metricB, policy_parameter_columns, k, random_state_j))
-            results = pool.starmap(calcstat, arglist)
-            for j in range(n_jobs):
-                average_case_loss[indices[j], :] = results[j][:, [0, 1]]
-                worst_case_loss[indices[j], :] = results[j][:, [2, 3]]
+    # Each distinct policy is evaluated once, and its statistics are shared by the rows of the same policy
+    policy_rows, policy_of_row = unique_policies(X, policy_parameter_columns)
+    n_policies = len(policy_rows)
+    policy_loss = np.zeros((n_policies, 2 * d))
+
+    chunks = [(c, policy_rows[start:start + chunk_size], seed) for c, start in enumerate(range(0, n_policies, chunk_size))]
+    initargs = (workdir, metrics, policy_parameter_columns, k, multi_output, batch_rows, mapped)
+    if n_jobs > 1:
+        with multiprocessing.Pool(processes=n_jobs, initializer=init_worker, initargs=initargs) as pool:
+            results = pool.starmap(calcstat_chunk, chunks, chunksize=1)
     else:
-        random_state = check_random_state(seed)
-        results = calcstat(X, np.arange(n), workdir, metricA, metricB, policy_parameter_columns, k, random_state)
-        average_case_loss[:, :] = results[:, [0, 1]]
-        worst_case_loss[:, :] = results[:, [2, 3]]
+        init_worker(*initargs)
+        results = [calcstat_chunk(*chunk) for chunk in chunks]
+    for (c, indices, _), result in zip(chunks, results):
+        policy_loss[c * chunk_size:c * chunk_size + len(indices), :] = result
+
+    average_case_loss = policy_loss[policy_of_row][:, :d]
+    worst_case_loss = policy_loss[policy_of_row][:, d:]
         
-    # Identify the best empirical trade-off points (X, Y) = (x, y=min_Y Y | X<=x)
-    avg_score_columns = ['E[{}]'.format(metricA), 'E[{}]'.format(metricB)]
+    # Identify the best empirical trade-off points, which no other policy improves in every metric
+    avg_score_columns = ['E[{}]'.format(metric) for metric in metrics]
     avg_frontier_policies, avg_frontier_scores, avg_frontier_line = fit_frontier(
-        average_case_loss, X, policy_parameter_columns, avg_score_columns, seed)
-    avg_xrange = np.linspace(avg_frontier_line.x.min(), avg_frontier_line.x.max(), 1000)
+        average_case_loss, X, policy_parameter_columns, avg_score_columns)
     
-    worst_score_columns = ['Q99[{}]'.format(metricA), 'Q99[{}]'.format(metricB)]
+    worst_score_columns = ['Q99[{}]'.format(metric) for metric in metrics]
     worst_frontier_policies, worst_frontier_scores, worst_frontier_line = fit_frontier(
-        worst_case_loss, X, policy_parameter_columns, worst_score_columns, seed)
-    worst_xrange = np.linspace(worst_frontier_line.x.min(), worst_frontier_line.x.max(), 1000)
+        worst_case_loss, X, policy_parameter_columns, worst_score_columns)
     
     with PdfPages('{}/{}.tradeoffs.pdf'.format(workdir, outprefix)) as pdf:
-        plt.figure(figsize=(6, 6))
-        plt.scatter(average_case_loss[:, 0], average_case_loss[:, 1])
-        plt.plot(avg_xrange, avg_frontier_line(avg_xrange), color='blue', linewidth=2)
-        plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
-        plt.title('Average-case Efficient Frontier')
-        plt.xlabel(avg_score_columns[0])
-        plt.ylabel(avg_score_columns[1])
-        pdf.savefig()
-        plt.close()
-
-        plt.figure(figsize=(6, 6))
-        plt.scatter(worst_case_loss[:, 0], worst_case_loss[:, 1])
-        plt.plot(worst_xrange, worst_frontier_line(worst_xrange), color='blue', linewidth=2)
-        plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
-        plt.title('Worst-case (99%-tile-based) Efficient Frontier')
-        plt.xlabel(worst_score_columns[0])
-        plt.ylabel(worst_score_columns[1])
-        pdf.savefig()
-        plt.close()
+        for case_loss, frontier_scores, frontier_line, score_columns, title in [
+                (average_case_loss, avg_frontier_scores, avg_frontier_line, avg_score_columns, 'Average-case Efficient Frontier'),
+                (worst_case_loss, worst_frontier_scores, worst_frontier_line, worst_score_columns, 'Worst-case (99%-tile-based) Efficient Frontier')]:
+            plt.figure(figsize=(6, 6))
+            plt.scatter(case_loss[:, 0], case_loss[:, 1])
+            if frontier_line is not None:
+                xrange = np.linspace(frontier_line.x.min(), frontier_line.x.max(), 1000)
+                plt.plot(xrange, frontier_line(xrange), color='blue', linewidth=2)
+            else:
+                # Trade-offs of more than two metrics are shown as points projected on the first two
+                plt.scatter(frontier_scores[score_columns[0]], frontier_scores[score_columns[1]], color='red')
+            plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
+            plt.title(title)
+            plt.xlabel(score_columns[0])
+            plt.ylabel(score_columns[1])
+            pdf.savefig()
+            plt.close()
         
     pd.concat([avg_frontier_scores, avg_frontier_policies], axis=1).to_csv('{}/{}.average_case_policies.csv'.format(workdir, outprefix))
     pd.concat([worst_frontier_scores, worst_frontier_policies], axis=1).to_csv('{}/{}.worst_case_policies.csv'.format(workdir, outprefix))
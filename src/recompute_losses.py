@@ -0,0 +1,154 @@
+"""Recomputing the loss samples from the simulation outputs archived by draw_parameters.py --save-all.
+Every sample{i}/data directory is evaluated by the current loss metrics with a process pool, and output_loss_samples is rewritten.
+Samples whose output files are unchanged since the last recompute under the same metrics are taken from loss_manifest.json.
+Samples whose outputs cannot be read are reported in recompute_report.csv and their losses are written as NaN,
+so that output_loss_samples keeps the index of input_parameter_samples in the same order.
+
+Usage:
+  recompute_losses.py <OUTPUT_DIR> [--loss-config=<file>] [--job-name=<name>] [--output-summary-file=<OSFILE>] [--output-stat-file=<OSFILE>] [--check=<mode>] [--n-jobs=<njobs>] [--save-every=<n>] [--sample-format=<fmt>]
+  recompute_losses.py (-h | --help)
+  recompute_losses.py --version
+
+Options:
+  -h --help                       Show this screen.
+  --version                       Show version.
+  --loss-config=<file>            JSON file of the loss metrics (see uk/co/ramp/exec/default_losses.json)
+  --job-name=<name>               Job name of the sample index, read from checkpoint.json when not given
+  --output-summary-file=<OSFILE>  CSV file that stores a summary of one simulation [default: Compartments.csv]
+  --output-stat-file=<OSFILE>     CSV file that stores another summary of one simulation [default: stats.txt]
+  --check=<mode>                  How unchanged outputs are detected, either mtime (time and size) or hash (SHA-1 of the content) [default: mtime].
+  --n-jobs=<njobs>                Number of processes [default: 4].
+  --save-every=<n>                Number of evaluated samples between saves of loss_manifest.json [default: 1000].
+  --sample-format=<fmt>           Format of output_loss_samples, either csv, npy or parquet [default: csv].
+
+"""
+
+import json
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from docopt import docopt
+from os.path import dirname, realpath
+sys.path.append(dirname(realpath(__file__)))
+from uk.co.ramp.exec.losses import LossRegistry
+from uk.co.ramp.param.loss_manifest import LossManifest, config_digest, file_stamp
+from uk.co.ramp.param.store import SampleStore
+
+_worker = {}
+
+
+def init_worker(registry, files, check):
+    _worker['registry'] = registry
+    _worker['files'] = files
+    _worker['check'] = check
+
+
+def evaluate_sample(job):
+    """
+    Losses of one archived sample (label, data directory, recorded fingerprints, recorded losses),
+    where the recorded losses are returned as they are if the fingerprints are unchanged.
+    Errors are returned as a message instead of being raised.
+    """
+    label, data_dir, stamps, losses = job
+    try:
+        paths = ['{}/{}'.format(data_dir, name) for name in _worker['files']]
+        new_stamps = [file_stamp(path, _worker['check']) for path in paths]
+        if losses is not None and new_stamps == stamps:
+            return label, stamps, losses, False, None
+        values = np.array(_worker['registry'].evaluate(*paths), dtype=np.float64).tolist()
+        return label, new_stamps, values, True, None
+    except Exception as e:
+        return label, None, None, False, '{}: {}'.format(type(e).__name__, e)
+
+
+def archived_samples(top_output_dir, jobname):
+    """
+    Index labels and data directories of the sample{i} directories, ordered by i.
+    """
+    found = []
+    for name in os.listdir(top_output_dir):
+        match = re.match(r'^sample(\d+)$', name)
+        if match is not None and os.path.isdir('{}/{}/data'.format(top_output_dir, name)):
+            found.append((int(match.group(1)), '{}/{}/data'.format(top_output_dir, name)))
+    return [('{}.sample{}'.format(jobname, trial), data_dir) for trial, data_dir in sorted(found)]
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.0.1')
+
+    def _getopt(key, default):
+        return args[key] if key in args and args[key] is not None else default
+
+    top_output_dir = args['<OUTPUT_DIR>']
+    registry = LossRegistry.load(_getopt('--loss-config', None))
+    output_summary_file = _getopt('--output-summary-file', 'Compartments.csv')
+    output_stat_file = _getopt('--output-stat-file', 'stats.txt')
+    check = _getopt('--check', 'mtime')
+    n_jobs = int(_getopt('--n-jobs', 4))
+    save_every = int(_getopt('--save-every', 1000))
+    sample_format = _getopt('--sample-format', 'csv')
+    if check not in ['mtime', 'hash']:
+        raise ValueError('--check must be either mtime or hash')
+
+    jobname = _getopt('--job-name', None)
+    if jobname is None:
+        with open('{}/checkpoint.json'.format(top_output_dir), 'r') as fin:
+            jobname = json.load(fin)['job_name']
+
+    files = [output_summary_file, output_stat_file]
+    manifest = LossManifest(top_output_dir, config_digest(registry), registry.names, files, check=check)
+    samples = archived_samples(top_output_dir, jobname)
+
+    # Only the samples recorded in input_parameter_samples are kept, as draw_parameters.py may have been interrupted
+    store = SampleStore(top_output_dir, sample_format)
+    X_index = None
+    if store.exists('input_parameter_samples'):
+        X_index = store.read('input_parameter_samples').index
+        recorded = set(X_index)
+        samples = [(label, data_dir) for label, data_dir in samples if label in recorded]
+
+    jobs = []
+    for label, data_dir in samples:
+        entry = manifest.samples.get(label)
+        jobs.append((label, data_dir) + ((None, None) if entry is None else (entry['stamps'], entry['losses'])))
+
+    results = {}
+    errors = []
+    n_evaluated = 0
+    pool = Pool(n_jobs, initializer=init_worker, initargs=(registry, files, check)) if n_jobs > 1 else None
+    if pool is None:
+        init_worker(registry, files, check)
+        outputs = (evaluate_sample(job) for job in jobs)
+    else:
+        # Results arrive as they finish, so that the manifest saved on the way covers the finished samples
+        outputs = pool.imap_unordered(evaluate_sample, jobs, chunksize=max(1, min(100, len(jobs) // (4 * n_jobs))))
+    for label, stamps, losses, evaluated, error in outputs:
+        if error is not None:
+            errors.append({'sample': label, 'error': error})
+            continue
+        results[label] = losses
+        if evaluated:
+            manifest.update(label, stamps, losses)
+            n_evaluated += 1
+            if n_evaluated % save_every == 0:
+                manifest.save()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    manifest.save()
+
+    labels = [label for label, _ in samples if label in results]
+    Y = pd.DataFrame(
+        data=np.array([results[label] for label in labels]).reshape(len(labels), len(registry.names)),
+        index=labels,
+        columns=registry.names)
+    if X_index is not None:
+        # Failed and missing samples stay as rows of NaN, so that X and Y can be paired by position
+        Y = Y.reindex(X_index)
+    store.write('output_loss_samples', Y)
+    pd.DataFrame(errors, columns=['sample', 'error']).to_csv('{}/recompute_report.csv'.format(top_output_dir), index=False)
+    print('{} samples: {} evaluated, {} unchanged, {} failed'.format(
+        len(samples), n_evaluated, len(results) - n_evaluated, len(errors)))
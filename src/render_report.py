@@ -0,0 +1,56 @@
+"""Render the PDF reports of meta models fitted by analyse_sensitivity.py
+Plots are drawn from the SHAP values and predictions cached in <metric>.shap.npz, without refitting or reloading
+the models, so that the reports can be drawn again with other options.
+Pages of all metrics are drawn in parallel by --n-jobs processes.
+
+Usage:
+  render_report.py <WORK_DIR> [--metric=<metric>...] [--n-jobs=<njobs>] [--fast] [--max-points=<n>] [--seed=<seed>]
+  render_report.py (-h | --help)
+  render_report.py --version
+
+Options:
+  -h --help                       Show this screen.
+  --version                       Show version.
+  --metric=<metric>               Metric to be reported, which can be repeated. All metrics with cached SHAP values by default.
+  --n-jobs=<njobs>                Number of processes drawing pages [default: 1].
+  --fast                          Bin the forecast scatter into hexagons, and subsample the SHAP plots, for large samples.
+  --max-points=<n>                Number of points above which the fast mode bins or subsamples [default: 5000].
+  --seed=<seed>                   Random seed of the subsamples [default: 1234].
+  
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from docopt import docopt
+from os.path import dirname, realpath
+import matplotlib
+matplotlib.use('Agg')
+sys.path.append(dirname(realpath(__file__)))
+from uk.co.ramp.param.report import submit_report, write_report
+from uk.co.ramp.param.store import SampleStore
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.0.1')
+
+    def _getopt(key, default):
+        return args[key] if key in args and args[key] is not None else default
+
+    workdir = _getopt('<WORK_DIR>', None)
+    metrics = _getopt('--metric', [])
+    n_jobs = int(_getopt('--n-jobs', 1))
+    fast = _getopt('--fast', False)
+    max_points = int(_getopt('--max-points', 5000))
+    seed = int(_getopt('--seed', 1234))
+
+    if len(metrics) == 0:
+        metrics = [
+            metric for metric in SampleStore(workdir).columns('output_loss_samples')
+            if os.path.exists('{}/{}.shap.npz'.format(workdir, metric))]
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        # Pages of every metric are submitted at once, and each PDF is written when its pages are drawn
+        futures = [(metric, submit_report(executor, workdir, metric, fast=fast, max_points=max_points, seed=seed)) for metric in metrics]
+        for metric, pages in futures:
+            write_report(workdir, metric, [page.result() for page in pages])
+            print('{}/{}.pdf'.format(workdir, metric))
@@ -0,0 +1,190 @@
+"""Running the whole analysis as a pipeline of stages, in place of run_all.sh
+The stages are the draws of parameter samples by draw_parameters.py in n tasks, their merge by unify_draws.py,
+the analysis of each metric by analyse_sensitivity.py, the table of all importances, and the frontier by policy_frontier.py.
+Each stage runs as soon as the stages it reads from have finished, up to --n-jobs stages at once.
+A stage is skipped when the hashes of its input files, code and options, and of its output files, are the same as
+when it last finished, which are recorded under WORK_DIR/.pipeline together with the logs of the stages.
+
+Usage:
+  run_pipeline.py <WORK_DIR> [--n-tasks=<n>] [--n-simulations=<n_sim>] [--seed=<seed>] [--java-project-dir=<JPDIR>] [--loss-config=<file>] [--design=<design>] [--resume] [--metric=<metric>...] [--metricA=<output_metric>] [--metricB=<output_metric>] [--report=<mode>] [--sobol-samples=<n>] [--executor=<exec>] [--sbatch-args=<args>] [--n-jobs=<njobs>] [--force=<stage>...] [--dry-run]
+  run_pipeline.py (-h | --help)
+  run_pipeline.py --version
+
+Options:
+  -h --help                       Show this screen.
+  --version                       Show version.
+  --n-tasks=<n>                   Number of draw stages, each in WORK_DIR/job_<i> [default: 10].
+  --n-simulations=<n_sim>         Number of simulations per draw stage [default: 100].
+  --seed=<seed>                   Random seed, where draw stage i uses seed + i [default: 1234].
+  --java-project-dir=<JPDIR>      Project directory of Contact Tracing Model Java codes
+  --loss-config=<file>            JSON file of the loss metrics (see uk/co/ramp/exec/default_losses.json)
+  --design=<design>               Design of the parameter draws, either random, sequential, sobol or lhs [default: random].
+  --resume                        Let the draw stages continue the trials recorded by an interrupted run.
+  --metric=<metric>               Metric to be analysed, which can be repeated. All metrics of the loss config by default.
+  --metricA=<output_metric>       X-axis metric of the frontier [default: person_days_in_isolation].
+  --metricB=<output_metric>       Y-axis metric of the frontier [default: total_infections].
+  --report=<mode>                 PDF reports of analyse_sensitivity.py, either full, fast or none [default: full].
+  --sobol-samples=<n>             Number of base samples of the Sobol indices of analyse_sensitivity.py [default: 0].
+  --executor=<exec>               Where the draw and analysis stages run, either local (subprocesses) or slurm (sbatch) [default: local].
+  --sbatch-args=<args>            Options of sbatch for every job, e.g. "-A DIRAC-DC003-CPU -p skylake --time=01:00:00"
+  --n-jobs=<njobs>                Number of stages running at once [default: 1].
+  --force=<stage>...              Stage to be run even if it is current, which can be repeated.
+  --dry-run                       Only list the stages to be run.
+
+"""
+
+import os
+import shlex
+import sys
+import pandas as pd
+from docopt import docopt
+from os.path import expanduser, dirname, realpath
+sys.path.append(dirname(realpath(__file__)))
+from uk.co.ramp.exec.losses import LossRegistry
+from uk.co.ramp.exec.pipeline import Stage, LocalExecutor, SlurmExecutor, run_pipeline
+
+sample_names = ['input_parameter_samples', 'output_loss_samples']
+
+
+def merge_importances(workdir, metrics):
+    """
+    Function of the stage that joins <metric>.importance.csv of all metrics into relative_importance.csv.
+    """
+    def merge():
+        imp = pd.concat(
+            [pd.read_csv('{}/{}.importance.csv'.format(workdir, metric), index_col=0) for metric in metrics], axis=1)
+        imp.to_csv('{}/relative_importance.csv'.format(workdir))
+    merge.__name__ = 'merge_importances'
+    return merge
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.0.1')
+
+    def _getopt(key, default):
+        return args[key] if key in args and args[key] is not None else default
+
+    workdir = realpath(args['<WORK_DIR>'])
+    n_tasks = int(_getopt('--n-tasks', 10))
+    n_simulations = int(_getopt('--n-simulations', 100))
+    seed = int(_getopt('--seed', 1234))
+    java_project_dir = realpath(_getopt('--java-project-dir', expanduser('~/git/Contact-Tracing-Model')))
+    loss_config = _getopt('--loss-config', None)
+    design = _getopt('--design', 'random')
+    resume = _getopt('--resume', False)
+    metric_a = _getopt('--metricA', 'person_days_in_isolation')
+    metric_b = _getopt('--metricB', 'total_infections')
+    report = _getopt('--report', 'full')
+    sobol_samples = int(_getopt('--sobol-samples', 0))
+    executor_name = _getopt('--executor', 'local')
+    sbatch_args = shlex.split(_getopt('--sbatch-args', ''))
+    n_jobs = int(_getopt('--n-jobs', 1))
+    force = _getopt('--force', [])
+    dry_run = _getopt('--dry-run', False)
+
+    src_dir = dirname(realpath(__file__))
+    package_dir = '{}/uk/co/ramp'.format(src_dir)
+    python = sys.executable
+    if loss_config is not None:
+        loss_config = realpath(loss_config)
+    metrics = _getopt('--metric', []) or LossRegistry.load(loss_config).names
+    # policy_frontier.py finds the package through PYTHONPATH, which the subprocesses and sbatch jobs inherit
+    os.environ['PYTHONPATH'] = os.pathsep.join([src_dir] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p])
+
+    try:
+        os.mkdir(workdir)
+    except:
+        pass
+
+    stages = []
+    job_dirs = ['{}/job_{}'.format(workdir, task) for task in range(1, n_tasks + 1)]
+    for task, job_dir in enumerate(job_dirs, 1):
+        command = [
+            python, '{}/draw_parameters.py'.format(src_dir), job_dir,
+            '--job-name=job_{}'.format(task),
+            '--n-simulations={}'.format(n_simulations),
+            '--seed={}'.format(seed + task),
+            '--java-project-dir={}'.format(java_project_dir),
+            '--design={}'.format(design)]
+        if loss_config is not None:
+            command.append('--loss-config={}'.format(loss_config))
+        if resume:
+            command.append('--resume')
+        stages.append(Stage(
+            'draw_{}'.format(task), command=command,
+            # The simulator and the default input files it copies are inputs, so that rebuilding the model reruns the draws
+            inputs=['{}/draw_parameters.py'.format(src_dir), '{}/gencfg'.format(package_dir), '{}/exec'.format(package_dir),
+                    '{}/build/install/ContactTracing'.format(java_project_dir), '{}/input'.format(java_project_dir)]
+            + ([loss_config] if loss_config is not None else []),
+            outputs=['{}/{}.csv'.format(job_dir, name) for name in sample_names]))
+
+    # The list of the job directories replaces the loop over workdirlist.txt of run_all.sh
+    dirlist_file = '{}/workdirlist.txt'.format(workdir)
+    dirlist = ''.join('{}\n'.format(job_dir) for job_dir in job_dirs)
+    previous = None
+    if os.path.exists(dirlist_file):
+        with open(dirlist_file, 'r') as fin:
+            previous = fin.read()
+    if previous != dirlist:
+        with open(dirlist_file, 'w') as fout:
+            fout.write(dirlist)
+    samples = ['{}/{}.csv'.format(workdir, name) for name in sample_names]
+    stages.append(Stage(
+        'unify', command=[python, '{}/unify_draws.py'.format(src_dir), dirlist_file, workdir],
+        deps=['draw_{}'.format(task) for task in range(1, n_tasks + 1)],
+        inputs=['{}/unify_draws.py'.format(src_dir), '{}/param/store.py'.format(package_dir), dirlist_file]
+        + [stage_output for stage in stages for stage_output in stage.outputs],
+        outputs=samples))
+
+    for metric in metrics:
+        stages.append(Stage(
+            'analyse_{}'.format(metric),
+            command=[
+                python, '{}/analyse_sensitivity.py'.format(src_dir), workdir,
+                '--metric={}'.format(metric),
+                '--seed={}'.format(seed),
+                '--report={}'.format(report),
+                '--sobol-samples={}'.format(sobol_samples)],
+            deps=['unify'],
+            inputs=['{}/analyse_sensitivity.py'.format(src_dir), '{}/param'.format(package_dir)] + samples,
+            outputs=['{}/{}{}'.format(workdir, metric, suffix) for suffix in (
+                ['.model', '.forest', '.shap.npz', '.importance.csv']
+                + (['.pdf'] if report != 'none' else [])
+                + (['.sobol_indices.csv'] if sobol_samples > 0 else []))]))
+
+    stages.append(Stage(
+        'importance', function=merge_importances(workdir, metrics),
+        deps=['analyse_{}'.format(metric) for metric in metrics],
+        inputs=['{}/{}.importance.csv'.format(workdir, metric) for metric in metrics],
+        outputs=['{}/relative_importance.csv'.format(workdir)],
+        params={'metrics': metrics}))
+
+    missing = [metric for metric in [metric_a, metric_b] if metric not in metrics]
+    if len(missing) > 0:
+        print('Warning: no frontier stage, as {} are not among the analysed metrics {}'.format(missing, metrics))
+    else:
+        stages.append(Stage(
+            'frontier',
+            command=[
+                python, '{}/policy_frontier.py'.format(src_dir), workdir,
+                '--metricA={}'.format(metric_a),
+                '--metricB={}'.format(metric_b),
+                '--seed={}'.format(seed)],
+            deps=['analyse_{}'.format(metric_a), 'analyse_{}'.format(metric_b)],
+            inputs=['{}/policy_frontier.py'.format(src_dir), '{}/param'.format(package_dir), '{}/gencfg'.format(package_dir)]
+            + samples + ['{}/{}.model'.format(workdir, metric) for metric in [metric_a, metric_b]],
+            outputs=['{}/frontier.{}'.format(workdir, name) for name in [
+                'average_case_policies.csv', 'worst_case_policies.csv', 'tradeoffs.pdf']]))
+
+    if executor_name == 'local':
+        executor = LocalExecutor()
+    elif executor_name == 'slurm':
+        executor = SlurmExecutor(sbatch_args)
+    else:
+        raise ValueError('--executor must be either local or slurm')
+
+    status = run_pipeline(stages, '{}/.pipeline'.format(workdir), executor, n_jobs=n_jobs, force=force, dry_run=dry_run)
+    failed = [name for name, s in status.items() if s in ['failed', 'cancelled']]
+    if len(failed) > 0:
+        print('Failed or cancelled stages: {}. See the logs in {}/.pipeline'.format(failed, workdir))
+        sys.exit(1)
@@ -0,0 +1,181 @@
+"""Long-lived Simulation Worker that Keeps One Warm JVM of Contact Tracing Model
+Jobs are sent by draw_parameters.py with --worker-address, and the worker runs them one at a time.
+JPype (https://github.com/jpype-project/jpype) is required to host the JVM inside a child process of this one.
+The main method of the model is called through java/ExitGuard.java, compiled at startup by javac of JAVA_HOME or of the PATH,
+which turns System.exit inside the model into the exit status of the job instead of ending the JVM.
+Java 18 to 23 need --jvm-option=-Djava.security.manager=allow for it, and on Java 24 or later (or without javac)
+System.exit ends the whole JVM. The child process is then started again on the same socket,
+while the job that was running is reported to draw_parameters.py as a lost connection and run again by launching the binary.
+
+Usage:
+  simulation_worker.py <ADDRESS> [--java-project-dir=<JPDIR>] [--main-class=<class>] [--jvm-option=<opt>...]
+  simulation_worker.py (-h | --help)
+  simulation_worker.py --version
+
+Options:
+  -h --help                       Show this screen.
+  --version                       Show version.
+  --java-project-dir=<JPDIR>      Project directory of Contact Tracing Model Java codes
+  --main-class=<class>            Java main class. Read from the gradle start script if not given.
+  --jvm-option=<opt>              Option passed to the JVM such as -Xmx4g. Can be repeated.
+
+<ADDRESS> is either 'host:port' for TCP or a path of a Unix domain socket.
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import traceback
+from docopt import docopt
+from glob import glob
+from os.path import expanduser, dirname, realpath
+sys.path.append(dirname(realpath(__file__)))
+
+
+def find_main_class(java_project_dir):
+    """
+    The gradle start script passes the main class right after the classpath.
+    """
+    with open('{}/build/install/ContactTracing/bin/ContactTracing'.format(java_project_dir), 'r') as fin:
+        script = fin.read()
+    match = re.search(r'-classpath\s+"\\"\$CLASSPATH\\""\s*\\?\s*([\w.$]+)', script)
+    if match is None:
+        raise ValueError('Main class is not found in the start script. Use --main-class.')
+    return match.group(1)
+
+
+def compile_exit_guard(class_dir):
+    """
+    Compile java/ExitGuard.java into class_dir, and return whether it succeeded.
+    """
+    java_home = os.environ.get('JAVA_HOME')
+    javac = os.path.join(java_home, 'bin', 'javac') if java_home else shutil.which('javac')
+    if javac is None or not os.path.exists(javac):
+        print('javac is not found, so System.exit inside the model ends the JVM of the worker')
+        return False
+    source = '{}/java/ExitGuard.java'.format(dirname(realpath(__file__)))
+    result = subprocess.run(
+        [javac, '-source', '8', '-target', '8', '-d', class_dir, source],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode != 0:
+        print(result.stdout)
+        print('ExitGuard.java failed to compile, so System.exit inside the model ends the JVM of the worker')
+        return False
+    return True
+
+
+class SimulationJobHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if len(line.strip()) == 0:
+                continue
+            job = json.loads(line.decode('utf-8'))
+            exitcode = self.server.run_job(job['input_dir'], job['output_dir'], job['seed'])
+            self.wfile.write((json.dumps({'exitcode': exitcode}) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class SimulationWorker(object):
+    '''
+    Call the main method of Contact Tracing Model repeatedly inside one JVM.
+    Jobs are run one at a time because the Java model is not guaranteed to be thread-safe.
+    '''
+
+    def __init__(self, java_project_dir, main_class=None, jvm_options=None, guard_dir=None):
+        import jpype
+        self.jpype = jpype
+        if main_class is None:
+            main_class = find_main_class(java_project_dir)
+        classpath = sorted(glob('{}/build/install/ContactTracing/lib/*.jar'.format(java_project_dir)))
+        if guard_dir is not None:
+            classpath.append(guard_dir)
+        jpype.startJVM(*(jvm_options or []), classpath=classpath, convertStrings=False)
+        self.main_class = main_class
+        self.main = jpype.JClass(main_class).main
+        self.guard = None
+        if guard_dir is not None:
+            try:
+                guard = jpype.JClass('ExitGuard')
+                guard.install()
+                self.guard = guard
+            except Exception as e:
+                print('System.exit inside the model ends the JVM of the worker, because ExitGuard is not installed: {}'.format(e))
+
+    def run_job(self, input_dir, output_dir, seed):
+        args = [
+            '--overrideInputFolderLocation={}'.format(input_dir),
+            '--overrideOutputFolderLocation={}'.format(output_dir),
+            '--seed={}'.format(seed)]
+        jargs = self.jpype.JArray(self.jpype.JString)(args)
+        try:
+            if self.guard is not None:
+                return int(self.guard.run(self.main_class, jargs))
+            self.main(jargs)
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
+
+
+def serve(server, ready, java_project_dir, main_class, jvm_options, guard_dir):
+    """
+    Start the JVM in this child process and answer the jobs on the listening socket of server,
+    until the process is ended, for example by System.exit inside the model without ExitGuard.
+    """
+    worker = SimulationWorker(java_project_dir, main_class=main_class, jvm_options=jvm_options, guard_dir=guard_dir)
+    server.run_job = worker.run_job
+    ready.set()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.0.1')
+
+    def _getopt(key, default):
+        return args[key] if key in args and args[key] is not None else default
+
+    address = _getopt('<ADDRESS>', None)
+    java_project_dir = _getopt('--java-project-dir', expanduser('~/git/Contact-Tracing-Model'))
+    main_class = _getopt('--main-class', None)
+    jvm_options = _getopt('--jvm-option', [])
+
+    if ':' in address and not os.path.exists(address):
+        host, port = address.rsplit(':', 1)
+        server = socketserver.TCPServer((host, int(port)), SimulationJobHandler)
+    else:
+        address = os.path.abspath(address)
+        if os.path.exists(address):
+            os.remove(address)
+        server = socketserver.UnixStreamServer(address, SimulationJobHandler)
+
+    guard_dir = tempfile.mkdtemp()
+    if not compile_exit_guard(guard_dir):
+        shutil.rmtree(guard_dir)
+        guard_dir = None
+    # Same working directory as the process launched by draw_parameters.py
+    os.chdir(java_project_dir)
+    # The listening socket is inherited by every child process that hosts the JVM
+    context = multiprocessing.get_context('fork')
+    try:
+        while True:
+            ready = context.Event()
+            process = context.Process(target=serve, args=(server, ready, java_project_dir, main_class, jvm_options, guard_dir))
+            process.start()
+            process.join()
+            if not ready.is_set():
+                raise RuntimeError('JVM of the simulation worker failed to start with exit code {}'.format(process.exitcode))
+            print('JVM of the simulation worker ended with exit code {}, restarting'.format(process.exitcode))
+    finally:
+        server.server_close()
+        if guard_dir is not None:
+            shutil.rmtree(guard_dir)
+        if server.address_family == socket.AF_UNIX:
+            os.remove(address)
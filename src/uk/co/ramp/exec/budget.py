@@ -0,0 +1,59 @@
+'''
+Budget of the threads of the jobs submitted to a pool of processes.
+'''
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+
+class ThreadBudget(object):
+    '''
+    Submit jobs to an executor such that the jobs running at once use at most n_threads threads in total.
+    A job holds its threads until it finishes, and the jobs that do not fit wait in the order of submission.
+    submit() takes single-threaded jobs as the executor does, so that the budget can be passed instead of it.
+    The returned futures are resolved by wait(), which the caller repeats until no job is running.
+    '''
+
+    def __init__(self, executor, n_threads):
+        self.executor = executor
+        self.n_threads = n_threads
+        self._running = {}
+        self._backlog = deque()
+
+    def submit(self, fn, *args):
+        return self.submit_threads(lambda threads: self.executor.submit(fn, *args), 1)
+
+    def submit_threads(self, start, max_threads):
+        """
+        Future of the job submitted by start(threads), which is called as soon as a thread is free,
+        with up to max_threads of the free threads.
+        """
+        future = Future()
+        self._backlog.append((future, start, max_threads))
+        self._dispatch()
+        return future
+
+    def free(self):
+        return self.n_threads - sum(threads for _, threads in self._running.values())
+
+    def _dispatch(self):
+        while len(self._backlog) > 0 and self.free() > 0:
+            future, start, max_threads = self._backlog.popleft()
+            threads = min(max_threads, self.free())
+            self._running[start(threads)] = (future, threads)
+
+    def wait(self):
+        """
+        Block until a running job finishes, resolve the futures of the finished jobs, and start the waiting jobs.
+        Returns False when no job was running.
+        """
+        if len(self._running) == 0:
+            return False
+        wait(list(self._running), return_when=FIRST_COMPLETED)
+        for job in [job for job in self._running if job.done()]:
+            future, _ = self._running.pop(job)
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+        self._dispatch()
+        return True
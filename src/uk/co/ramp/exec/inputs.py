@@ -0,0 +1,96 @@
+'''
+Input directories of the simulations, linked to one shared template of the static input files.
+'''
+import json
+import os
+import shutil
+import stat
+
+
+class InputTemplate(object):
+    '''
+    Prepare the input folder of one simulation from the default files listed in input/inputLocations.json.
+    Files whose contents change in each trial are written, and the other files are taken from a shared template
+    according to link:
+        'copy'     : copy the default files into every input folder, as the Java model expects by default
+        'hardlink' : hardlink to a read-only snapshot of the default files (falls back to copy across file systems)
+        'symlink'  : symlink to a read-only snapshot of the default files
+    '''
+
+    link_modes = ['copy', 'hardlink', 'symlink']
+
+    def __init__(self, java_project_dir, template_dir=None, link='copy'):
+        if link not in InputTemplate.link_modes:
+            raise ValueError('link must be one of {}'.format(InputTemplate.link_modes))
+        self.java_project_dir = java_project_dir
+        self.link = link
+        with open('{}/input/inputLocations.json'.format(java_project_dir), 'r') as fin:
+            self.input_locations = json.load(fin)
+        self.source_dir = '{}/input'.format(java_project_dir)
+        if link != 'copy':
+            if template_dir is None:
+                raise ValueError('template_dir is required when link={}'.format(link))
+            self.source_dir = os.path.abspath(template_dir)
+            self._snapshot()
+
+    def _snapshot(self):
+        """
+        Copy the default files once, so that later edits in the Java project do not change the running campaign.
+        """
+        try:
+            os.mkdir(self.source_dir)
+        except:
+            pass
+        for filename in self.input_locations.values():
+            dst = '{}/{}'.format(self.source_dir, filename)
+            if not os.path.exists(dst):
+                shutil.copy2('{}/input/{}'.format(self.java_project_dir, filename), dst)
+                os.chmod(dst, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    def load(self, filename):
+        """
+        Default contents of a json input file.
+        """
+        with open('{}/{}'.format(self.source_dir, filename), 'r') as fin:
+            return json.load(fin)
+
+    def prepare(self, input_dir, contents):
+        """
+        Write the json files given by contents (a dictionary from file name to json object) into input_dir,
+        and put the rest of the input files by self.link.
+        """
+        for filename in self.input_locations.values():
+            dst = '{}/{}'.format(input_dir, filename)
+            if filename in contents:
+                # Never write through a link to the shared template
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                with open(dst, 'w') as fout:
+                    json.dump(contents[filename], fout, sort_keys=True, indent=2)
+            else:
+                self._put(filename, dst)
+
+        for filename in contents.keys():
+            if filename not in self.input_locations.values():
+                with open('{}/{}'.format(input_dir, filename), 'w') as fout:
+                    json.dump(contents[filename], fout, sort_keys=True, indent=2)
+
+    def _put(self, filename, dst):
+        src = '{}/{}'.format(self.source_dir, filename)
+        if self.link == 'copy':
+            # dst may be a link to the template made by a previous run in another mode
+            if os.path.lexists(dst):
+                os.remove(dst)
+            shutil.copy2(src, dst)
+            return
+        if os.path.lexists(dst):
+            if os.path.exists(dst) and os.path.samefile(src, dst):
+                return
+            os.remove(dst)
+        if self.link == 'symlink':
+            os.symlink(src, dst)
+        else:
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
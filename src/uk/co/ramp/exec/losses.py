@@ -0,0 +1,250 @@
+'''
+Loss metrics of one simulation, computed from its output files by a registry of metric definitions.
+'''
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+def _number(text):
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _lines(path, buffer_size):
+    """
+    Lines of a text file read through a buffer of buffer_size bytes.
+    """
+    with io.open(path, 'r', buffering=buffer_size, newline=None) as fin:
+        for line in fin:
+            line = line.rstrip('\n')
+            if len(line.strip()) > 0:
+                yield line
+
+
+def scan_compartments(path, maxima=('sev',), last=('d', 'r'), buffer_size=1 << 16, chunk_rows=1 << 16):
+    """
+    Maximum of the columns maxima and values at the final row of the columns last in a CSV file
+    of time-series such as Compartments.csv, in one pass without keeping the rows.
+    A file smaller than buffer_size is scanned line by line, splitting only the fields up to the rightmost needed column.
+    A larger file is parsed by pandas in chunks of chunk_rows rows, converting only the needed columns.
+    Returns two dictionaries from column name to value.
+    """
+    lines = _lines(path, buffer_size)
+    # The header is normalised once, so that both paths find the columns by the same names
+    header = [col.strip() for col in next(lines).split(',')]
+    positions = {col: header.index(col) for col in list(maxima) + list(last)}
+
+    if os.path.getsize(path) > buffer_size:
+        lines.close()
+        max_values = {col: None for col in maxima}
+        chunk = None
+        usecols = sorted(set(positions.values()))
+        for chunk in pd.read_csv(path, usecols=usecols, skipinitialspace=True, chunksize=chunk_rows):
+            chunk.columns = [header[j] for j in usecols]
+            for col in maxima:
+                value = chunk[col].max()
+                if max_values[col] is None or value > max_values[col]:
+                    max_values[col] = value
+        if chunk is None or chunk.shape[0] == 0:
+            raise ValueError('No rows in {}'.format(path))
+        return max_values, {col: chunk[col].iloc[-1] for col in last}
+
+    n_split = max(positions.values()) + 1
+    max_positions = [(col, positions[col]) for col in maxima]
+
+    max_values = {col: None for col in maxima}
+    fields = None
+    for line in lines:
+        fields = line.split(',', n_split)
+        for col, j in max_positions:
+            value = _number(fields[j])
+            if max_values[col] is None or value > max_values[col]:
+                max_values[col] = value
+    if fields is None:
+        raise ValueError('No rows in {}'.format(path))
+    last_values = {col: _number(fields[positions[col]]) for col in last}
+    return max_values, last_values
+
+
+def read_stat(path, name, buffer_size=1 << 16):
+    """
+    Value of the line 'name, value' of a headerless CSV file such as stats.txt, reading up to that line.
+    """
+    for line in _lines(path, buffer_size):
+        key, _, value = line.partition(',')
+        if key.strip() == name:
+            try:
+                return _number(value)
+            except ValueError:
+                return value.strip()
+    raise KeyError('{} is not found in {}'.format(name, path))
+
+
+class SimulationOutputs(object):
+    '''
+    Columns of the output time-series and stats of one simulation, each file being read at most once.
+    When no metric needs whole series, Compartments.csv is only scanned for the maxima and final values by scan_compartments.
+    '''
+
+    def __init__(self, output_summary_file, output_stat_file, series=(), maxima=(), last=(), time_column='time'):
+        self.output_stat_file = output_stat_file
+        self.time_column = time_column
+        self._stats = {}
+        if len(series) == 0:
+            self._series = None
+            self._max, self._last = scan_compartments(output_summary_file, maxima=tuple(maxima), last=tuple(last))
+            return
+        columns = set(series) | set(maxima) | set(last) | {time_column}
+        df = pd.read_csv(output_summary_file, usecols=lambda col: col.strip() in columns)
+        df.columns = [col.strip() for col in df.columns]
+        if df.shape[0] == 0:
+            raise ValueError('No rows in {}'.format(output_summary_file))
+        self._series = {col: df[col].values for col in df.columns}
+        self._max = {col: self._series[col].max() for col in maxima}
+        self._last = {col: self._series[col][-1] for col in last}
+
+    def series(self, columns):
+        """
+        Sum of the columns at every time.
+        """
+        return np.sum([self._series[col] for col in columns], axis=0)
+
+    def time(self):
+        return self._series[self.time_column]
+
+    def max(self, column):
+        return self._max[column]
+
+    def last(self, column):
+        return self._last[column]
+
+    def stat(self, key):
+        if key not in self._stats:
+            self._stats[key] = read_stat(self.output_stat_file, key)
+        return self._stats[key]
+
+
+def dtw_distance(x, y):
+    """
+    Dynamic time warping distance between two series by the absolute difference, where the cells of each
+    anti-diagonal of the cost matrix are updated at once.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n, m = len(x), len(y)
+    D = np.full((n + 1, m + 1), np.inf)
+    D[0, 0] = 0.0
+    for k in range(2, n + m + 1):
+        i = np.arange(max(1, k - m), min(n, k - 1) + 1)
+        j = k - i
+        D[i, j] = np.abs(x[i - 1] - y[j - 1]) + np.minimum(np.minimum(D[i - 1, j], D[i, j - 1]), D[i - 1, j - 1])
+    return D[n, m]
+
+
+class LossMetric(object):
+    '''
+    One loss metric defined by a dictionary of the config file, whose 'type' is one of
+        'peak'         : maximum over time of the sum of 'columns'
+        'final'        : sum of 'columns' at the final time
+        'auc'          : area under the curve of the sum of 'columns' over time, by the trapezoidal rule
+        'time_to_peak' : first time when the sum of 'columns' is maximum
+        'dtw'          : DTW distance between the sum of 'columns' and 'observed_column' of the CSV file 'observed'
+        'ratio'        : ratio of the two metrics defined by the dictionaries 'numerator' and 'denominator'
+        'stat'         : value of the line 'key' in the stats file
+    '''
+
+    types = ['peak', 'final', 'auc', 'time_to_peak', 'dtw', 'ratio', 'stat']
+
+    def __init__(self, definition, base_dir='.'):
+        self.name = definition.get('name')
+        self.type = definition['type']
+        if self.type not in LossMetric.types:
+            raise ValueError('Loss metric type {} is not one of {}'.format(self.type, LossMetric.types))
+        self.columns = list(definition.get('columns', []))
+        if self.type == 'ratio':
+            self.numerator = LossMetric(definition['numerator'], base_dir)
+            self.denominator = LossMetric(definition['denominator'], base_dir)
+        if self.type == 'stat':
+            self.key = definition['key']
+        if self.type == 'dtw':
+            observed = definition['observed']
+            if not os.path.isabs(observed):
+                observed = os.path.join(base_dir, observed)
+            df = pd.read_csv(observed)
+            self.observed = df[definition.get('observed_column', self.columns[0])].values.astype(np.float64)
+
+    def needs(self):
+        """
+        Columns needed as whole series, as maxima, and as final values.
+        """
+        if self.type == 'ratio':
+            needs = [self.numerator.needs(), self.denominator.needs()]
+            return tuple(set(needs[0][k]) | set(needs[1][k]) for k in range(3))
+        if self.type == 'peak':
+            return (set(), set(self.columns), set()) if len(self.columns) == 1 else (set(self.columns), set(), set())
+        if self.type == 'final':
+            return set(), set(), set(self.columns)
+        if self.type == 'stat':
+            return set(), set(), set()
+        return set(self.columns), set(), set()
+
+    def evaluate(self, outputs):
+        if self.type == 'peak':
+            return outputs.max(self.columns[0]) if len(self.columns) == 1 else outputs.series(self.columns).max()
+        if self.type == 'final':
+            return np.sum([outputs.last(col) for col in self.columns])
+        if self.type == 'auc':
+            y = outputs.series(self.columns)
+            return float(np.sum((y[1:] + y[:-1]) * np.diff(outputs.time())) / 2.0)
+        if self.type == 'time_to_peak':
+            return outputs.time()[np.argmax(outputs.series(self.columns))]
+        if self.type == 'dtw':
+            return dtw_distance(outputs.series(self.columns), self.observed)
+        if self.type == 'ratio':
+            # Division by zero gives inf or nan rather than raising
+            return np.float64(self.numerator.evaluate(outputs)) / self.denominator.evaluate(outputs)
+        return outputs.stat(self.key)
+
+
+class LossRegistry(object):
+    '''
+    Ordered loss metrics loaded from a json config file of a list of metric definitions (see LossMetric),
+    where default_losses.json defines the default columns of output_loss_samples.
+    All metrics of one simulation are evaluated from one read of its output files.
+    '''
+
+    default_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_losses.json')
+
+    def __init__(self, definitions, base_dir='.'):
+        self.definitions = list(definitions)
+        self.metrics = [LossMetric(definition, base_dir) for definition in definitions]
+        self.names = [metric.name for metric in self.metrics]
+        if None in self.names or len(set(self.names)) != len(self.names):
+            raise ValueError('Every loss metric needs a unique name')
+
+    @classmethod
+    def load(cls, config_file=None):
+        """
+        Registry of config_file, or of default_losses.json when it is None.
+        Observed series of the DTW metrics are looked up relative to the config file.
+        """
+        if config_file is None:
+            config_file = cls.default_config
+        with open(config_file, 'r') as fin:
+            definitions = json.load(fin)
+        return cls(definitions, base_dir=os.path.dirname(os.path.abspath(config_file)))
+
+    def evaluate(self, output_summary_file, output_stat_file):
+        """
+        List of the metric values of one simulation.
+        """
+        needs = [metric.needs() for metric in self.metrics]
+        series, maxima, last = [set().union(*[need[k] for need in needs]) for k in range(3)]
+        outputs = SimulationOutputs(output_summary_file, output_stat_file, series=series, maxima=maxima, last=last)
+        return [metric.evaluate(outputs) for metric in self.metrics]
@@ -0,0 +1,226 @@
+'''
+Stages of a pipeline run in the order of their dependencies, skipped when the content hashes are unchanged.
+'''
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Stage(object):
+    '''
+    One step of a pipeline, which is either a command line or a python function without arguments.
+    inputs are the files (or directories) read by the stage, outputs are those written by it,
+    and params are the other settings that determine the outputs, all of which make the cache key of the stage.
+    A stage runs after the stages of its deps. A local stage runs on this machine whichever executor runs the others.
+    '''
+
+    def __init__(self, name, command=None, function=None, deps=(), inputs=(), outputs=(), params=None, local=False):
+        if (command is None) == (function is None):
+            raise ValueError('Stage {} needs either a command or a function'.format(name))
+        self.name = name
+        self.command = None if command is None else [str(arg) for arg in command]
+        self.function = function
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = {} if params is None else params
+        self.local = local or function is not None
+
+
+class ContentHashes(object):
+    '''
+    SHA-1 of files and directories, where the hash of a file is reused while its (mtime, size) stays the same,
+    so that large sample files are read only when they change. The table is kept in hashes.json of the cache directory.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_file = '{}/hashes.json'.format(cache_dir)
+        self.lock = threading.Lock()
+        self.table = {}
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, 'r') as fin:
+                self.table = json.load(fin)
+
+    def _file(self, path):
+        stat = os.stat(path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.table.get(key)
+        if entry is not None and entry['stamp'] == stamp:
+            return entry['sha1']
+        digest = hashlib.sha1()
+        with open(path, 'rb') as fin:
+            for block in iter(lambda: fin.read(1 << 20), b''):
+                digest.update(block)
+        with self.lock:
+            self.table[key] = {'stamp': stamp, 'sha1': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def digest(self, path):
+        """
+        Hash of a file, of a directory as the hashes of its files by relative path, or None if the path does not exist.
+        Compiled python files in __pycache__ are left out of directories.
+        """
+        if os.path.isdir(path):
+            entries = []
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    entries.append([os.path.relpath(full, path), self._file(full)])
+            return hashlib.sha1(json.dumps(entries).encode('utf-8')).hexdigest()
+        if os.path.exists(path):
+            return self._file(path)
+        return None
+
+    def save(self):
+        with self.lock:
+            tmp_file = '{}.tmp'.format(self.cache_file)
+            with open(tmp_file, 'w') as fout:
+                json.dump(self.table, fout)
+            os.replace(tmp_file, self.cache_file)
+
+
+class StageCache(object):
+    '''
+    Record of the finished stages in <cache_dir>/<stage>.json, each holding the key of the inputs, command and params
+    it ran with and the hashes of the outputs it wrote. A stage is current when both are unchanged,
+    so that a stage rerun with the same outputs does not invalidate the stages after it.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        try:
+            os.makedirs(cache_dir)
+        except:
+            pass
+        self.hashes = ContentHashes(cache_dir)
+
+    def key(self, stage):
+        payload = {
+            'command': stage.command,
+            'function': None if stage.function is None else stage.function.__name__,
+            'params': stage.params,
+            'inputs': [[path, self.hashes.digest(path)] for path in stage.inputs]}
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _record_file(self, stage):
+        return '{}/{}.json'.format(self.cache_dir, stage.name)
+
+    def is_current(self, stage, key):
+        if not os.path.exists(self._record_file(stage)):
+            return False
+        with open(self._record_file(stage), 'r') as fin:
+            record = json.load(fin)
+        if record['key'] != key:
+            return False
+        return all(self.hashes.digest(path) == digest and digest is not None for path, digest in record['outputs'])
+
+    def record(self, stage, key):
+        record = {'key': key, 'outputs': [[path, self.hashes.digest(path)] for path in stage.outputs]}
+        with open(self._record_file(stage), 'w') as fout:
+            json.dump(record, fout, indent=2)
+        self.hashes.save()
+
+
+class LocalExecutor(object):
+    '''
+    Runs command stages as subprocesses of this machine.
+    '''
+
+    def run(self, stage, log_file):
+        with open(log_file, 'w') as log:
+            return subprocess.call(stage.command, stdout=log, stderr=subprocess.STDOUT)
+
+
+class SlurmExecutor(object):
+    '''
+    Submits command stages to SLURM by sbatch --wait, which returns when the job finishes with its exit code.
+    sbatch_args are the options of sbatch for every job, such as the account and the partition.
+    '''
+
+    def __init__(self, sbatch_args=()):
+        self.sbatch_args = list(sbatch_args)
+
+    def run(self, stage, log_file):
+        command = ['sbatch', '--wait', '--job-name={}'.format(stage.name), '--output={}'.format(log_file)]
+        command += self.sbatch_args + ['--wrap', ' '.join(shlex.quote(arg) for arg in stage.command)]
+        return subprocess.call(command)
+
+
+def run_pipeline(stages, cache_dir, executor, n_jobs=1, force=(), dry_run=False):
+    """
+    Run the stages in an order of their deps, up to n_jobs stages at once.
+    A stage is skipped when the cache finds it current, and its key is computed only once its deps have finished,
+    because its inputs are the outputs of those stages. Stages named in force run regardless of the cache.
+    Logs of the commands are written into <cache_dir>/<stage>.log.
+    Returns a dictionary from stage name to 'skipped', 'done', 'failed', 'cancelled' (after a failed dep),
+    or 'stale' (to be run, in a dry run).
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError('Stage {} depends on unknown stage {}'.format(stage.name, dep))
+    cache = StageCache(cache_dir)
+    local_executor = LocalExecutor()
+    status = {}
+    running = {}
+
+    def execute(stage, key):
+        if stage.function is not None:
+            stage.function()
+            code = 0
+        else:
+            code = (local_executor if stage.local else executor).run(stage, '{}/{}.log'.format(cache_dir, stage.name))
+        if code == 0:
+            cache.record(stage, key)
+        return code
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        while len(status) < len(stages):
+            n_decided = len(status)
+            for stage in stages:
+                if stage.name in status or stage.name in running:
+                    continue
+                dep_status = [status.get(dep) for dep in stage.deps]
+                if any(s in ['failed', 'cancelled'] for s in dep_status):
+                    status[stage.name] = 'cancelled'
+                    print('{}: cancelled'.format(stage.name))
+                    continue
+                if not all(s in ['skipped', 'done', 'stale'] for s in dep_status):
+                    continue
+                # In a dry run, the stages after a stale stage are stale as well
+                key = None if 'stale' in dep_status else cache.key(stage)
+                if key is not None and stage.name not in force and cache.is_current(stage, key):
+                    status[stage.name] = 'skipped'
+                    print('{}: current'.format(stage.name))
+                    continue
+                if dry_run:
+                    status[stage.name] = 'stale'
+                    print('{}: to run'.format(stage.name))
+                    continue
+                print('{}: running'.format(stage.name))
+                running[stage.name] = pool.submit(execute, stage, key)
+            if len(running) == 0:
+                if len(status) == n_decided:
+                    raise ValueError('Stages {} have cyclic deps'.format([s.name for s in stages if s.name not in status]))
+                continue
+            finished, _ = wait(list(running.values()), return_when=FIRST_COMPLETED)
+            for name, future in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[name]
+                try:
+                    code = future.result()
+                except Exception as e:
+                    print('{}: {}: {}'.format(name, type(e).__name__, e))
+                    code = 1
+                status[name] = 'done' if code == 0 else 'failed'
+                print('{}: {}'.format(name, status[name]))
+    return status
@@ -0,0 +1,95 @@
+'''
+Launch of the Java Contact Tracing Model, and a pool of concurrent simulations.
+'''
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from uk.co.ramp.exec.worker import SimulationWorkerClient
+
+
+class ContactTracingSimulator(object):
+    '''
+    Launch the Java ContactTracing binary built under a Contact-Tracing-Model project directory.
+    When the addresses of simulation workers are given, jobs are sent to these warm JVMs first,
+    and a job that is not answered within worker_timeout seconds is launched as the binary instead.
+    '''
+
+    def __init__(self, java_project_dir, worker_addresses=None, worker_timeout=3600.0):
+        self.java_project_dir = java_project_dir
+        self.workers = [SimulationWorkerClient(address, timeout=worker_timeout) for address in (worker_addresses or [])]
+        self._install_lock = threading.Lock()
+
+    def command(self, input_dir, output_dir, seed):
+        return [
+            '{}/build/install/ContactTracing/bin/ContactTracing'.format(self.java_project_dir),
+            '--overrideInputFolderLocation={}'.format(input_dir),
+            '--overrideOutputFolderLocation={}'.format(output_dir),
+            '--seed={}'.format(seed)]
+
+    def run(self, input_dir, output_dir, seed, slot=0):
+        """
+        Run one simulation and block until it finishes.
+        The slot chooses a worker, and the binary is launched as a new process when that worker is not running
+        or the simulation fails inside it.
+        When the binary fails, it is re-installed by gradle and the simulation is retried.
+        """
+        if len(self.workers) > 0:
+            try:
+                if self.workers[slot % len(self.workers)].run(input_dir, output_dir, seed) == 0:
+                    return
+            except OSError:
+                pass
+
+        while True:
+            exitcode = subprocess.call(self.command(input_dir, output_dir, seed))
+            if exitcode == 0:
+                return
+            time.sleep(3)
+            # Concurrent simulations must not run gradle install on the same project at once
+            with self._install_lock:
+                subprocess.call(['gradle', 'install'])
+            time.sleep(3)
+
+
+class SimulationPool(object):
+    '''
+    Run up to n_parallel simulations at once, each of which occupies one slot.
+    The slot number identifies the working directory that is free to be overwritten by that simulation.
+    '''
+
+    def __init__(self, n_parallel=1):
+        self.n_parallel = n_parallel
+
+    def imap(self, func, iterable):
+        """
+        Apply func(item, slot) to every item and yield the results in the order of iterable.
+        Items are consumed lazily in the calling thread, so random draws made while iterating stay deterministic.
+        """
+        if self.n_parallel <= 1:
+            for item in iterable:
+                yield func(item, 0)
+            return
+
+        slots = Queue()
+        for slot in range(self.n_parallel):
+            slots.put(slot)
+
+        def _call(item):
+            slot = slots.get()
+            try:
+                return func(item, slot)
+            finally:
+                slots.put(slot)
+
+        # Keep a bounded number of pending jobs so that memory does not grow with n_simulations
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.n_parallel) as executor:
+            for item in iterable:
+                pending.append(executor.submit(_call, item))
+                if len(pending) >= 2 * self.n_parallel:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
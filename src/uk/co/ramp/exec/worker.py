@@ -0,0 +1,58 @@
+'''
+Client of the long-lived simulation workers of simulation_worker.py.
+'''
+import json
+import os
+import socket
+
+
+def open_connection(address, timeout=None):
+    """
+    Connect to a simulation worker.
+    The address is either 'host:port' for TCP or a path of a Unix domain socket.
+    """
+    if ':' in address and not os.path.exists(address):
+        host, port = address.rsplit(':', 1)
+        return socket.create_connection((host, int(port)), timeout=timeout)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+class SimulationWorkerClient(object):
+    '''
+    Send (input_dir, output_dir, seed) jobs to a simulation worker started by simulation_worker.py.
+    One job is one line of JSON, and the worker answers one line of JSON including the exit code.
+    connect_timeout limits the wait for the connection in seconds, and timeout that for the answer of one job,
+    so that a worker whose JVM hangs does not block draw_parameters.py.
+    '''
+
+    def __init__(self, address, timeout=3600.0, connect_timeout=10.0):
+        self.address = address
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+
+    def run(self, input_dir, output_dir, seed):
+        """
+        Run one simulation on the worker and return its exit code.
+        OSError is raised when the worker is not reachable or does not answer in time,
+        so that the caller can fall back to another launcher.
+        """
+        job = {
+            'input_dir': os.path.abspath(input_dir),
+            'output_dir': os.path.abspath(output_dir),
+            'seed': int(seed)}
+        with open_connection(self.address, timeout=self.connect_timeout) as sock:
+            sock.settimeout(self.timeout)
+            with sock.makefile('rw') as stream:
+                stream.write(json.dumps(job) + '\n')
+                stream.flush()
+                line = stream.readline()
+        if len(line) == 0:
+            raise ConnectionError('Simulation worker at {} closed the connection'.format(self.address))
+        return int(json.loads(line)['exitcode'])
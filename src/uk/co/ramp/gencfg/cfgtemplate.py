@@ -0,0 +1,83 @@
+'''
+Created on 2020/06/12
+
+@author: rikiya
+'''
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+
+class ConfigTemplate(object):
+    '''
+    Common interface of the generators of json files for Contact Tracing Model.
+    next() draws one sample as a dictionary, while sample(n) draws n samples at once as a DataFrame
+    whose columns are ordered as columns(). sample(n) consumes the random state in another order than n calls of next(),
+    which sequence(n) makes instead.
+    from_uniform(U) maps the rows of U in the unit hypercube to samples of the same distributions,
+    for quasi-random designs.
+    '''
+
+    def columns(self):
+        """
+        Names of the parameters in the order of next() and sample(n).
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def joint_columns(cls):
+        """
+        Lists of the columns that are not drawn independently of each other, such as a maximum drawn as the mean
+        plus a difference. Sensitivity analyses resample each list together as one factor.
+        """
+        return []
+
+    def next(self):
+        raise NotImplementedError()
+
+    def sample(self, n):
+        """
+        Simulate n vectors of parameters.
+        Results are obtained as a DataFrame of shape (n, len(columns())).
+        """
+        return pd.DataFrame(self._sample(n), columns=self.columns())
+
+    def _sample(self, n):
+        raise NotImplementedError()
+
+    def sequence(self, n):
+        """
+        Simulate n vectors of parameters by n calls of next(), which consume the random state in the same order
+        as the trials of the earlier versions of draw_parameters.py, so that their samples are drawn again from the same seed.
+        Results are obtained as a DataFrame of shape (n, len(columns())).
+        """
+        return pd.DataFrame([self.next() for _ in range(n)], columns=self.columns())
+
+    def n_uniforms(self):
+        """
+        Number of uniforms that determine one sample, which is the width of U of from_uniform(U).
+        """
+        raise NotImplementedError()
+
+    def from_uniform(self, U):
+        """
+        Samples mapped from the rows of U of shape (n, n_uniforms()) through the inverse CDFs of the distributions of sample(n).
+        Results are obtained as a DataFrame of shape (n, len(columns())).
+        """
+        return pd.DataFrame(self._from_uniform(np.asarray(U, dtype=np.float64)), columns=self.columns())
+
+    def _from_uniform(self, U):
+        raise NotImplementedError()
+
+    @classmethod
+    def records(cls, samples):
+        """
+        Iterate over the rows of sample(n) as dictionaries of python scalars, which are the input of export().
+        """
+        columns = list(samples.columns)
+        for values in zip(*[samples[col].tolist() for col in columns]):
+            yield OrderedDict(zip(columns, values))
+
+    @classmethod
+    def export(cls, param_dict):
+        raise NotImplementedError()
@@ -0,0 +1,85 @@
+'''
+Quasi-random designs of the parameter draws through the inverse CDFs of the samplers.
+'''
+import numpy as np
+from collections import OrderedDict
+from scipy import stats
+
+designs = ['random', 'sequential', 'sobol', 'lhs']
+
+# Uniforms are kept away from 0 and 1, where the inverse CDFs of unbounded distributions diverge
+_eps = 1e-12
+
+
+def randint_ppf(u, low, high):
+    """
+    Inverse CDF of random_state.randint(low, high), i.e. of the integers in [low, high).
+    """
+    return np.minimum(low + np.floor(u * (high - low)).astype(np.int64), high - 1)
+
+
+def choice_ppf(u, values):
+    """
+    Inverse CDF of random_state.choice(values) of equal probabilities.
+    """
+    return np.asarray(values)[np.minimum(np.floor(u * len(values)).astype(np.int64), len(values) - 1)]
+
+
+def beta_ppf(u, a, b):
+    return stats.beta.ppf(u, a, b)
+
+
+def lognormal_ppf(u, mean, sigma):
+    """
+    Inverse CDF of random_state.lognormal(mean, sigma).
+    """
+    return np.exp(mean + sigma * stats.norm.ppf(u))
+
+
+def dirichlet_ppf(U, alpha):
+    """
+    Dirichlet vectors of U of shape (n, len(alpha)), as the normalised gamma variables of the columns of U.
+    """
+    gammas = np.column_stack([stats.gamma.ppf(U[:, i], a) for i, a in enumerate(alpha)])
+    return gammas / gammas.sum(axis=1, keepdims=True)
+
+
+def uniforms(design, n, d, seed=None):
+    """
+    Points of shape (n, d) in the unit hypercube, by a scrambled Sobol sequence or a Latin hypercube.
+    """
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError('--design={} requires scipy>=1.7'.format(design))
+    if design == 'sobol':
+        sampler = qmc.Sobol(d, scramble=True, seed=seed)
+        m = int(np.ceil(np.log2(max(n, 1))))
+        # Sobol points are balanced on powers of two, of which the first n points are taken
+        U = sampler.random_base2(m)[:n]
+    elif design == 'lhs':
+        U = qmc.LatinHypercube(d, seed=seed).random(n)
+    else:
+        raise ValueError('Design must be one of {}'.format(designs))
+    return np.clip(U, _eps, 1.0 - _eps)
+
+
+def draw_design(generators, n, design='random', seed=None):
+    """
+    Samples of shape (n, len(columns())) of each generator in an OrderedDict.
+    'random' draws each generator by its own random state as sample(n) does.
+    'sequential' draws the same distributions by n calls of next() of each generator as sequence(n) does,
+    which reproduces the samples of draw_parameters.py before sample(n) was introduced.
+    'sobol' and 'lhs' draw one joint low-discrepancy design over the uniforms of all generators,
+    and map each generator's block of columns through its inverse CDFs by from_uniform(U).
+    """
+    if design == 'random':
+        return OrderedDict([(name, generator.sample(n)) for name, generator in generators.items()])
+    if design == 'sequential':
+        return OrderedDict([(name, generator.sequence(n)) for name, generator in generators.items()])
+    widths = [generator.n_uniforms() for generator in generators.values()]
+    U = uniforms(design, n, sum(widths), seed=seed)
+    starts = np.cumsum([0] + widths)
+    return OrderedDict([
+        (name, generator.from_uniform(U[:, starts[i]:starts[i + 1]]))
+        for i, (name, generator) in enumerate(generators.items())])
@@ -5,12 +5,26 @@ Created on 2020/06/12
 '''
 from sklearn.utils import check_random_state
 from collections import OrderedDict
+from uk.co.ramp.gencfg.cfgtemplate import ConfigTemplate
+from uk.co.ramp.gencfg.design import randint_ppf, beta_ppf, lognormal_ppf
 
 
-class DiseaseSettings(object):
+class DiseaseSettings(ConfigTemplate):
     '''
     Generate diseaseSettings.json
     '''
+
+    # (name, range of mean, range of max - mean) of each time distribution
+    _time_ranges = [
+        ('time_latent', (3, 10), (5, 10)),
+        ('time_recovery_asymp', (3, 10), (5, 10)),
+        ('time_recovery_symp', (3, 10), (5, 10)),
+        ('time_recovery_syv', (3, 10), (5, 10)),
+        ('time_symptoms_onset', (3, 10), (5, 10)),
+        ('time_decline', (3, 10), (5, 10)),
+        ('time_death', (3, 10), (5, 10)),
+        ('time_test_administered', (1, 3), (1, 5)),
+        ('time_test_result', (1, 3), (1, 5))]
     
     def __init__(
             self,
@@ -77,6 +91,87 @@ class DiseaseSettings(object):
             )        
         
         return result
+    
+    def columns(self):
+        result = []
+        for name, _, _ in DiseaseSettings._time_ranges:
+            result.append('{}_mean'.format(name))
+            result.append('{}_max'.format(name))
+        result += [
+            'test_positive_accuracy',
+            'test_negative_accuracy',
+            'exposure_threshold',
+            'exposure_probability4unit_contact',
+            'exposure_exponent',
+            'random_infection_rate']
+        return result
+    
+    @classmethod
+    def joint_columns(cls):
+        return [['{}_mean'.format(name), '{}_max'.format(name)] for name, _, _ in DiseaseSettings._time_ranges]
+
+    def _sample(self, n):
+        random_state = self.random_state
+        result = OrderedDict()
+        for name, (mean_low, mean_high), (diff_low, diff_high) in DiseaseSettings._time_ranges:
+            result['{}_mean'.format(name)] = random_state.randint(low=mean_low, high=mean_high, size=n)
+            result['{}_max'.format(name)] = result['{}_mean'.format(name)] + random_state.randint(low=diff_low, high=diff_high, size=n)
+
+        result['test_positive_accuracy'] = random_state.beta(
+            self.test_acc_concentration * self.test_acc_mean,
+            self.test_acc_concentration * (1.0 - self.test_acc_mean),
+            size=n)
+        result['test_negative_accuracy'] = random_state.beta(
+            self.test_acc_concentration * self.test_acc_mean,
+            self.test_acc_concentration * (1.0 - self.test_acc_mean),
+            size=n)
+        
+        result['exposure_threshold'] = 50.0 * random_state.lognormal(0.0, 1.0, size=n)
+        result['exposure_probability4unit_contact'] = random_state.beta(
+            self.exposure_probability4unit_contact_concentration * self.exposure_probability4unit_contact_mean,
+            self.exposure_probability4unit_contact_concentration * (1.0 - self.exposure_probability4unit_contact_mean),
+            size=n)
+        result['exposure_exponent'] = random_state.lognormal(0.0, 0.3, size=n)
+        
+        result['random_infection_rate'] = random_state.beta(
+            self.random_infection_rate_concentration * self.random_infection_rate_mean,
+            self.random_infection_rate_concentration * (1.0 - self.random_infection_rate_mean),
+            size=n)
+        
+        return result
+
+    def n_uniforms(self):
+        return 2 * len(DiseaseSettings._time_ranges) + 6
+
+    def _from_uniform(self, U):
+        result = OrderedDict()
+        for k, (name, (mean_low, mean_high), (diff_low, diff_high)) in enumerate(DiseaseSettings._time_ranges):
+            result['{}_mean'.format(name)] = randint_ppf(U[:, 2 * k], mean_low, mean_high)
+            result['{}_max'.format(name)] = result['{}_mean'.format(name)] + randint_ppf(U[:, 2 * k + 1], diff_low, diff_high)
+        u = U[:, 2 * len(DiseaseSettings._time_ranges):]
+
+        result['test_positive_accuracy'] = beta_ppf(
+            u[:, 0],
+            self.test_acc_concentration * self.test_acc_mean,
+            self.test_acc_concentration * (1.0 - self.test_acc_mean))
+        result['test_negative_accuracy'] = beta_ppf(
+            u[:, 1],
+            self.test_acc_concentration * self.test_acc_mean,
+            self.test_acc_concentration * (1.0 - self.test_acc_mean))
+        
+        result['exposure_threshold'] = 50.0 * lognormal_ppf(u[:, 2], 0.0, 1.0)
+        result['exposure_probability4unit_contact'] = beta_ppf(
+            u[:, 3],
+            self.exposure_probability4unit_contact_concentration * self.exposure_probability4unit_contact_mean,
+            self.exposure_probability4unit_contact_concentration * (1.0 - self.exposure_probability4unit_contact_mean))
+        result['exposure_exponent'] = lognormal_ppf(u[:, 4], 0.0, 0.3)
+        
+        result['random_infection_rate'] = beta_ppf(
+            u[:, 5],
+            self.random_infection_rate_concentration * self.random_infection_rate_mean,
+            self.random_infection_rate_concentration * (1.0 - self.random_infection_rate_mean))
+        
+        return result
         
     @classmethod
     def export(cls, param_dict):
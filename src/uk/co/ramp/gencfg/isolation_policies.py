@@ -6,9 +6,11 @@ Created on 2020/06/12
 from copy import deepcopy
 from sklearn.utils import check_random_state
 from collections import OrderedDict
+from uk.co.ramp.gencfg.cfgtemplate import ConfigTemplate
+from uk.co.ramp.gencfg.design import randint_ppf, choice_ppf
 
 
-class IsolationPolicies(object):
+class IsolationPolicies(ConfigTemplate):
     '''
     Generate isolationPolicies.json
     '''
@@ -55,6 +57,55 @@ class IsolationPolicies(object):
                 result['{}_start_of_isolation_is_absolute'.format(sta)] = random_state.choice([0, 1])
         
         return result
+    
+    def columns(self):
+        result = ['alert_policy_prioritised', 'no_isolation_tested_negative']
+        for sta in IsolationPolicies._virus_statuses + IsolationPolicies._alert_statuses:
+            result.append('{}_isolation_time_mean'.format(sta))
+            result.append('{}_start_of_isolation_is_absolute'.format(sta))
+        return result
+    
+    def _sample(self, n):
+        random_state = self.random_state
+        result = OrderedDict()
+        
+        result['alert_policy_prioritised'] = random_state.choice([0, 1], size=n)
+        result['no_isolation_tested_negative'] = random_state.choice([0, 1], size=n)
+        if self.simplified:
+            is_absolute = random_state.choice([0, 1], size=n)
+            time_mean = random_state.randint(low=1, high=14, size=n)
+            for sta in IsolationPolicies._virus_statuses + IsolationPolicies._alert_statuses:
+                result['{}_isolation_time_mean'.format(sta)] = time_mean
+                result['{}_start_of_isolation_is_absolute'.format(sta)] = is_absolute
+        else:
+            for sta in IsolationPolicies._virus_statuses + IsolationPolicies._alert_statuses:
+                result['{}_isolation_time_mean'.format(sta)] = random_state.randint(low=1, high=14, size=n)
+                result['{}_start_of_isolation_is_absolute'.format(sta)] = random_state.choice([0, 1], size=n)
+        
+        return result
+
+    def n_uniforms(self):
+        if self.simplified:
+            return 4
+        return 2 + 2 * len(IsolationPolicies._virus_statuses + IsolationPolicies._alert_statuses)
+
+    def _from_uniform(self, U):
+        result = OrderedDict()
+        
+        result['alert_policy_prioritised'] = choice_ppf(U[:, 0], [0, 1])
+        result['no_isolation_tested_negative'] = choice_ppf(U[:, 1], [0, 1])
+        if self.simplified:
+            is_absolute = choice_ppf(U[:, 2], [0, 1])
+            time_mean = randint_ppf(U[:, 3], 1, 14)
+            for sta in IsolationPolicies._virus_statuses + IsolationPolicies._alert_statuses:
+                result['{}_isolation_time_mean'.format(sta)] = time_mean
+                result['{}_start_of_isolation_is_absolute'.format(sta)] = is_absolute
+        else:
+            for k, sta in enumerate(IsolationPolicies._virus_statuses + IsolationPolicies._alert_statuses):
+                result['{}_isolation_time_mean'.format(sta)] = randint_ppf(U[:, 2 + 2 * k], 1, 14)
+                result['{}_start_of_isolation_is_absolute'.format(sta)] = choice_ppf(U[:, 3 + 2 * k], [0, 1])
+        
+        return result
         
     @classmethod
     def export(cls, param_dict):
@@ -6,9 +6,11 @@ Created on 2020/06/12
 import numpy as np
 from sklearn.utils import check_random_state
 from collections import OrderedDict
+from uk.co.ramp.gencfg.cfgtemplate import ConfigTemplate
+from uk.co.ramp.gencfg.design import beta_ppf, dirichlet_ppf
 
 
-class PopulationSettings(object):
+class PopulationSettings(ConfigTemplate):
     '''
     Generate diseaseSettings.json
     '''
@@ -39,6 +41,45 @@ class PopulationSettings(object):
         result['gender_balance'] = random_state.beta(0.99 * 50.0, 0.01 * 50.0)
         
         return result
+    
+    def columns(self):
+        return ['population_distribution_{}'.format(i) for i in range(5)] + ['gender_balance']
+    
+    @classmethod
+    def joint_columns(cls):
+        # Shares of the Dirichlet population split sum to one
+        return [['population_distribution_{}'.format(i) for i in range(5)]]
+
+    def _sample(self, n):
+        random_state = self.random_state
+        result = OrderedDict()
+
+        alpha = np.array([0.1759, 0.1171, 0.4029, 0.1222, 0.1819]) * self.population_concentration
+        popdist = random_state.dirichlet(alpha, size=n)
+        popdist /= popdist.sum(axis=1, keepdims=True)
+        
+        for i in range(5):
+            result['population_distribution_{}'.format(i)] = popdist[:, i]
+        
+        result['gender_balance'] = random_state.beta(0.99 * 50.0, 0.01 * 50.0, size=n)
+        
+        return result
+
+    def n_uniforms(self):
+        return 6
+
+    def _from_uniform(self, U):
+        result = OrderedDict()
+
+        alpha = np.array([0.1759, 0.1171, 0.4029, 0.1222, 0.1819]) * self.population_concentration
+        popdist = dirichlet_ppf(U[:, :5], alpha)
+        
+        for i in range(5):
+            result['population_distribution_{}'.format(i)] = popdist[:, i]
+        
+        result['gender_balance'] = beta_ppf(U[:, 5], 0.99 * 50.0, 0.01 * 50.0)
+        
+        return result
         
     @classmethod
     def export(cls, param_dict):
@@ -6,9 +6,11 @@ Created on 2020/06/12
 from copy import deepcopy
 from sklearn.utils import check_random_state
 from collections import OrderedDict
+from uk.co.ramp.gencfg.cfgtemplate import ConfigTemplate
+from uk.co.ramp.gencfg.design import randint_ppf, choice_ppf
 
 
-class TracingPolicies(object):
+class TracingPolicies(ConfigTemplate):
     '''
     Generate tracingPolicies.json
     '''
@@ -35,6 +37,34 @@ class TracingPolicies(object):
             result['{}_recent_contacts_lookbacktime'.format(sta)] = random_state.randint(low=1, high=14)
         
         return result
+    
+    def columns(self):
+        result = ['alert_by_tested_positive']
+        for sta in TracingPolicies._virus_statuses:
+            result.append('{}_recent_contacts_lookbacktime'.format(sta))
+        return result
+    
+    def _sample(self, n):
+        random_state = self.random_state
+        result = OrderedDict()
+        
+        result['alert_by_tested_positive'] = random_state.choice([0, 1], size=n)
+        for sta in TracingPolicies._virus_statuses:
+            result['{}_recent_contacts_lookbacktime'.format(sta)] = random_state.randint(low=1, high=14, size=n)
+        
+        return result
+
+    def n_uniforms(self):
+        return 1 + len(TracingPolicies._virus_statuses)
+
+    def _from_uniform(self, U):
+        result = OrderedDict()
+        
+        result['alert_by_tested_positive'] = choice_ppf(U[:, 0], [0, 1])
+        for k, sta in enumerate(TracingPolicies._virus_statuses):
+            result['{}_recent_contacts_lookbacktime'.format(sta)] = randint_ppf(U[:, 1 + k], 1, 14)
+        
+        return result
         
     @classmethod
     def export(cls, param_dict):
@@ -0,0 +1,90 @@
+'''
+Choice of the trials of the adaptive sampling rounds by a surrogate meta model.
+'''
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor
+from uk.co.ramp.param.frontier import pareto_front
+from uk.co.ramp.param.metamodel import MultiOutputForest
+
+
+def round_sizes(n_simulations, n_rounds, initial_fraction=0.5):
+    """
+    Number of trials of the initial round drawn from the priors, followed by those of n_rounds adaptive rounds.
+    Every adaptive round has at least one trial.
+    """
+    if n_rounds == 0:
+        return [n_simulations]
+    n_initial = max(1, int(n_simulations * initial_fraction))
+    rest = n_simulations - n_initial
+    if n_rounds < 0 or n_rounds > rest:
+        raise ValueError('{} adaptive rounds cannot share the {} of {} simulations left after the initial round'.format(
+            n_rounds, rest, n_simulations))
+    return [n_initial] + [rest // n_rounds + (1 if r < rest % n_rounds else 0) for r in range(n_rounds)]
+
+
+def fit_surrogate(X, Y, n_estimators=100, min_samples_split=10, n_jobs=1, random_state=None):
+    """
+    Multi-output ExtraTrees on the standardised losses, whose trees give the spread of the predictions.
+    """
+    offset, scale = MultiOutputForest.standardise(Y)
+    forest = ExtraTreesRegressor(
+        n_estimators=n_estimators,
+        min_samples_split=min_samples_split,
+        n_jobs=n_jobs,
+        random_state=random_state)
+    forest.fit(X, (np.asarray(Y, dtype=np.float64) - offset) / scale)
+    return MultiOutputForest(forest, list(Y.columns), offset, scale)
+
+
+def tree_moments(model, X):
+    """
+    Mean and variance across trees of the standardised predictions, each of shape (n, n_outputs).
+    The trees are accumulated one by one, so that memory does not grow with the number of trees.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    s1 = np.zeros((X.shape[0], len(model.output_names)))
+    s2 = np.zeros_like(s1)
+    for estimator in model.forest.estimators_:
+        y = estimator.predict(X).reshape(s1.shape)
+        s1 += y
+        s2 += y ** 2
+    n_trees = len(model.forest.estimators_)
+    mean = s1 / n_trees
+    return mean, np.maximum(s2 / n_trees - mean ** 2, 0.0)
+
+
+def frontier_layers(scores):
+    """
+    Non-dominated layer of each row of scores (every column to be minimised), where 0 is the Pareto front,
+    1 is the front once layer 0 is removed, and so on.
+    """
+    n = scores.shape[0]
+    layer = np.full(n, -1, dtype=int)
+    remaining = np.arange(n)
+    depth = 0
+    while remaining.size > 0:
+        front = remaining[pareto_front(scores[remaining])]
+        layer[front] = depth
+        remaining = remaining[layer[remaining] < 0]
+        depth += 1
+    return layer
+
+
+def select_batch(model, X_pool, size, acquisition='variance', frontier_metrics=None):
+    """
+    Positions of size rows of X_pool to be simulated next.
+    'variance' takes the rows of the largest variance across trees, summed over the standardised losses.
+    'frontier' takes the rows closest to the Pareto front of the predicted frontier_metrics among the pool,
+    layer by layer, and the rows of larger variance first within a layer.
+    """
+    mean, var = tree_moments(model, X_pool)
+    spread = var.sum(axis=1)
+    if acquisition == 'variance':
+        order = np.argsort(-spread, kind='stable')
+    elif acquisition == 'frontier':
+        outputs = [model.output_index(metric) for metric in frontier_metrics]
+        layer = frontier_layers(mean[:, outputs])
+        order = np.lexsort((-spread, layer))
+    else:
+        raise ValueError('Acquisition must be either variance or frontier')
+    return np.sort(order[:size])
@@ -0,0 +1,86 @@
+'''
+Checkpoint of the finished trials of draw_parameters.py for --resume.
+'''
+import json
+import os
+from uk.co.ramp.param.store import SampleStore
+
+
+class SampleCheckpoint(object):
+    '''
+    Append-only record of the finished (parameters, losses) rows of draw_parameters.py.
+    Each row is appended to input_parameter_samples.csv and then to output_loss_samples.csv as soon as
+    its simulation finishes, so that a killed job loses at most the simulations running at that time.
+    A row counts as finished only when it is found in both files.
+    checkpoint.json records the settings that determine the random draws, and a resumed run must match them.
+    Other settings that determine the draws, such as those of adaptive sampling, are given as a dictionary.
+    '''
+
+    def __init__(self, workdir, job_name, seed, n_simulations, resume=False, settings=None):
+        self.X_file = '{}/input_parameter_samples.csv'.format(workdir)
+        self.Y_file = '{}/output_loss_samples.csv'.format(workdir)
+        self.manifest_file = '{}/checkpoint.json'.format(workdir)
+        self.manifest = {'job_name': job_name, 'seed': seed, 'n_simulations': n_simulations}
+        if settings is not None:
+            self.manifest.update(settings)
+        self.finished = set()  # index labels of the rows already recorded
+
+        if resume and os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as fin:
+                manifest = json.load(fin)
+            if manifest != self.manifest:
+                raise ValueError('Cannot resume {} recorded as {}'.format(self.manifest, manifest))
+            self._recover()
+        else:
+            for filename in [self.X_file, self.Y_file]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            with open(self.manifest_file, 'w') as fout:
+                json.dump(self.manifest, fout, sort_keys=True, indent=2)
+        # The CSV files are the tables to be read until they are converted into another format
+        store = SampleStore(workdir, 'csv')
+        for name in ['input_parameter_samples', 'output_loss_samples']:
+            store.record(name)
+
+    def _read_lines(self, filename):
+        """
+        Header and rows of a CSV file, where a row without the trailing newline was cut off while being written.
+        """
+        if not os.path.exists(filename):
+            return None, []
+        with open(filename, 'r') as fin:
+            lines = fin.read().split('\n')
+        lines = [line + '\n' for line in lines[:-1]]
+        if len(lines) == 0:
+            return None, []
+        return lines[0], lines[1:]
+
+    def _recover(self):
+        """
+        Keep the rows found in both files, dropping a row whose write was interrupted.
+        Kept rows are written back as they are, so that the float values are not rounded by parsing.
+        """
+        X_header, X_lines = self._read_lines(self.X_file)
+        Y_header, Y_lines = self._read_lines(self.Y_file)
+        X_index = [line.split(',', 1)[0] for line in X_lines]
+        Y_index = [line.split(',', 1)[0] for line in Y_lines]
+        self.finished = set(X_index) & set(Y_index)
+        for filename, header, index, lines in [
+                (self.X_file, X_header, X_index, X_lines),
+                (self.Y_file, Y_header, Y_index, Y_lines)]:
+            with open(filename, 'w') as fout:
+                if header is not None and len(self.finished) > 0:
+                    fout.write(header)
+                    fout.writelines([line for i, line in zip(index, lines) if i in self.finished])
+
+    def append(self, X_row, Y_row):
+        """
+        Append DataFrames of the same index to the two files.
+        """
+        for row, filename in [(X_row, self.X_file), (Y_row, self.Y_file)]:
+            header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+            with open(filename, 'a') as fout:
+                row.to_csv(fout, header=header)
+                fout.flush()
+                os.fsync(fout.fileno())
+        self.finished.update(X_row.index)
@@ -0,0 +1,125 @@
+'''
+Tree ensembles saved as flat node arrays that processes memory-map and share.
+'''
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+_arrays = ['left', 'right', 'feature', 'threshold', 'value', 'roots']
+
+
+def save_forest(path, model, feature_columns):
+    """
+    Save a fitted tree ensemble of scikit-learn, or a MultiOutputForest, as a directory of flat node arrays
+    that MappedForest reads by memory maps.
+    The nodes of all trees are concatenated, and children are numbered across the trees, with -1 at leaves.
+    The directory appears at path only after all arrays are written.
+    """
+    forest = getattr(model, 'forest', model)
+    lefts, rights, features, thresholds, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        internal = tree.children_left >= 0
+        roots.append(offset)
+        lefts.append(np.where(internal, tree.children_left + offset, -1))
+        rights.append(np.where(internal, tree.children_right + offset, -1))
+        features.append(np.where(internal, tree.feature, 0))
+        thresholds.append(tree.threshold)
+        values.append(tree.value.reshape(tree.node_count, -1))
+        offset += tree.node_count
+    arrays = {
+        'left': np.concatenate(lefts).astype(np.int64),
+        'right': np.concatenate(rights).astype(np.int64),
+        'feature': np.concatenate(features).astype(np.int64),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'value': np.vstack(values).astype(np.float64),
+        'roots': np.array(roots, dtype=np.int64)}
+    meta = {
+        'feature_columns': list(feature_columns),
+        'n_outputs': int(arrays['value'].shape[1]),
+        'output_names': getattr(model, 'output_names', None),
+        'offset': np.asarray(model.offset).tolist() if hasattr(model, 'offset') else None,
+        'scale': np.asarray(model.scale).tolist() if hasattr(model, 'scale') else None}
+
+    tmp_path = '{}.tmp'.format(path)
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.mkdir(tmp_path)
+    for name in _arrays:
+        np.save('{}/{}.npy'.format(tmp_path, name), arrays[name])
+    with open('{}/meta.json'.format(tmp_path), 'w') as fout:
+        json.dump(meta, fout, indent=2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+class MappedForest(object):
+    '''
+    Read-only tree ensemble saved by save_forest, whose node arrays are memory-mapped,
+    so that worker processes loading the same model share one copy in the page cache.
+    Predictions equal those of the original model, as X is compared with the thresholds in float32 like scikit-learn.
+    A model saved from a MultiOutputForest predicts an array of shape (n, n_outputs) in the original scale,
+    and a single-output model predicts a vector.
+    '''
+
+    def __init__(self, path, mmap_mode='r'):
+        with open('{}/meta.json'.format(path), 'r') as fin:
+            meta = json.load(fin)
+        self.path = path
+        self.feature_columns = meta['feature_columns']
+        self.n_outputs = meta['n_outputs']
+        self.output_names = meta['output_names']
+        self.offset = None if meta['offset'] is None else np.array(meta['offset'])
+        self.scale = None if meta['scale'] is None else np.array(meta['scale'])
+        for name in _arrays:
+            setattr(self, name, np.load('{}/{}.npy'.format(path, name), mmap_mode=mmap_mode))
+
+    def output_index(self, metric):
+        return self.output_names.index(metric)
+
+    def _check_columns(self, X):
+        """
+        Array of X in the feature order of the model, where the columns of a DataFrame are matched by name.
+        """
+        if isinstance(X, pd.DataFrame):
+            missing = [col for col in self.feature_columns if col not in X.columns]
+            if len(missing) > 0:
+                raise ValueError('Columns {} of the model {} are missing'.format(missing, self.path))
+            if list(X.columns) != self.feature_columns:
+                X = X[self.feature_columns]
+            X = X.values
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_columns):
+            raise ValueError('The model {} expects {} features'.format(self.path, len(self.feature_columns)))
+        return X
+
+    def apply(self, X, tree):
+        """
+        Leaf node of each row of X in one tree, walking down all rows level by level.
+        Rows reaching a leaf drop out of the walk.
+        """
+        n, d = X.shape
+        flat = X.reshape(-1)
+        node = np.full(n, self.roots[tree], dtype=np.int64)
+        active = np.arange(n) if self.left[self.roots[tree]] >= 0 else np.zeros(0, dtype=np.int64)
+        while active.size > 0:
+            current = node[active]
+            go_left = flat[active * d + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            node[active] = current
+            active = active[self.left[current] >= 0]
+        return node
+
+    def predict(self, X):
+        X = self._check_columns(X)
+        result = np.zeros((X.shape[0], self.n_outputs))
+        for tree in range(len(self.roots)):
+            result += self.value[self.apply(X, tree)]
+        result /= len(self.roots)
+        if self.scale is not None:
+            result = result * self.scale + self.offset
+        return result[:, 0] if self.output_names is None and self.n_outputs == 1 else result
@@ -0,0 +1,46 @@
+'''
+Pareto fronts of the policy scores.
+'''
+import numpy as np
+
+
+def pareto_front(scores):
+    """
+    Rows of scores (an array of shape (n, d), every column to be minimised) that no other row dominates,
+    ordered by the first objective.
+    A row is dominated by another that is no worse in every objective, and of equal rows only the first is kept.
+    Two objectives take one sort and a running minimum. More objectives take one lexicographic sort
+    and a comparison of each row with the front found so far.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    n, d = scores.shape
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    # Sort by the objectives in order, and by the row number among equal rows
+    order = np.lexsort((np.arange(n),) + tuple(scores[:, j] for j in reversed(range(d))))
+    if d == 1:
+        return order[:1]
+    sorted_scores = scores[order]
+
+    if d == 2:
+        # Among rows of equal first objective, only the first (of the smallest second objective) can be on the front,
+        # and it is when its second objective is below those of all rows of smaller first objective.
+        first = np.ones(n, dtype=bool)
+        first[1:] = sorted_scores[1:, 0] != sorted_scores[:-1, 0]
+        candidates = order[first]
+        y = sorted_scores[first, 1]
+        previous_min = np.minimum.accumulate(np.concatenate([[np.inf], y[:-1]]))
+        return candidates[y < previous_min]
+
+    # The front is filled into a preallocated array, and each row is compared with the view of the rows found so far
+    front = np.empty(n, dtype=int)
+    front_scores = np.empty((n, d))
+    n_front = 0
+    for i, row in zip(order, sorted_scores):
+        # Rows sorted earlier can dominate this row, but not the other way round
+        if np.any(np.all(front_scores[:n_front] <= row, axis=1)):
+            continue
+        front[n_front] = i
+        front_scores[n_front] = row
+        n_front += 1
+    return front[:n_front]
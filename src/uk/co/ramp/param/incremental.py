@@ -0,0 +1,60 @@
+'''
+State of the incremental updates of the meta models of analyse_sensitivity.py.
+'''
+import json
+import os
+import zlib
+import numpy as np
+
+
+def hashed_test_mask(index, seed):
+    """
+    Test half of the incremental mode, chosen by a hash of each sample ID and the seed,
+    so that a sample stays in the same half however many samples are added.
+    """
+    return np.array([zlib.crc32('{}:{}'.format(seed, label).encode('utf-8')) % 2 == 1 for label in index], dtype=bool)
+
+
+class IncrementalState(object):
+    '''
+    Record of the incremental mode of analyse_sensitivity.py in incremental_state.json:
+    the sample IDs that the saved meta models have seen, the hyperparameters of each model,
+    and the reasons why models were refitted from scratch in the last run instead of being updated.
+    The record of another seed is ignored, as the halves of the samples depend on the seed.
+    '''
+
+    def __init__(self, workdir, seed):
+        self.state_file = '{}/incremental_state.json'.format(workdir)
+        self.seed = seed
+        self.seen = set()
+        self.models = {}  # model name -> {'ms': min_samples_split, 'mf': max_features}
+        self.refits = {}  # model name -> reason, of this run only
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as fin:
+                state = json.load(fin)
+            if state['seed'] == seed:
+                self.seen = set(state['seen'])
+                self.models = state['models']
+
+    def can_update(self, name, index):
+        """
+        Whether the model of the name can be grown on index, which must keep every sample seen before.
+        """
+        return name in self.models and len(self.seen) > 0 and self.seen.issubset(index)
+
+    def record(self, name, ms, mf):
+        self.models[name] = {'ms': int(ms), 'mf': mf}
+
+    def record_refit(self, name, reason):
+        self.refits[name] = reason
+
+    def save(self, index):
+        """
+        Record all samples of index as seen. The file is replaced atomically.
+        """
+        tmp_file = '{}.tmp'.format(self.state_file)
+        with open(tmp_file, 'w') as fout:
+            json.dump({
+                'seed': self.seed, 'seen': [str(label) for label in index], 'models': self.models, 'refits': self.refits},
+                fout)
+        os.replace(tmp_file, self.state_file)
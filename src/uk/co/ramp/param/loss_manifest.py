@@ -0,0 +1,73 @@
+'''
+Manifest of the losses recomputed from archived simulation outputs.
+'''
+import hashlib
+import json
+import os
+
+
+def _observed(metric):
+    if metric.type == 'ratio':
+        return [_observed(metric.numerator), _observed(metric.denominator)]
+    return metric.observed.tolist() if metric.type == 'dtw' else None
+
+
+def config_digest(registry):
+    """
+    Hash of the metric definitions of a LossRegistry and of the observed series of its DTW metrics,
+    which changes whenever a metric is added or redefined.
+    """
+    payload = [registry.definitions, [_observed(metric) for metric in registry.metrics]]
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def file_stamp(path, check='mtime'):
+    """
+    Fingerprint of a file, either its (mtime in ns, size) or the SHA-1 of its content.
+    """
+    if check == 'hash':
+        digest = hashlib.sha1()
+        with open(path, 'rb') as fin:
+            for block in iter(lambda: fin.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class LossManifest(object):
+    '''
+    Losses computed from the archived outputs of each sample, with the fingerprints of the output files they came from.
+    A sample is up to date when its files have the same fingerprints under the same metric definitions,
+    and the whole record is discarded when the definitions, the output file names or the check mode change.
+    The file is replaced atomically, so that an interrupted recompute keeps the samples saved before.
+    '''
+
+    def __init__(self, workdir, digest, names, files, check='mtime'):
+        self.manifest_file = '{}/loss_manifest.json'.format(workdir)
+        self.header = {'config': digest, 'names': list(names), 'files': list(files), 'check': check}
+        self.samples = {}  # index label -> {'stamps': fingerprints of files, 'losses': values}
+
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as fin:
+                manifest = json.load(fin)
+            if manifest.get('header') == self.header:
+                self.samples = manifest['samples']
+
+    def lookup(self, label, stamps):
+        """
+        Recorded losses of the sample, or None if its files changed since.
+        """
+        entry = self.samples.get(label)
+        if entry is None or entry['stamps'] != stamps:
+            return None
+        return entry['losses']
+
+    def update(self, label, stamps, losses):
+        self.samples[label] = {'stamps': stamps, 'losses': losses}
+
+    def save(self):
+        tmp_file = '{}.tmp'.format(self.manifest_file)
+        with open(tmp_file, 'w') as fout:
+            json.dump({'header': self.header, 'samples': self.samples}, fout)
+        os.replace(tmp_file, self.manifest_file)
@@ -0,0 +1,198 @@
+'''
+Meta models of the losses, their hyperparameter search, and the caches of their SHAP values.
+'''
+import numpy as np
+
+
+class MultiOutputForest(object):
+    '''
+    One tree ensemble that predicts all loss metrics at once.
+    The forest is fitted on standardised metrics, so that the split criterion does not favour
+    metrics of large scale, and predictions are returned in the original scale.
+    '''
+
+    def __init__(self, forest, output_names, offset, scale):
+        self.forest = forest
+        self.output_names = list(output_names)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def standardise(cls, Y):
+        """
+        Offset and scale of each column of Y, where constant columns are left unscaled.
+        """
+        Y = np.asarray(Y, dtype=np.float64)
+        offset = Y.mean(axis=0)
+        scale = Y.std(axis=0)
+        scale[scale == 0.0] = 1.0
+        return offset, scale
+
+    def predict(self, X):
+        """
+        Returns an array of shape (n, len(output_names)).
+        """
+        return self.forest.predict(X).reshape(-1, len(self.output_names)) * self.scale + self.offset
+
+    def output_index(self, metric):
+        return self.output_names.index(metric)
+
+
+def per_output_importances(forest, X, Y):
+    """
+    Impurity-based feature importances of a multi-output forest for each output separately.
+    The impurity of every node is re-evaluated per output by passing (X, Y) through the trees,
+    while feature_importances_ of scikit-learn averages the impurity decrease over the outputs.
+    Returns an array of shape (n_features, n_outputs) whose columns sum to one.
+    """
+    Y = np.asarray(Y, dtype=np.float64).reshape(X.shape[0], -1)
+    result = np.zeros((X.shape[1], Y.shape[1]))
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        path = estimator.decision_path(X)
+        count = np.asarray(path.sum(axis=0)).reshape(-1, 1)
+        s1 = path.T.dot(Y)
+        s2 = path.T.dot(Y ** 2)
+        # Sum of squared deviations from the node mean, which is the node impurity times the node size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            impurity = np.where(count > 0, s2 - s1 ** 2 / count, 0.0)
+        internal = tree.children_left >= 0
+        decrease = (
+            impurity[internal]
+            - impurity[tree.children_left[internal]]
+            - impurity[tree.children_right[internal]])
+        np.add.at(result, tree.feature[internal], decrease)
+    total = result.sum(axis=0)
+    total[total == 0.0] = 1.0
+    return result / total
+
+
+class SuccessiveHalving(object):
+    '''
+    Successive halving over hyperparameter configurations.
+    All configurations are first scored on a small random subset of the rows, and only the best 1/eta of them
+    are scored again on an eta-times larger subset, until the survivors are scored on all rows and the best one wins.
+    Subsets are nested prefixes of one seeded permutation of the rows.
+    Rounds that would score on the same number of rows, because of min_rows, are merged into one that keeps
+    the best 1/eta**k. When min_rows is not smaller than n_rows, every configuration is scored on all rows in one round,
+    as a grid search.
+    '''
+
+    def __init__(self, configs, n_rows, eta=3, min_rows=100):
+        self.configs = list(configs)
+        self.n_rows = n_rows
+        self.eta = eta
+        n_rounds = int(np.ceil(np.log(len(self.configs)) / np.log(eta))) if len(self.configs) > 1 and eta > 1 else 1
+        self.round_sizes = []
+        self.round_cuts = []  # number of 1/eta reductions after each round
+        for r in range(n_rounds):
+            size = int(min(n_rows, max(min_rows, np.ceil(n_rows / eta ** (n_rounds - 1 - r)))))
+            if len(self.round_sizes) > 0 and self.round_sizes[-1] == size:
+                self.round_cuts[-1] += 1
+            else:
+                self.round_sizes.append(size)
+                self.round_cuts.append(1)
+        self.round = 0
+        self.candidates = list(range(len(self.configs)))
+        self.best_index = None
+
+    @property
+    def finished(self):
+        return self.best_index is not None
+
+    @property
+    def best(self):
+        return self.configs[self.best_index]
+
+    def current_size(self):
+        return self.round_sizes[self.round]
+
+    def is_final(self):
+        """
+        Whether the current round scores on all rows, after which the best configuration is chosen.
+        """
+        return self.current_size() >= self.n_rows
+
+    def current(self):
+        """
+        Pairs of (index, configuration) to be scored in the current round.
+        """
+        return [(i, self.configs[i]) for i in self.candidates]
+
+    def report(self, scores):
+        """
+        Scores (smaller is better) of the current round, in the order of current().
+        Ties are broken by the order of configs.
+        """
+        order = sorted(range(len(self.candidates)), key=lambda j: (scores[j], self.candidates[j]))
+        if self.is_final():
+            self.best_index = self.candidates[order[0]]
+            return
+        n_keep = int(np.ceil(len(self.candidates) / self.eta ** self.round_cuts[self.round]))
+        self.candidates = sorted([self.candidates[j] for j in order[:n_keep]])
+        self.round += 1
+
+
+def subset_rows(n_rows, size, seed):
+    """
+    Positions of the first size rows in a seeded permutation, which are nested for increasing size.
+    """
+    return np.sort(np.random.RandomState(seed).permutation(n_rows)[:size])
+
+
+def grow_forest(model, n_estimators, n_jobs, X, y):
+    """
+    Add trees to a fitted forest by warm start, which gives the same trees as fitting n_estimators
+    trees from scratch by the same random_state.
+    Out-of-bag predictions of the smaller forest are discarded, since they are memory-consuming.
+    """
+    model.set_params(warm_start=True, n_estimators=n_estimators, oob_score=False, n_jobs=n_jobs)
+    model.fit(X, y)
+    model.set_params(warm_start=False)
+    for attr in ['oob_prediction_', 'oob_score_']:
+        if hasattr(model, attr):
+            delattr(model, attr)
+    return model
+
+
+def stratified_rows(y, max_rows, seed, n_strata=10):
+    """
+    Sorted positions of at most max_rows entries of y, drawn without replacement from n_strata quantile bins of y
+    in proportion to their sizes, so that the subsample keeps the tails of y.
+    All positions are returned when max_rows is 0 or not smaller than len(y).
+    """
+    y = np.asarray(y, dtype=np.float64).reshape(-1)
+    n = y.shape[0]
+    if max_rows <= 0 or max_rows >= n:
+        return np.arange(n)
+    random_state = np.random.RandomState(seed)
+    strata = np.array_split(np.argsort(y, kind='mergesort'), n_strata)
+    quota = np.array([len(stratum) for stratum in strata]) * max_rows / n
+    counts = np.floor(quota).astype(int)
+    # The rows left by rounding down go to the strata of the largest remainders
+    counts[np.argsort(counts - quota, kind='mergesort')[:max_rows - counts.sum()]] += 1
+    rows = [random_state.choice(stratum, size=count, replace=False) for stratum, count in zip(strata, counts)]
+    return np.sort(np.concatenate(rows))
+
+
+def save_shap(path, shap_values, index, columns, test_index, y_pred):
+    """
+    Cache the SHAP values of one metric on the rows index, together with the predictions y_pred of the whole test half
+    test_index, so that the plots can be drawn again without the model.
+    """
+    with open(path, 'wb') as fout:
+        np.savez(
+            fout,
+            shap_values=np.asarray(shap_values, dtype=np.float64),
+            index=np.asarray(index).astype(str),
+            columns=np.asarray(columns).astype(str),
+            test_index=np.asarray(test_index).astype(str),
+            y_pred=np.asarray(y_pred, dtype=np.float64))
+
+
+def load_shap(path):
+    """
+    Dictionary of the arrays saved by save_shap.
+    """
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
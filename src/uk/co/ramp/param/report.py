@@ -0,0 +1,134 @@
+'''
+PDF reports of the meta models drawn page by page from the cached SHAP values.
+'''
+import os
+import numpy as np
+import shap
+import matplotlib.pyplot as plt
+from uk.co.ramp.param.metamodel import load_shap
+from uk.co.ramp.param.store import SampleStore
+
+_cache = {}
+
+
+def report_data(workdir, metric):
+    """
+    Predictions and actual values of the test half, and the SHAP values with their rows of X, read once per process.
+    """
+    if (workdir, metric) not in _cache:
+        if workdir not in _cache:
+            store = SampleStore(workdir)
+            _cache[workdir] = (store.read('input_parameter_samples'), store.read('output_loss_samples'))
+        X, Y = _cache[workdir]
+        cache = load_shap('{}/{}.shap.npz'.format(workdir, metric))
+        _cache[(workdir, metric)] = {
+            'y_pred': cache['y_pred'],
+            'y_test': Y[metric].loc[cache['test_index']].values,
+            'shap_values': cache['shap_values'],
+            'X_shap': X.loc[cache['index'], [str(col) for col in cache['columns']]]}
+    return _cache[(workdir, metric)]
+
+
+def report_pages(workdir, metric):
+    """
+    Page names of the report: the forecast-vs-actual scatter, the SHAP summary, and one dependence plot per column.
+    """
+    with np.load('{}/{}.shap.npz'.format(workdir, metric)) as npz:
+        return ['forecast', 'summary'] + [str(col) for col in npz['columns']]
+
+
+def draw_page(workdir, metric, page, fast=False, max_points=5000, seed=1234):
+    """
+    Figure of one page. In the fast mode, the forecast scatter is binned into hexagons and the SHAP plots
+    show a random subsample of at most max_points rows, when there are more points.
+    """
+    data = report_data(workdir, metric)
+    if page == 'forecast':
+        fig = plt.figure(figsize=(6, 6))
+        if fast and len(data['y_pred']) > max_points:
+            plt.hexbin(data['y_pred'], data['y_test'], gridsize=60, bins='log', mincnt=1)
+        else:
+            plt.scatter(data['y_pred'], data['y_test'])
+        plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
+        plt.title('{}\nForecast by Meta-Model vs Actual Outcome by Simulator'.format(metric))
+        plt.xlabel('Forecast')
+        plt.ylabel('Actual')
+        return fig
+
+    shap_values = data['shap_values']
+    X_shap = data['X_shap']
+    if fast and shap_values.shape[0] > max_points:
+        rows = np.sort(np.random.RandomState(seed).choice(shap_values.shape[0], size=max_points, replace=False))
+        shap_values = shap_values[rows]
+        X_shap = X_shap.iloc[rows]
+    if page == 'summary':
+        fig = plt.figure(figsize=(12, 6))
+        shap.summary_plot(shap_values, X_shap, show=False, plot_size=(12, 6))
+        plt.subplots_adjust(left=0.28, bottom=0.12, right=0.98, top=0.92)
+        plt.title('Datapoint-specific Sensitivities to {}'.format(metric))
+        return fig
+
+    fig, ax = plt.subplots(figsize=(6, 6))
+    shap.dependence_plot(page, shap_values, X_shap, ax=ax, show=False)
+    plt.subplots_adjust(left=0.18, bottom=0.12, right=0.98, top=0.92)
+    plt.title('How Interaction with {} Affects {}'.format(page, metric))
+    return fig
+
+
+def page_file(workdir, metric, number):
+    return '{}/{}.pages/{:04d}.pdf'.format(workdir, metric, number)
+
+
+def draw_page_task(workdir, metric, page, number, fast, max_points, seed):
+    """
+    draw_page for a worker process, which renders the figure into a one-page PDF file and returns its path,
+    so that only the path is sent back to the main process.
+    """
+    fig = draw_page(workdir, metric, page, fast=fast, max_points=max_points, seed=seed)
+    path = page_file(workdir, metric, number)
+    fig.savefig(path, format='pdf')
+    plt.close(fig)
+    return path
+
+
+def submit_report(executor, workdir, metric, fast=False, max_points=5000, seed=1234):
+    """
+    Futures of the pages of one metric, in page order.
+    Each page is drawn and rendered as an independent one-page PDF by a worker process, to be merged by write_report.
+    The matplotlib backend of the workers must be chosen by the script before this module is imported.
+    """
+    try:
+        os.mkdir('{}/{}.pages'.format(workdir, metric))
+    except:
+        pass
+    return [
+        executor.submit(draw_page_task, workdir, metric, page, number, fast, max_points, seed)
+        for number, page in enumerate(report_pages(workdir, metric))]
+
+
+def write_report(workdir, metric, page_files):
+    """
+    Merge the one-page PDF files into {metric}.pdf by copying their pages, without rendering them again,
+    and remove the page files.
+    pypdf is imported here, so that the scripts that import this module run without it when no report is merged.
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        raise ImportError(
+            'Merging the pages of {}.pdf requires pypdf. The SHAP values are cached, '
+            'so render_report.py draws the reports again once pypdf is installed.'.format(metric))
+    writer = PdfWriter()
+    for path in page_files:
+        writer.append(path)
+    tmp_file = '{}/{}.pdf.tmp'.format(workdir, metric)
+    with open(tmp_file, 'wb') as fout:
+        writer.write(fout)
+    writer.close()
+    os.replace(tmp_file, '{}/{}.pdf'.format(workdir, metric))
+    for path in page_files:
+        os.remove(path)
+    try:
+        os.rmdir('{}/{}.pages'.format(workdir, metric))
+    except:
+        pass
@@ -0,0 +1,157 @@
+'''
+Sobol indices estimated on the predictions of a meta model.
+'''
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+
+def factor_groups(X, columns=None, joint_columns=()):
+    """
+    Groups of the positions of the columns of X that are resampled together as one factor, ordered by their first column.
+    These are the columns identical in every row, such as the isolation times of the simplified policies,
+    and each list in joint_columns of the names in columns that depend on each other,
+    such as the mean and max of a time distribution or the population shares that sum to one.
+    """
+    # Each column is labelled by the first column of its group
+    labels = []
+    seen = {}
+    for j in range(X.shape[1]):
+        labels.append(seen.setdefault(X[:, j].tobytes(), j))
+    if columns is not None:
+        positions = {col: j for j, col in enumerate(columns)}
+        for names in joint_columns:
+            merged = set(labels[positions[name]] for name in names if name in positions)
+            if len(merged) > 0:
+                labels = [min(merged) if label in merged else label for label in labels]
+    groups = OrderedDict()
+    for j, label in enumerate(labels):
+        groups.setdefault(label, []).append(j)
+    return list(groups.values())
+
+
+def chunk_rows(n_groups, n_features, n_outputs, max_bytes):
+    """
+    Number of base rows per chunk, such that the stacked inputs and predictions of a chunk fit into max_bytes.
+    """
+    per_row = (n_groups + 2) * (4 * n_features + 8 * 2 * n_outputs)
+    return max(1, int(max_bytes // per_row))
+
+
+def saltelli_design(X, groups, n_rows, random_state):
+    """
+    Inputs of one chunk in float32, stacked as the rows of A, of B, and of A with the columns of each group taken from B,
+    so that shape is ((len(groups) + 2) * n_rows, n_features).
+    Every group of A and B is drawn independently from the rows of X, which gives the product of the empirical marginals.
+    """
+    n, d = X.shape
+    A = np.empty((n_rows, d), dtype=np.float32)
+    B = np.empty((n_rows, d), dtype=np.float32)
+    for group in groups:
+        A[:, group] = X[random_state.randint(n, size=n_rows)[:, None], group]
+        B[:, group] = X[random_state.randint(n, size=n_rows)[:, None], group]
+    design = np.empty(((len(groups) + 2) * n_rows, d), dtype=np.float32)
+    design[:n_rows] = A
+    design[n_rows:2 * n_rows] = B
+    for i, group in enumerate(groups):
+        AB = design[(i + 2) * n_rows:(i + 3) * n_rows]
+        AB[:] = A
+        AB[:, group] = B[:, group]
+    return design
+
+
+def evaluate_chunk(predict, X, columns, groups, n_rows, random_state):
+    """
+    Predictions of shape (len(groups) + 2, n_rows, n_outputs) on the Saltelli design of one chunk drawn by random_state,
+    where predict takes a DataFrame of the columns. All rows of the chunk are predicted in one call.
+    """
+    design = saltelli_design(X, groups, n_rows, random_state)
+    f = np.asarray(predict(pd.DataFrame(design, columns=columns)), dtype=np.float64)
+    return f.reshape(len(groups) + 2, n_rows, -1)
+
+
+def weighted_sums(f, weights, shift=0.0):
+    """
+    Sums of the terms of the estimators over the base rows of predictions f of shape (n_groups + 2, n_rows, n_outputs)
+    under the row weights of shape (n_replicates, n_rows): 'n' of the weights, 'f' of f_A + f_B, 'f2' of f_A ** 2 + f_B ** 2,
+    and 'first' of (f_B - shift) * (f_AB - f_A) and 'total' of (f_A - f_AB) ** 2 / 2 of the groups,
+    of shape (n_replicates, n_groups, n_outputs). Any constant shift leaves the expectation of 'first' unchanged,
+    while a shift close to the mean of the predictions reduces its variance.
+    """
+    f_A, f_B, f_AB = f[0], f[1], f[2:]
+    return {
+        'n': weights.sum(axis=1),
+        'f': weights.dot(f_A + f_B),
+        'f2': weights.dot(f_A ** 2 + f_B ** 2),
+        'first': np.tensordot(weights, (f_B - shift) * (f_AB - f_A), axes=([1], [1])),
+        'total': np.tensordot(weights, 0.5 * (f_A - f_AB) ** 2, axes=([1], [1]))}
+
+
+def add_sums(chunks):
+    """
+    Weighted sums of all base rows from those of the chunks.
+    """
+    total = None
+    for sums in chunks:
+        total = dict(sums) if total is None else {key: total[key] + sums[key] for key in total}
+    return total
+
+
+def chunk_sums(f, n_bootstrap, random_state, block_rows=1 << 16):
+    """
+    Weighted sums of the predictions f of one chunk (see evaluate_chunk) for 1 + n_bootstrap replicates.
+    Replicate 0 weights every base row by one, which gives the indices.
+    The Poisson bootstrap replicates weight every base row by an independent Poisson(1) count drawn by random_state,
+    which gives their confidence intervals. The weights are drawn block by block, and only the sums leave the chunk,
+    so that no rows are kept across the chunks.
+    The first-order terms are centred by the mean prediction of the chunk.
+    """
+    n_rows = f.shape[1]
+    shift = f[:2].mean(axis=(0, 1))
+    blocks = []
+    for start in range(0, n_rows, block_rows):
+        stop = min(n_rows, start + block_rows)
+        weights = np.ones((1 + n_bootstrap, stop - start))
+        weights[1:] = random_state.poisson(1.0, size=(n_bootstrap, stop - start))
+        blocks.append(weighted_sums(f[:, start:stop], weights, shift))
+    return add_sums(blocks)
+
+
+def sobol_indices(sums):
+    """
+    First-order indices by the estimator of Saltelli et al. (2010) and total-effect indices by that of Jansen (1999)
+    of every replicate of the weighted sums. Returns two arrays of shape (n_replicates, n_groups, n_outputs).
+    """
+    n_weights = sums['n'][:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums['f'] / (2.0 * n_weights)
+        # Variance over the rows of both A and B
+        variance = sums['f2'] / (2.0 * n_weights) - mean ** 2
+        first = sums['first'] / n_weights[:, None] / variance[:, None, :]
+        total = sums['total'] / n_weights[:, None] / variance[:, None, :]
+    return first, total
+
+
+def indices_table(sums, columns, groups, output_names, confidence=0.95):
+    """
+    Long table of the first-order (S1) and total-effect (ST) indices with the percentile confidence intervals
+    of the bootstrap replicates of the sums, one row per pair of a column of X and an output,
+    where the columns of one group share the indices of the group.
+    """
+    first, total = sobol_indices(sums)
+    if first.shape[0] > 1:
+        q = [50.0 * (1.0 - confidence), 50.0 * (1.0 + confidence)]
+        bounds = list(np.nanpercentile(first[1:], q, axis=0)) + list(np.nanpercentile(total[1:], q, axis=0))
+    else:
+        bounds = [np.full(first.shape[1:], np.nan)] * 4
+    first, total = first[0], total[0]
+    rows = []
+    for i, group in enumerate(groups):
+        for j in group:
+            for k, output in enumerate(output_names):
+                rows.append([
+                    columns[j], output,
+                    first[i, k], bounds[0][i, k], bounds[1][i, k],
+                    total[i, k], bounds[2][i, k], bounds[3][i, k]])
+    return pd.DataFrame(
+        rows, columns=['parameter', 'metric', 'S1', 'S1_low', 'S1_high', 'ST', 'ST_low', 'ST_high'])
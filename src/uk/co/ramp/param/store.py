@@ -0,0 +1,335 @@
+'''
+Tables of samples in CSV, npy or Parquet files.
+'''
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+def _label_length(index):
+    return int(np.max(np.asarray(index.astype(str).str.len()), initial=0))
+
+
+def finite_samples(X, Y):
+    """
+    Rows of X and Y of the same labels in the order of X, leaving out the samples whose losses are not all finite,
+    such as those that recompute_losses.py failed to evaluate. Returns X, Y and the labels left out.
+    """
+    Y = Y.reindex(X.index)
+    finite = np.isfinite(Y.values.astype(np.float64)).all(axis=1)
+    return X[finite], Y[finite], X.index[~finite]
+
+
+class CSVTable(object):
+    '''
+    One CSV file whose first column is the index, which is also the export format for other tools.
+    '''
+
+    suffix = '.csv'
+
+    def read(self, path, columns=None):
+        # round_trip keeps the exact float values written by to_csv
+        result = pd.read_csv(path, index_col=0, float_precision='round_trip')
+        return result if columns is None else result[columns]
+
+    def write(self, path, df):
+        df.to_csv(path)
+
+    def writer(self, path, columns, n_rows=None, dtypes=None, index_name=None):
+        return CSVTableWriter(path, columns)
+
+    def columns(self, path):
+        return list(pd.read_csv(path, index_col=0, nrows=0).columns)
+
+    def n_rows(self, path):
+        with open(path, 'rb') as fin:
+            return max(sum(1 for _ in fin) - 1, 0)
+
+
+class CSVTableWriter(object):
+    '''
+    Append chunks to a CSV file, which appears at path only after close().
+    '''
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.tmp_path = '{}.tmp'.format(path)
+        self.columns = columns
+        self.fout = open(self.tmp_path, 'w')
+        self.header = True
+
+    def write(self, df):
+        df[self.columns].to_csv(self.fout, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.fout.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class NpyTable(object):
+    '''
+    Directory of one .npy file per column with index.npy and schema.json, so that each column can be
+    read alone or memory-mapped without parsing the others.
+    '''
+
+    suffix = '.npy'
+
+    def _schema(self, path):
+        with open('{}/schema.json'.format(path), 'r') as fin:
+            return json.load(fin)
+
+    def read_arrays(self, path, columns=None, mmap_mode='r'):
+        """
+        Index and a dictionary of column arrays, which are read-only memory maps by default.
+        """
+        schema = self._schema(path)
+        if columns is None:
+            columns = schema['columns']
+        index = np.load('{}/index.npy'.format(path))
+        arrays = {col: np.load('{}/{}.npy'.format(path, schema['columns'].index(col)), mmap_mode=mmap_mode) for col in columns}
+        return index, arrays
+
+    def read(self, path, columns=None):
+        schema = self._schema(path)
+        if columns is None:
+            columns = schema['columns']
+        index, arrays = self.read_arrays(path, columns=columns, mmap_mode=None)
+        result = pd.DataFrame(arrays, index=pd.Index(index, name=schema['index_name']), columns=columns)
+        return result
+
+    def write(self, path, df):
+        index_length = max(64, _label_length(df.index))
+        writer = NpyTableWriter(
+            path, list(df.columns), df.shape[0], dtypes=list(df.dtypes), index_name=df.index.name, index_length=index_length)
+        writer.write(df)
+        writer.close()
+
+    def writer(self, path, columns, n_rows=None, dtypes=None, index_name=None):
+        if n_rows is None:
+            raise ValueError('The number of rows must be known in advance to write {}'.format(path))
+        return NpyTableWriter(path, columns, n_rows, dtypes=dtypes, index_name=index_name)
+
+    def columns(self, path):
+        return self._schema(path)['columns']
+
+    def n_rows(self, path):
+        return self._schema(path)['n_rows']
+
+
+class NpyTableWriter(object):
+    '''
+    Fill an NpyTable of a known number of rows chunk by chunk through memory maps.
+    The table appears at path only after close().
+    '''
+
+    def __init__(self, path, columns, n_rows, dtypes=None, index_name=None, index_length=64):
+        self.path = path
+        self.tmp_path = '{}.tmp'.format(path)
+        self.columns = columns
+        self.n_rows = n_rows
+        self.offset = 0
+        self.index_name = index_name
+        if dtypes is None:
+            dtypes = [np.dtype('float64')] * len(columns)
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.mkdir(self.tmp_path)
+        self.index = np.lib.format.open_memmap(
+            '{}/index.npy'.format(self.tmp_path), mode='w+', dtype='<U{}'.format(index_length), shape=(n_rows,))
+        self.arrays = [
+            np.lib.format.open_memmap('{}/{}.npy'.format(self.tmp_path, j), mode='w+', dtype=dtype, shape=(n_rows,))
+            for j, dtype in enumerate(dtypes)]
+
+    def write(self, df):
+        n = df.shape[0]
+        if self.offset + n > self.n_rows:
+            raise ValueError('More rows than {} are written to {}'.format(self.n_rows, self.path))
+        if _label_length(df.index) > self.index.dtype.itemsize // 4:
+            raise ValueError('Index label is longer than {} characters'.format(self.index.dtype.itemsize // 4))
+        self.index[self.offset:self.offset + n] = df.index.values.astype(str)
+        for col, array in zip(self.columns, self.arrays):
+            array[self.offset:self.offset + n] = df[col].values
+        self.offset += n
+
+    def close(self):
+        if self.offset != self.n_rows:
+            raise ValueError('{} rows are written to {} while {} are expected'.format(self.offset, self.path, self.n_rows))
+        for array in [self.index] + self.arrays:
+            array.flush()
+        del self.index
+        del self.arrays
+        with open('{}/schema.json'.format(self.tmp_path), 'w') as fout:
+            json.dump({
+                'columns': self.columns,
+                'index_name': self.index_name,
+                'n_rows': self.n_rows}, fout, indent=2)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp_path, self.path)
+
+
+class ParquetTable(object):
+    '''
+    One Parquet file, available when pandas finds pyarrow or fastparquet.
+    '''
+
+    suffix = '.parquet'
+
+    def read(self, path, columns=None):
+        return pd.read_parquet(path, columns=columns)
+
+    def write(self, path, df):
+        df.to_parquet(path)
+
+    def writer(self, path, columns, n_rows=None, dtypes=None, index_name=None):
+        return ParquetTableWriter(path, columns)
+
+    def columns(self, path):
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(path)
+        index_columns = schema.pandas_metadata['index_columns'] if schema.pandas_metadata is not None else []
+        return [col for col in schema.names if col not in index_columns]
+
+    def n_rows(self, path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+
+
+class ParquetTableWriter(object):
+    '''
+    Append chunks as row groups of a Parquet file, which appears at path only after close().
+    Every chunk must have the same dtypes.
+    '''
+
+    def __init__(self, path, columns):
+        import pyarrow.parquet as pq
+        self.pq = pq
+        self.path = path
+        self.tmp_path = '{}.tmp'.format(path)
+        self.columns = columns
+        self.writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df[self.columns], preserve_index=True)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.tmp_path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class StoreWriter(object):
+    '''
+    Writer of a table that records its format in samples.json once the table is closed.
+    '''
+
+    def __init__(self, store, name, writer):
+        self.store = store
+        self.name = name
+        self.writer = writer
+
+    def write(self, df):
+        self.writer.write(df)
+
+    def close(self):
+        self.writer.close()
+        self.store.record(self.name)
+
+
+class SampleStore(object):
+    '''
+    Tables of samples, such as input_parameter_samples and output_loss_samples, under one work directory.
+    Writing uses the format given at construction, and records it per table in samples.json.
+    Reading uses the recorded format, or the most recently modified table among the formats
+    when no table of the name is recorded, as in work directories written before samples.json.
+    '''
+
+    formats = {
+        'csv': CSVTable(),
+        'npy': NpyTable(),
+        'parquet': ParquetTable()}
+
+    def __init__(self, workdir, fmt='csv'):
+        if fmt not in SampleStore.formats:
+            raise ValueError('Sample format must be one of {}'.format(list(SampleStore.formats.keys())))
+        self.workdir = workdir
+        self.fmt = fmt
+
+    def path(self, name, fmt=None):
+        fmt = self.fmt if fmt is None else fmt
+        return '{}/{}{}'.format(self.workdir, name, SampleStore.formats[fmt].suffix)
+
+    def _record_file(self):
+        return '{}/samples.json'.format(self.workdir)
+
+    def _records(self):
+        if not os.path.exists(self._record_file()):
+            return {}
+        with open(self._record_file(), 'r') as fin:
+            return json.load(fin)
+
+    def record(self, name, fmt=None):
+        """
+        Record the format of the table of the name as the one to be read. The file is replaced atomically.
+        """
+        records = self._records()
+        records[name] = self.fmt if fmt is None else fmt
+        tmp_file = '{}.tmp'.format(self._record_file())
+        with open(tmp_file, 'w') as fout:
+            json.dump(records, fout, sort_keys=True, indent=2)
+        os.replace(tmp_file, self._record_file())
+
+    def find(self, name):
+        """
+        Format of the table of the name recorded in samples.json, or else of the most recently modified table,
+        or None if no table exists.
+        """
+        recorded = self._records().get(name)
+        if recorded is not None and os.path.exists(self.path(name, recorded)):
+            return recorded
+        found = [(os.path.getmtime(self.path(name, fmt)), fmt) for fmt in SampleStore.formats.keys() if os.path.exists(self.path(name, fmt))]
+        if len(found) == 0:
+            return None
+        return max(found)[1]
+
+    def exists(self, name):
+        return self.find(name) is not None
+
+    def _table(self, name):
+        fmt = self.find(name)
+        if fmt is None:
+            raise FileNotFoundError('No table of {} under {}'.format(name, self.workdir))
+        return SampleStore.formats[fmt], self.path(name, fmt)
+
+    def read(self, name, columns=None):
+        table, path = self._table(name)
+        return table.read(path, columns=columns)
+
+    def columns(self, name):
+        table, path = self._table(name)
+        return table.columns(path)
+
+    def n_rows(self, name):
+        table, path = self._table(name)
+        return table.n_rows(path)
+
+    def write(self, name, df):
+        SampleStore.formats[self.fmt].write(self.path(name), df)
+        self.record(name)
+
+    def writer(self, name, columns, n_rows=None, dtypes=None, index_name=None):
+        """
+        Writer of a table chunk by chunk through write(df) and close().
+        The npy format requires n_rows, and dtypes are also fixed at the construction of its writer.
+        """
+        return StoreWriter(
+            self, name,
+            SampleStore.formats[self.fmt].writer(self.path(name), columns, n_rows=n_rows, dtypes=dtypes, index_name=index_name))
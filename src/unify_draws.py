@@ -1,49 +1,162 @@
 """Concatenating the CSV files of random parameter and output draws.
+Directories are merged one by one into the output, so that the values of only a few directories are in memory at once,
+while the sample IDs of all directories are kept to find duplicated rows.
+Directories with broken or inconsistent files are reported in unify_report.csv and skipped,
+as are directories listed more than once, and rows whose sample ID was already merged are dropped.
 
 Usage:
-  unify_draws.py <DIRLIST_FILE> <OUTPUT_DIR>
+  unify_draws.py <DIRLIST_FILE> <OUTPUT_DIR> [--sample-format=<fmt>] [--n-jobs=<njobs>]
   unify_draws.py (-h | --help)
   unify_draws.py --version
 
 Options:
   -h --help                       Show this screen.
   --version                       Show version.
-  
+  --sample-format=<fmt>           Format of the unified sample files, either csv, npy or parquet [default: csv].
+  --n-jobs=<njobs>                Number of directories read at once [default: 4].
+
 """
 
 import os
 import sys
 import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from docopt import docopt
 from os.path import dirname, realpath
 sys.path.append(dirname(realpath(__file__)))
+from uk.co.ramp.param.store import SampleStore
+
+sample_names = ['input_parameter_samples', 'output_loss_samples']
+
+
+def read_samples(indir):
+    store = SampleStore(indir)
+    return [store.read(name) for name in sample_names]
+
+
+def inspect_samples(indir):
+    """
+    Read the samples of one directory, and summarise them without keeping the values.
+    Errors are returned as a message instead of being raised.
+    """
+    try:
+        X, Y = read_samples(indir)
+    except Exception as e:
+        return {'dir': indir, 'error': '{}: {}'.format(type(e).__name__, e)}
+    return {
+        'dir': indir,
+        'error': None,
+        'columns': [list(X.columns), list(Y.columns)],
+        'dtypes': [X.dtypes, Y.dtypes],
+        'n_rows': max(X.shape[0], Y.shape[0]),
+        # Rows are complete only when both tables have them
+        'index': X.index[X.index.isin(Y.index)]}
+
+
+def imap_bounded(executor, func, iterable, n_pending):
+    """
+    Ordered map that keeps at most n_pending results in memory.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= n_pending:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
+def unify(dirlist, output_dir, sample_format='csv', n_jobs=4):
+    """
+    Merge the samples of the directories in dirlist into output_dir, and return the report of every directory
+    as a DataFrame of status ('ok', 'partial', 'failed' or 'skipped'), the number of merged rows and a message.
+    """
+    try:
+        os.mkdir(output_dir)
+    except:
+        pass
+
+    # First pass: check the schema and the sample IDs of every directory
+    report = []
+    keep = []  # (directory, index of the rows to be merged) in the order of dirlist
+    columns = None
+    dtypes = None
+    seen = set()
+    visited = set()
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for summary in imap_bounded(executor, inspect_samples, dirlist, 2 * n_jobs):
+            indir = summary['dir']
+            if realpath(indir) in visited:
+                report.append((indir, 'skipped', 0, 'Listed more than once'))
+                continue
+            visited.add(realpath(indir))
+            if summary['error'] is not None:
+                report.append((indir, 'failed', 0, summary['error']))
+                continue
+            if columns is None:
+                reference_dir = indir
+                columns = summary['columns']
+                dtypes = [dict(dt) for dt in summary['dtypes']]
+            if [set(cols) for cols in summary['columns']] != [set(cols) for cols in columns]:
+                report.append((indir, 'failed', 0, 'Columns differ from those of {}'.format(reference_dir)))
+                continue
+            for dt_all, dt in zip(dtypes, summary['dtypes']):
+                for col, dtype in dt.items():
+                    if dtype != dt_all[col]:
+                        dt_all[col] = np.dtype('float64')
+
+            index = summary['index']
+            n_incomplete = summary['n_rows'] - len(index)
+            index = index[~index.duplicated() & ~index.isin(seen)]
+            n_duplicated = summary['n_rows'] - n_incomplete - len(index)
+            seen.update(index)
+            keep.append((indir, index))
+            if n_incomplete + n_duplicated > 0:
+                report.append((indir, 'partial', len(index), '{} incomplete and {} duplicated rows are dropped'.format(n_incomplete, n_duplicated)))
+            else:
+                report.append((indir, 'ok', len(index), ''))
+    del seen
+
+    # Second pass: append the kept rows directory by directory
+    if columns is not None:
+        n_rows = int(np.sum([len(index) for _, index in keep]))
+        store = SampleStore(output_dir, sample_format)
+        writers = [
+            store.writer(name, cols, n_rows=n_rows, dtypes=[dt[col] for col in cols])
+            for name, cols, dt in zip(sample_names, columns, dtypes)]
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            kept_dirs = [indir for indir, _ in keep]
+            for (indir, index), samples in zip(keep, imap_bounded(executor, read_samples, kept_dirs, 2 * n_jobs)):
+                for writer, df, cols, dt in zip(writers, samples, columns, dtypes):
+                    # .loc returns every row of a duplicated label, of which only the first is kept
+                    df = df[~df.index.duplicated()]
+                    writer.write(df.loc[index, cols].astype({col: dt[col] for col in cols}))
+        for writer in writers:
+            writer.close()
+
+    report = pd.DataFrame(report, columns=['dir', 'status', 'n_rows', 'message']).set_index('dir')
+    report.to_csv('{}/unify_report.csv'.format(output_dir))
+    return report
+
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='0.0.1')
-    
+
     def _getopt(key, default):
         return args[key] if key in args and args[key] is not None else default
 
     input_file = _getopt('<DIRLIST_FILE>', None)
     output_dir = _getopt('<OUTPUT_DIR>', None)
-    try:
-        os.mkdir(output_dir)
-    except:
-        pass
-    
+    sample_format = _getopt('--sample-format', 'csv')
+    n_jobs = int(_getopt('--n-jobs', 4))
+
     with open(input_file, "r") as fin:
-        dirlist = fin.read().splitlines()
-    
-    X = []
-    Y = []
-    for indir in dirlist:
-        X_i = pd.read_csv('{}/input_parameter_samples.csv'.format(indir), index_col=0)
-        Y_i = pd.read_csv('{}/output_loss_samples.csv'.format(indir), index_col=0)
-        X.append(X_i)
-        Y.append(Y_i)
-    X = pd.concat(X, axis=0)
-    Y = pd.concat(Y, axis=0)
-    
-    X.to_csv('{}/input_parameter_samples.csv'.format(output_dir))
-    Y.to_csv('{}/output_loss_samples.csv'.format(output_dir))
+        dirlist = [line for line in fin.read().splitlines() if len(line.strip()) > 0]
+
+    report = unify(dirlist, output_dir, sample_format, n_jobs)
+    for status in ['ok', 'partial', 'failed', 'skipped']:
+        print('{} directories are {}'.format(np.sum(report['status'] == status), status))
+    for indir, row in report[report['status'] != 'ok'].iterrows():
+        print('{}: {} ({})'.format(indir, row['status'], row['message']))
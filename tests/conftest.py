@@ -0,0 +1,3 @@
+import sys
+from os.path import dirname, realpath
+sys.path.append('{}/../src'.format(dirname(realpath(__file__))))
@@ -0,0 +1,17 @@
+'''
+Sizes of the adaptive rounds of draw_parameters.py.
+'''
+import pytest
+from uk.co.ramp.param.adaptive import round_sizes
+
+
+def test_round_sizes():
+    assert round_sizes(1000, 0) == [1000]
+    assert round_sizes(10, 3) == [5, 2, 2, 1]
+    assert round_sizes(3, 2) == [1, 1, 1]
+
+
+@pytest.mark.parametrize('n_simulations, n_rounds', [(3, 5), (1, 1), (10, -1)])
+def test_empty_rounds_are_rejected(n_simulations, n_rounds):
+    with pytest.raises(ValueError):
+        round_sizes(n_simulations, n_rounds)
@@ -0,0 +1,46 @@
+'''
+Jobs of a pool under the budget of threads of analyse_sensitivity.py.
+'''
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uk.co.ramp.exec.budget import ThreadBudget
+
+
+def test_running_jobs_stay_within_budget():
+    lock = threading.Lock()
+    in_use = [0, 0]
+
+    def job(threads):
+        with lock:
+            in_use[0] += threads
+            in_use[1] = max(in_use[1], in_use[0])
+        time.sleep(0.02)
+        with lock:
+            in_use[0] -= threads
+        return threads
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        budget = ThreadBudget(executor, 4)
+        futures = [budget.submit(job, 1) for _ in range(3)]
+        # Only the thread left free is granted to a job that asks for 4
+        futures.append(budget.submit_threads(lambda threads: executor.submit(job, threads), 4))
+        futures += [budget.submit(job, 1) for _ in range(3)]
+        futures.append(budget.submit_threads(lambda threads: executor.submit(job, threads), 4))
+        while budget.wait():
+            pass
+    assert all(future.done() for future in futures)
+    assert futures[3].result() == 1
+    assert in_use[1] <= 4
+
+
+def test_exceptions_are_passed_to_futures():
+    def fail():
+        raise ValueError('failed job')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        budget = ThreadBudget(executor, 2)
+        future = budget.submit(fail)
+        while budget.wait():
+            pass
+    assert isinstance(future.exception(), ValueError)
@@ -0,0 +1,31 @@
+'''
+Draws of the gencfg samplers by the designs of draw_parameters.py.
+'''
+from collections import OrderedDict
+from uk.co.ramp.gencfg.design import draw_design
+from uk.co.ramp.gencfg.disease import DiseaseSettings
+from uk.co.ramp.gencfg.population import PopulationSettings
+from uk.co.ramp.gencfg.isolation_policies import IsolationPolicies
+from uk.co.ramp.gencfg.tracing_policies import TracingPolicies
+
+
+def generators(seed):
+    return OrderedDict([
+        ('populationSettings', PopulationSettings(random_state=seed)),
+        ('diseaseSettings', DiseaseSettings(random_state=seed)),
+        ('isolationPolicies', IsolationPolicies(random_state=seed, simplified=True)),
+        ('tracingPolicies', TracingPolicies(random_state=seed))])
+
+
+def test_sequential_design_follows_next():
+    designs = draw_design(generators(1234), 7, design='sequential')
+    for name, generator in generators(1234).items():
+        expected = [generator.export(generator.next()) for _ in range(7)]
+        assert [generator.export(record) for record in generator.records(designs[name])] == expected
+
+
+def test_random_design_is_reproducible():
+    first = draw_design(generators(1234), 7)
+    second = draw_design(generators(1234), 7)
+    for name in first:
+        assert first[name].equals(second[name])
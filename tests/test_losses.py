@@ -0,0 +1,18 @@
+'''
+Scans of the compartment time-series for the loss metrics.
+'''
+import pytest
+from uk.co.ramp.exec.losses import scan_compartments
+
+
+@pytest.mark.parametrize('buffer_size', [1 << 16, 64])
+def test_scan_compartments_with_padded_header(tmpdir, buffer_size):
+    # buffer_size=64 makes the file larger than the buffer, so that it is parsed by pandas in chunks
+    path = str(tmpdir.join('Compartments.csv'))
+    with open(path, 'w') as fout:
+        fout.write('time, s, sev, d, r\n')
+        for t in range(20):
+            fout.write('{}, {}, {}, {}, {}\n'.format(t, 20 - t, (7 * t) % 11, t, 2 * t))
+    max_values, last_values = scan_compartments(path, buffer_size=buffer_size, chunk_rows=8)
+    assert max_values == {'sev': 10}
+    assert last_values == {'d': 19, 'r': 38}
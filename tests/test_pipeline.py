@@ -0,0 +1,111 @@
+'''
+Scheduling and caching of the stages by run_pipeline.
+'''
+import os
+import sys
+import pytest
+from uk.co.ramp.exec.pipeline import LocalExecutor, Stage, run_pipeline
+
+
+def copy_stage(name, source, target, deps=(), calls=None):
+    """
+    Stage of a function that copies the file source into target, counting its calls by name.
+    """
+    def copy():
+        if calls is not None:
+            calls.append(name)
+        with open(source, 'r') as fin, open(target, 'w') as fout:
+            fout.write(fin.read())
+    copy.__name__ = 'copy'
+    return Stage(name, function=copy, deps=deps, inputs=[source], outputs=[target])
+
+
+def write(path, text):
+    with open(path, 'w') as fout:
+        fout.write(text)
+
+
+@pytest.fixture
+def chain(tmpdir):
+    """
+    Stages a -> b, where a copies in.txt into a.txt and b copies a.txt into b.txt.
+    """
+    write(str(tmpdir.join('in.txt')), 'x')
+    calls = []
+
+    def stages():
+        return [
+            copy_stage('a', str(tmpdir.join('in.txt')), str(tmpdir.join('a.txt')), calls=calls),
+            copy_stage('b', str(tmpdir.join('a.txt')), str(tmpdir.join('b.txt')), deps=['a'], calls=calls)]
+    return stages, calls, str(tmpdir.join('cache'))
+
+
+def test_current_stages_are_skipped(chain):
+    stages, calls, cache_dir = chain
+    assert run_pipeline(stages(), cache_dir, LocalExecutor()) == {'a': 'done', 'b': 'done'}
+    assert run_pipeline(stages(), cache_dir, LocalExecutor()) == {'a': 'skipped', 'b': 'skipped'}
+    assert calls == ['a', 'b']
+
+
+def test_changed_input_reruns_dependent_stages(chain, tmpdir):
+    stages, calls, cache_dir = chain
+    run_pipeline(stages(), cache_dir, LocalExecutor())
+    write(str(tmpdir.join('in.txt')), 'y')
+    assert run_pipeline(stages(), cache_dir, LocalExecutor()) == {'a': 'done', 'b': 'done'}
+    assert tmpdir.join('b.txt').read() == 'y'
+
+
+def test_stage_with_unchanged_outputs_keeps_dependents_current(chain, tmpdir):
+    stages, calls, cache_dir = chain
+    run_pipeline(stages(), cache_dir, LocalExecutor())
+    assert run_pipeline(stages(), cache_dir, LocalExecutor(), force=['a']) == {'a': 'done', 'b': 'skipped'}
+
+
+def test_changed_output_reruns_the_stage(chain, tmpdir):
+    stages, calls, cache_dir = chain
+    run_pipeline(stages(), cache_dir, LocalExecutor())
+    write(str(tmpdir.join('b.txt')), 'edited')
+    assert run_pipeline(stages(), cache_dir, LocalExecutor()) == {'a': 'skipped', 'b': 'done'}
+    assert tmpdir.join('b.txt').read() == 'x'
+
+
+def test_dry_run_runs_nothing(chain, tmpdir):
+    stages, calls, cache_dir = chain
+    assert run_pipeline(stages(), cache_dir, LocalExecutor(), dry_run=True) == {'a': 'stale', 'b': 'stale'}
+    assert calls == []
+    assert not tmpdir.join('a.txt').exists()
+
+
+def test_failed_stage_cancels_dependents(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    write(str(tmpdir.join('in.txt')), 'x')
+    stages = [
+        Stage('fail', command=[sys.executable, '-c', 'import sys; print("broken"); sys.exit(3)']),
+        copy_stage('after', str(tmpdir.join('in.txt')), str(tmpdir.join('after.txt')), deps=['fail']),
+        copy_stage('later', str(tmpdir.join('in.txt')), str(tmpdir.join('later.txt')), deps=['after']),
+        copy_stage('other', str(tmpdir.join('in.txt')), str(tmpdir.join('other.txt')))]
+    status = run_pipeline(stages, cache_dir, LocalExecutor(), n_jobs=2)
+    assert status == {'fail': 'failed', 'after': 'cancelled', 'later': 'cancelled', 'other': 'done'}
+    assert 'broken' in open(os.path.join(cache_dir, 'fail.log')).read()
+    # A failed stage is not recorded, and runs again
+    assert run_pipeline(stages, cache_dir, LocalExecutor())['fail'] == 'failed'
+
+
+def test_exception_of_function_fails_the_stage(tmpdir):
+    def broken():
+        raise IOError('disk full')
+    status = run_pipeline([Stage('broken', function=broken)], str(tmpdir.join('cache')), LocalExecutor())
+    assert status == {'broken': 'failed'}
+
+
+def test_cyclic_deps_are_rejected(tmpdir):
+    stages = [
+        Stage('a', function=lambda: None, deps=['b']),
+        Stage('b', function=lambda: None, deps=['a'])]
+    with pytest.raises(ValueError):
+        run_pipeline(stages, str(tmpdir.join('cache')), LocalExecutor())
+
+
+def test_unknown_dep_is_rejected(tmpdir):
+    with pytest.raises(ValueError):
+        run_pipeline([Stage('a', function=lambda: None, deps=['missing'])], str(tmpdir.join('cache')), LocalExecutor())
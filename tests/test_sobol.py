@@ -0,0 +1,103 @@
+'''
+Sobol indices of the Ishigami function, whose indices are known analytically.
+'''
+import numpy as np
+import pandas as pd
+from uk.co.ramp.param.sobol import (
+    add_sums, chunk_sums, evaluate_chunk, factor_groups, indices_table, saltelli_design, sobol_indices)
+
+a = 7.0
+b = 0.1
+# Sobol and Homma (1996) for the inputs uniform on [-pi, pi]
+variance = a ** 2 / 8.0 + b * np.pi ** 4 / 5.0 + b ** 2 * np.pi ** 8 / 18.0 + 0.5
+first_exact = np.array([
+    0.5 * (1.0 + b * np.pi ** 4 / 5.0) ** 2 / variance,
+    a ** 2 / 8.0 / variance,
+    0.0])
+total_exact = np.array([
+    (0.5 * (1.0 + b * np.pi ** 4 / 5.0) ** 2 + 8.0 * b ** 2 * np.pi ** 8 / 225.0) / variance,
+    a ** 2 / 8.0 / variance,
+    8.0 * b ** 2 * np.pi ** 8 / 225.0 / variance])
+
+
+def ishigami(X):
+    X = np.asarray(X, dtype=np.float64)
+    return (np.sin(X[:, 0]) + a * np.sin(X[:, 1]) ** 2 + b * X[:, 2] ** 4 * np.sin(X[:, 0])).reshape(-1, 1)
+
+
+def samples(n=20000, seed=0):
+    return np.random.RandomState(seed).uniform(-np.pi, np.pi, size=(n, 3))
+
+
+def test_ishigami_indices():
+    X = samples()
+    groups = factor_groups(X)
+    random_state = np.random.RandomState(1)
+    sums = chunk_sums(evaluate_chunk(ishigami, X, ['x1', 'x2', 'x3'], groups, 50000, random_state), 0, random_state)
+    first, total = sobol_indices(sums)
+    assert first.shape == (1, 3, 1)
+    np.testing.assert_allclose(first[0, :, 0], first_exact, atol=0.03)
+    np.testing.assert_allclose(total[0, :, 0], total_exact, atol=0.03)
+
+
+def test_chunks_are_combined():
+    X = samples(2000)
+    groups = factor_groups(X)
+    f = [evaluate_chunk(ishigami, X, ['x1', 'x2', 'x3'], groups, 1000, np.random.RandomState(seed)) for seed in [1, 2]]
+    # Blocks smaller than the chunks are summed as well
+    sums = add_sums([chunk_sums(f_chunk, 5, np.random.RandomState(0), block_rows=300) for f_chunk in f])
+    first, total = sobol_indices(sums)
+    assert first.shape == (6, 3, 1)
+    # Estimators on all predictions at once, where f_B of the first-order terms is centred per chunk
+    f_B_centred = np.concatenate([f_chunk[1] - f_chunk[:2].mean(axis=(0, 1)) for f_chunk in f])
+    f = np.concatenate(f, axis=1)
+    f_A, f_B, f_AB = f[0], f[1], f[2:]
+    var = np.concatenate([f_A, f_B]).var(axis=0)
+    np.testing.assert_allclose(first[0], (f_B_centred * (f_AB - f_A)).mean(axis=1) / var, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(total[0], 0.5 * ((f_A - f_AB) ** 2).mean(axis=1) / var, rtol=1e-8, atol=1e-10)
+
+
+def test_indices_do_not_depend_on_offset():
+    X = samples(2000)
+    groups = factor_groups(X)
+    f = evaluate_chunk(ishigami, X, ['x1', 'x2', 'x3'], groups, 5000, np.random.RandomState(1))
+    first, total = sobol_indices(chunk_sums(f, 0, np.random.RandomState(2)))
+    first_offset, total_offset = sobol_indices(chunk_sums(f + 1000.0, 0, np.random.RandomState(2)))
+    np.testing.assert_allclose(first_offset, first, atol=1e-6)
+    np.testing.assert_allclose(total_offset, total, atol=1e-6)
+
+
+def test_bootstrap_intervals_cover_exact_indices():
+    X = samples()
+    groups = factor_groups(X)
+    random_state = np.random.RandomState(3)
+    sums = chunk_sums(evaluate_chunk(ishigami, X, ['x1', 'x2', 'x3'], groups, 20000, random_state), 50, random_state)
+    table = indices_table(sums, ['x1', 'x2', 'x3'], groups, ['y'])
+    assert list(table['parameter']) == ['x1', 'x2', 'x3']
+    assert (table['S1_low'] <= table['S1']).all() and (table['S1'] <= table['S1_high']).all()
+    # Allowing for the sampling error of the empirical marginals
+    assert (table['ST_low'] - 0.02 <= total_exact).all() and (total_exact <= table['ST_high'] + 0.02).all()
+
+
+def test_identical_columns_are_resampled_together():
+    X = samples(100)
+    X = np.column_stack([X, X[:, 1]])
+    groups = factor_groups(X)
+    assert groups == [[0], [1, 3], [2]]
+    design = saltelli_design(X, groups, 10, np.random.RandomState(0))
+    assert design.shape == (50, 4)
+    np.testing.assert_array_equal(design[:, 1], design[:, 3])
+
+
+def test_dependent_columns_are_resampled_together():
+    # A maximum drawn as the mean plus a difference, and shares that sum to one
+    random_state = np.random.RandomState(0)
+    mean = random_state.randint(3, 10, size=100)
+    shares = random_state.dirichlet([1.0, 2.0, 3.0], size=100)
+    X = np.column_stack([mean, mean + random_state.randint(5, 10, size=100), shares, random_state.rand(100)])
+    columns = ['t_mean', 't_max', 'p0', 'p1', 'p2', 'x']
+    groups = factor_groups(X, columns, [['t_mean', 't_max'], ['p0', 'p1', 'p2']])
+    assert groups == [[0, 1], [2, 3, 4], [5]]
+    design = saltelli_design(X, groups, 10, random_state)
+    assert (design[:, 1] - design[:, 0] >= 5).all()
+    np.testing.assert_allclose(design[:, 2:5].sum(axis=1), 1.0, rtol=1e-6)
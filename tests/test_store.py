@@ -0,0 +1,79 @@
+'''
+Round trips of the sample tables through SampleStore, and the choice of the format to be read.
+'''
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from uk.co.ramp.param.store import SampleStore, finite_samples
+
+
+def samples(n=5):
+    random_state = np.random.RandomState(0)
+    return pd.DataFrame(
+        {'a': random_state.rand(n), 'b': random_state.randint(10, size=n)},
+        index=pd.Index(['job.sample{}'.format(i) for i in range(n)], name='sample'))
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'npy', 'parquet'])
+def test_write_and_read(tmpdir, fmt):
+    if fmt == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            pytest.skip('pyarrow is not available')
+    df = samples()
+    store = SampleStore(str(tmpdir), fmt)
+    store.write('input_parameter_samples', df)
+    assert store.find('input_parameter_samples') == fmt
+    assert store.columns('input_parameter_samples') == ['a', 'b']
+    assert store.n_rows('input_parameter_samples') == 5
+    result = store.read('input_parameter_samples')
+    pd.testing.assert_frame_equal(result, df, check_dtype=False, check_index_type=False)
+    # Floats are kept exactly, including by CSV
+    np.testing.assert_array_equal(result['a'].values, df['a'].values)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'npy'])
+def test_writer_in_chunks(tmpdir, fmt):
+    df = samples(7)
+    store = SampleStore(str(tmpdir), fmt)
+    writer = store.writer('output_loss_samples', ['a', 'b'], n_rows=7, dtypes=list(df.dtypes), index_name='sample')
+    writer.write(df.iloc[:3])
+    assert store.find('output_loss_samples') is None
+    writer.write(df.iloc[3:])
+    writer.close()
+    result = SampleStore(str(tmpdir)).read('output_loss_samples')
+    pd.testing.assert_frame_equal(result, df, check_dtype=False, check_index_type=False)
+
+
+def test_recorded_format_wins_over_mtime(tmpdir):
+    df = samples()
+    SampleStore(str(tmpdir), 'csv').write('input_parameter_samples', df.iloc[:2])
+    SampleStore(str(tmpdir), 'npy').write('input_parameter_samples', df)
+    # An old CSV file whose timestamp ties with or even exceeds that of the table written last
+    stamp = os.path.getmtime(SampleStore(str(tmpdir), 'npy').path('input_parameter_samples'))
+    os.utime(SampleStore(str(tmpdir), 'csv').path('input_parameter_samples'), (stamp + 1, stamp + 1))
+    assert SampleStore(str(tmpdir)).find('input_parameter_samples') == 'npy'
+    assert SampleStore(str(tmpdir)).n_rows('input_parameter_samples') == 5
+
+
+def test_newest_table_without_record(tmpdir):
+    df = samples()
+    SampleStore(str(tmpdir), 'csv').write('input_parameter_samples', df)
+    SampleStore(str(tmpdir), 'npy').write('input_parameter_samples', df.iloc[:2])
+    os.remove('{}/samples.json'.format(tmpdir))
+    stamp = os.path.getmtime(SampleStore(str(tmpdir), 'npy').path('input_parameter_samples'))
+    os.utime(SampleStore(str(tmpdir), 'csv').path('input_parameter_samples'), (stamp + 1, stamp + 1))
+    assert SampleStore(str(tmpdir)).find('input_parameter_samples') == 'csv'
+    assert SampleStore(str(tmpdir)).find('output_loss_samples') is None
+
+
+def test_samples_without_finite_losses_are_left_out():
+    X = samples(4)
+    Y = pd.DataFrame({'loss': [1.0, np.nan, np.inf, 4.0]}, index=X.index[::-1])
+    X_finite, Y_finite, dropped = finite_samples(X, Y)
+    assert list(X_finite.index) == ['job.sample0', 'job.sample3']
+    assert list(Y_finite.index) == list(X_finite.index)
+    assert list(Y_finite['loss']) == [4.0, 1.0]
+    assert sorted(dropped) == ['job.sample1', 'job.sample2']
@@ -0,0 +1,63 @@
+'''
+Merge of the samples of several job directories by unify_draws.py.
+'''
+import pandas as pd
+import pytest
+from unify_draws import unify
+from uk.co.ramp.param.store import SampleStore
+
+
+def job_dir(tmpdir, name, labels, y_labels=None):
+    path = tmpdir.mkdir(name)
+    index = pd.Index(labels, name='sample')
+    pd.DataFrame({'x': [float(i) for i in range(len(labels))]}, index=index).to_csv(str(path.join('input_parameter_samples.csv')))
+    y_index = index if y_labels is None else pd.Index(y_labels, name='sample')
+    pd.DataFrame({'y': [10.0 * i for i in range(len(y_index))]}, index=y_index).to_csv(str(path.join('output_loss_samples.csv')))
+    return str(path)
+
+
+def test_duplicated_rows_are_dropped(tmpdir):
+    a = job_dir(tmpdir, 'a', ['s0', 's1', 's2'])
+    b = job_dir(tmpdir, 'b', ['s2', 's3'])
+    report = unify([a, b], str(tmpdir.join('out')), n_jobs=2)
+    X = SampleStore(str(tmpdir.join('out'))).read('input_parameter_samples')
+    Y = SampleStore(str(tmpdir.join('out'))).read('output_loss_samples')
+    assert list(X.index) == ['s0', 's1', 's2', 's3']
+    assert list(Y.index) == list(X.index)
+    # s2 is kept from the first directory
+    assert X.loc['s2', 'x'] == 2.0
+    assert list(report['status']) == ['ok', 'partial']
+    assert list(report['n_rows']) == [3, 1]
+
+
+def test_directory_listed_twice_is_merged_once(tmpdir):
+    a = job_dir(tmpdir, 'a', ['s0', 's1'])
+    b = job_dir(tmpdir, 'b', ['s2'])
+    report = unify([a, b, a + '/'], str(tmpdir.join('out')), n_jobs=2)
+    X = SampleStore(str(tmpdir.join('out'))).read('input_parameter_samples')
+    assert list(X.index) == ['s0', 's1', 's2']
+    assert list(report['status']) == ['ok', 'ok', 'skipped']
+
+
+def test_incomplete_and_broken_directories(tmpdir):
+    a = job_dir(tmpdir, 'a', ['s0', 's1', 's2'], y_labels=['s0', 's1'])
+    broken = str(tmpdir.mkdir('broken'))
+    report = unify([a, broken], str(tmpdir.join('out')), n_jobs=1)
+    X = SampleStore(str(tmpdir.join('out'))).read('input_parameter_samples')
+    assert list(X.index) == ['s0', 's1']
+    assert list(report['status']) == ['partial', 'failed']
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'npy'])
+def test_duplicated_label_in_one_directory(tmpdir, fmt):
+    a = job_dir(tmpdir, 'a', ['s0', 's1', 's1', 's2'])
+    b = job_dir(tmpdir, 'b', ['s3'])
+    report = unify([a, b], str(tmpdir.join('out')), sample_format=fmt, n_jobs=1)
+    X = SampleStore(str(tmpdir.join('out'))).read('input_parameter_samples')
+    Y = SampleStore(str(tmpdir.join('out'))).read('output_loss_samples')
+    assert list(X.index) == ['s0', 's1', 's2', 's3']
+    assert list(Y.index) == list(X.index)
+    # The first of the duplicated rows is kept
+    assert X.loc['s1', 'x'] == 1.0
+    assert list(report['status']) == ['partial', 'ok']
+    assert list(report['n_rows']) == [3, 1]